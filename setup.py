@@ -67,6 +67,7 @@ setup(
     packages=['torsionfit', 'torsionfit.tests', 'torsionfit.qmscan', 'torsionfit.backends', 'torsionfit.database'],
     package_data={'': package_files('torsionfit/tests/reference')},
     zip_safe=False,
+    entry_points={'console_scripts': ['torsionfit = torsionfit.cli:main']},
     install_requires=[
         'numpy',
         'mdtraj',
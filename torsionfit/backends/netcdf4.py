@@ -12,6 +12,7 @@ try:
 except ImportError:
     import pickle
 import codecs
+from torsionfit import profiling
 
 __all__ = ['Trace', 'Database']
 
@@ -53,11 +54,11 @@ class Trace(base.Trace):
                 chain = 0
             elif chain == -1:
                 chain = range(self.db.chains)[chain]
-            arr = self.db.ncfile['Chain#%d' % chain][self.name][:]
+            arr = self.db.ncfile['Chain#%d' % chain][self.name][:self.db.nsamples(chain)]
         elif chain is None:
-            arr = self.db.ncfile['Chain#0'][self.name][:]
+            arr = self.db.ncfile['Chain#0'][self.name][:self.db.nsamples(0)]
             for i in range(self.db.chains)[1:]:
-                arr = np.append(arr, self.db.ncfile['Chain#%d' % i][self.name][:])
+                arr = np.append(arr, self.db.ncfile['Chain#%d' % i][self.name][:self.db.nsamples(i)])
 
         if slicing is None:
             slicing = slice(burn, None, thin)
@@ -79,10 +80,13 @@ class Trace(base.Trace):
         """
         :param chain: int or None
             The chain index. If None return all chains. default is last chain
-        :return: int length of chain
+        :return: int length of chain. Uses the length of the variable without reading the samples
         """
-
-        return len(self.gettrace(chain=chain))
+        if chain is None:
+            return sum(self.length(i) for i in range(self.db.chains))
+        if chain < 0:
+            chain = range(self.db.chains)[chain]
+        return min(len(self.db.ncfile['Chain#%d' % chain][self.name]), self.db.nsamples(chain))
 
 
 class Database(base.Database):
@@ -108,6 +112,7 @@ class Database(base.Database):
         self._traces = {} # dictionary of trace objects
         self.__Trace__ = Trace
         self._chains ={} # dictionary of states for each chain
+        self._resume_chain = None
 
         # check if database exists
         db_exists = os.path.exists(self.dbname)
@@ -144,6 +149,10 @@ class Database(base.Database):
 
     def _initialize(self, funs_to_tally, length=None):
 
+        if self._resume_chain is not None:
+            self._initialize_resumed(funs_to_tally)
+            return
+
         for name, fun in six.iteritems(funs_to_tally):
             if name not in self._traces:
                 self._traces[name] = self.__Trace__(name=name, getfunc=fun, db=self)
@@ -177,8 +186,52 @@ class Database(base.Database):
             except IndexError:
                 self.trace_names.append(list(funs_to_tally.keys()))
         self.tally_index = len(self.ncfile['Chain#%d' % self.chains].dimensions['nsamples'])
+        self.ncfile['Chain#%d' % self.chains].setncattr('valid_samples', self.tally_index)
         self.chains += 1
 
+    def _initialize_resumed(self, funs_to_tally):
+        """ Reattach the traces of the chain selected with resume_chain. Tallying continues at self.tally_index"""
+
+        chain = self._resume_chain
+        group = self.ncfile['Chain#%d' % chain]
+        for name, fun in six.iteritems(funs_to_tally):
+            if name not in self._traces:
+                self._traces[name] = self.__Trace__(name=name, getfunc=fun, db=self)
+            self._traces[name]._initialize()
+        self.trace_names[chain] = [name for name in funs_to_tally if name in group.variables]
+        self._resume_chain = None
+
+    def resume_chain(self, length=None):
+        """ Continue tallying into the last chain on the next call to _initialize instead of creating a new group.
+
+        :param length: int
+            Number of samples of the last chain to keep. Samples tallied after the checkpoint will be overwritten.
+            Default None keeps all samples.
+        """
+        if self.chains == 0:
+            raise ValueError("Database {} has no chain to resume".format(self.dbname))
+        chain = self.chains - 1
+        self._resume_chain = chain
+        nsamples = len(self.ncfile['Chain#%d' % chain].dimensions['nsamples'])
+        if length is None:
+            self.tally_index = nsamples
+        else:
+            self.tally_index = min(int(length), nsamples)
+        # samples after the checkpoint stay in the file until they are overwritten but are not part of the chain
+        self.ncfile['Chain#%d' % chain].setncattr('valid_samples', self.tally_index)
+
+    def nsamples(self, chain=-1):
+        """ Number of valid samples of chain. A chain resumed from a checkpoint can have more samples in the file that
+        were tallied after the checkpoint before the run was interrupted.
+
+        :param chain: int
+        :return: int
+        """
+        group = self.ncfile['Chain#%d' % range(self.chains)[chain]]
+        if 'valid_samples' in group.ncattrs():
+            return int(group.getncattr('valid_samples'))
+        return len(group.dimensions['nsamples'])
+
     def connect_model(self, model):
         """Link the Database to the Model instance.
         In case a new database is created from scratch, ``connect_model``
@@ -217,6 +270,7 @@ class Database(base.Database):
                 if name not in self._traces:
                     self._traces[name] = self.__Trace__(name=name, getfunc=fun, db=self)
 
+    @profiling.timed('netcdf4.tally')
     def tally(self, chain=-1):
         """Append the current value of all tallyable object.
        :Parameters:
@@ -240,8 +294,16 @@ Error:
                 self.trace_names[chain].remove(name)
 
         self.tally_index += 1
+        self.ncfile['Chain#%d' % chain].setncattr('valid_samples', self.tally_index)
 
+    @profiling.timed('netcdf4.savestate')
     def savestate(self, state, chain=-1):
+        """ Save pickled state of sampler and step methods. The state is overwritten every time it is saved and the file
+        is synced so the state on disk matches the samples tallied so far.
+
+        :param state: dict
+        :param chain: int
+        """
 
         self._state_ = state
 
@@ -252,7 +314,9 @@ Error:
         # save pickled state in ncvar in group for current chain
         if 'state' not in self.ncfile['Chain#%d' % chain].variables:
             self.ncfile['Chain#%d' % chain].createVariable('state', str, ('state',))
-            self.ncfile['Chain#%d' % chain]['state'][0] = state_pickle
+        self.ncfile['Chain#%d' % chain]['state'][0] = state_pickle
+        self._chains[chain] = state
+        self.ncfile.sync()
 
     def getstate(self, chain=-1):
 
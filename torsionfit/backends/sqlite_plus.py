@@ -36,6 +36,8 @@ import sqlite3
 from pymc.database import base, pickle, ram
 import os
 import codecs
+from torsionfit.utils import decode_multiplicity_bitstring
+from torsionfit import profiling
 
 try:
     import cPickle as pickle
@@ -132,21 +134,33 @@ class Trace(base.Trace):
     def __getitem__(self, index):
         chain = self._chain
 
+        # Slices that start after the first sample (the new tail of a growing trace) skip the rows before the start
+        offset = 0
+        if isinstance(index, slice) and index.start is not None and index.start > 0 and \
+                (index.step is None or index.step > 0) and (index.stop is None or index.stop >= 0):
+            offset = index.start
+            index = slice(0, None if index.stop is None else max(index.stop - offset, 0), index.step)
+
         if chain is None:
-            self.db.cur.execute('SELECT * FROM [%s]' % self.name)
+            self.db.cur.execute('SELECT * FROM [%s] ORDER BY recid LIMIT -1 OFFSET %d' % (self.name, offset))
             trace = self.db.cur.fetchall()
         else:
             # Deal with negative chains (starting from the end)
             if chain < 0:
                 chain = range(self.db.chains)[chain]
             self.db.cur.execute(
-                'SELECT * FROM [%s] WHERE trace=%s' %
-                (self.name, chain))
+                'SELECT * FROM [%s] WHERE trace=%s ORDER BY recid LIMIT -1 OFFSET %d' %
+                (self.name, chain, offset))
             trace = self.db.cur.fetchall()
 
+        if not trace:
+            return np.zeros((0,) + tuple(self._shape or ()))[index]
         trace = np.array(trace)[:, 2:]
         if len(self._shape) > 1:
             trace = trace.reshape(-1, *self._shape)
+        elif offset and trace.shape[1] == 1:
+            # a tail of a single sample keeps its sample axis
+            trace = trace[:, 0]
         else:
             trace = np.squeeze(trace)
 
@@ -156,8 +170,14 @@ class Trace(base.Trace):
 
     def length(self, chain=-1):
         """Return the sample length of given chain. If chain is None,
-        return the total length of all chains."""
-        return len(self.gettrace(chain=chain))
+        return the total length of all chains. Counts the rows without reading the samples."""
+        if chain is None:
+            self.db.cur.execute('SELECT COUNT(*) FROM [%s]' % self.name)
+        else:
+            if chain < 0:
+                chain = range(self.db.chains)[chain]
+            self.db.cur.execute('SELECT COUNT(*) FROM [%s] WHERE trace=%s' % (self.name, chain))
+        return self.db.cur.fetchone()[0]
 
 
 class Database(base.Database):
@@ -190,7 +210,9 @@ class Database(base.Database):
         self.DB = sqlite3.connect(dbname, check_same_thread=False)
         self.cur = self.DB.cursor()
 
-        existing_tables = get_table_list(self.cur)
+        self._resume_chain = None
+
+        existing_tables = [name for name in get_table_list(self.cur) if name != 'state']
         if existing_tables:
             # Get number of existing chains
             self.cur.execute(
@@ -199,7 +221,7 @@ class Database(base.Database):
             self.chains = self.cur.fetchall()[0][0] + 1
             self.trace_names = self.chains * [existing_tables, ]
             # Get state for each chain
-            rows = self.cur.execute("SELECT * FROM state")
+            rows = self.cur.execute("SELECT * FROM state") if 'state' in get_table_list(self.cur) else []
             for row in rows:
                 try:
                     self._chains[row[0]] = pickle.loads(row[1], encoding='latin1')
@@ -208,6 +230,7 @@ class Database(base.Database):
         else:
             self.chains = 0
 
+    @profiling.timed('sqlite_plus.commit')
     def commit(self):
         """Commit updates to database"""
         self.DB.commit()
@@ -231,10 +254,15 @@ class Database(base.Database):
 # SQL enough to do that without having to read too much SQL documentation
 # for my taste.
 # A quick and dirty savestate was added by Chaya D. Stern April 2016
+    @profiling.timed('sqlite_plus.savestate')
     def savestate(self, state, chain=-1):
         """Store a dictionary containing the state of the Sampler and its
         StepMethods. Stores pickled dictionary in a sqlite table. Each row is the state for the chain with that
-        index"""
+        index.
+
+        The state row of the chain is replaced and committed together with all samples tallied since the last call, so
+        a checkpoint on disk always matches the traces stored with it. pymc calls this every `save_interval`
+        iterations when `save_interval` is passed to `MCMC.sample`."""
 
         self._state = state
 
@@ -247,14 +275,54 @@ class Database(base.Database):
 
         # pickle state
         chain = range(self.chains)[chain]
-        #state_pickle = codecs.encode(pickle.dumps(state), "base64")
         state_pickle = pickle.dumps(state)
 
         binary = sqlite3.Binary(state_pickle)
-        #text = sqlite3.
 
-        # insert into SQL table
+        # replace state of this chain in SQL table. Older databases don't have a unique key on chain so delete first.
+        self.cur.execute("DELETE FROM state WHERE chain=?", (chain,))
         self.cur.execute("INSERT INTO state VALUES(?, ?)", (chain, binary))
+        self._chains[chain] = state
+
+        # Commit samples and state in one transaction
+        self.commit()
+
+    def resume_chain(self, length=None):
+        """
+        Continue tallying into the last chain on the next call to `_initialize` instead of starting a new chain.
+
+        Parameters
+        ----------
+        length : int
+            Number of samples of the last chain to keep. Samples that were tallied after the checkpoint are deleted.
+            Default None keeps all samples.
+        """
+        if self.chains == 0:
+            raise ValueError("Database {} has no chain to resume".format(self.dbname))
+        chain = self.chains - 1
+        self._resume_chain = chain
+        if length is None:
+            return
+        for name in get_table_list(self.cur):
+            if name == 'state':
+                continue
+            self.cur.execute('DELETE FROM [%s] WHERE trace=%s AND recid NOT IN '
+                             '(SELECT recid FROM [%s] WHERE trace=%s ORDER BY recid LIMIT %s)' %
+                             (name, chain, name, chain, int(length)))
+        self.commit()
+
+    def _initialize(self, funs_to_tally, length=None):
+        """Initialize the tallyable objects. If `resume_chain` was called, the traces of the last chain are reused."""
+        if self._resume_chain is None:
+            return base.Database._initialize(self, funs_to_tally, length)
+
+        chain = self._resume_chain
+        for name, fun in funs_to_tally.items():
+            if name not in self._traces:
+                self._traces[name] = self.__Trace__(name=name, getfunc=fun, db=self)
+            self._traces[name]._initialize(chain, length)
+        self.trace_names[chain] = list(funs_to_tally.keys())
+        self._resume_chain = None
 
     def getstate(self, chain=-1):
 
@@ -304,21 +372,15 @@ class Database(base.Database):
         Returns
         -------
         multiplicity_trace: dict
-            Dictionary of multiplicities mapped to list of 0 and 1.
+            Dictionary of multiplicities mapped to np.array of 0 and 1.
 
         """
         multiplicities = (1, 2, 3, 4, 6)
         if n5:
             multiplicities = (1, 2, 3, 4, 5, 6)
-        multiplicity_trace = {}
         key = '{}_{}_{}_{}_multiplicity_bitstring'.format(key[0], key[1], key[2], key[3])
-        for m in multiplicities:
-            multiplicity_trace[str(m)] = []
-            for i in self.trace(key)[:]:
-                if 2**(m-1) & int(i):
-                    multiplicity_trace[str(m)].append(1)
-                else:
-                    multiplicity_trace[str(m)].append(0)
+        decoded = decode_multiplicity_bitstring(self.trace(key)[:], multiplicities)
+        multiplicity_trace = {str(m): decoded[:, i] for i, m in enumerate(multiplicities)}
         return multiplicity_trace
 
 
@@ -344,7 +406,7 @@ def load(dbname):
         chains = max(chains, db.cur.fetchall()[0][0] + 1)
 
     db.chains = chains
-    db.trace_names = chains * [tables, ]
+    db.trace_names = [[name for name in tables if name != 'state'] for _ in range(chains)]
     db._state_ = {}
     return db
 
@@ -0,0 +1,396 @@
+"""
+Benchmarks of torsionfit with synthetic workloads
+
+Synthetic QMDataBases are alkane-like chains built on the ToyModel parameters (toy.str). Interior carbons cycle through
+copies of the CG321 atom type so the number of torsion types can be varied independently of the number of atoms. Every
+benchmark varies one of atoms, frames, torsion types and fragments around a base workload and times
+
+    build_phis          QMDataBase.build_phis
+    model               TorsionFitModel construction (including the inner sums)
+    torsion_energy      one evaluation of the torsion_energy deterministic after new Ks are proposed
+    mm_energy           one QMDataBase.compute_energy with new torsion parameters (OpenMM)
+    update_param        one update_param_from_sample of all fitted torsions from a model's current values
+    logging             1000 debug messages that are not emitted (logging overhead in hot loops)
+    sample              one MCMC iteration with the sqlite_plus backend (tally and commit included)
+    trace_read          reading every trace of the sampled database
+    parse_psi4_out      parsing the reference psi4 scan
+
+Results are written as JSON so runs of different versions can be compared with `compare`.
+
+Example:
+    python -m torsionfit.benchmarks -o torsionfit-0.1.json
+    python -m torsionfit.benchmarks --compare torsionfit-0.1.json torsionfit-0.2.json
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import sys
+import json
+import time
+import copy
+import shutil
+import platform
+import tempfile
+import argparse
+import numpy as np
+from torsionfit.tests.utils import get_fun
+
+BASE = {'n_atoms': 16, 'n_frames': 96, 'n_types': 2, 'n_frags': 2}
+SCALING = {'n_atoms': [4, 16, 64],
+           'n_frames': [24, 96, 384],
+           'n_types': [1, 2, 4],
+           'n_frags': [1, 2, 4]}
+QUICK_SCALING = {'n_atoms': [4, 8], 'n_frames': [12, 24], 'n_types': [1, 2], 'n_frags': [1, 2]}
+
+
+def synthetic_parameters(n_types):
+    """
+    ToyModel parameters with n_types copies of the CG321 atom type (CG321, CX1, CX2, ...)
+
+    :param n_types: int
+    :return: parmed.charmm.CharmmParameterSet
+    """
+    from parmed.charmm import CharmmParameterSet
+    from parmed.topologyobjects import DihedralType, DihedralTypeList, NoUreyBradley
+
+    param = CharmmParameterSet(get_fun('toy.str'))
+    types = ['CG321'] + ['CX{}'.format(i) for i in range(1, n_types)]
+    for t in types[1:]:
+        atom_type = copy.copy(param.atom_types['CG321'])
+        atom_type.name = t
+        param.atom_types[t] = atom_type
+    bond = param.bond_types[('CG321', 'CG321')]
+    end_bond = param.bond_types[('CG321', 'CG331')]
+    angle = param.angle_types[('CG321', 'CG321', 'CG331')]
+    urey_bradley = param.urey_bradley_types.get(('CG321', 'CG321', 'CG331'), NoUreyBradley)
+    for t1 in types:
+        param.bond_types[(t1, 'CG331')] = param.bond_types[('CG331', t1)] = end_bond
+        for t2 in types:
+            param.bond_types[(t1, t2)] = bond
+    for t1 in types + ['CG331']:
+        for t2 in types:
+            for t3 in types + ['CG331']:
+                param.angle_types[(t1, t2, t3)] = angle
+                param.urey_bradley_types[(t1, t2, t3)] = urey_bradley
+    for t1 in types + ['CG331']:
+        for t2 in types:
+            for t3 in types:
+                for t4 in types + ['CG331']:
+                    if (t1, t2, t3, t4) in param.dihedral_types:
+                        continue
+                    dihedral = DihedralTypeList()
+                    dihedral.append(DihedralType(0.2, 3, 0.0))
+                    param.dihedral_types[(t1, t2, t3, t4)] = param.dihedral_types[(t4, t3, t2, t1)] = dihedral
+    return param
+
+
+def synthetic_structure(n_atoms, n_types, resname='SYN'):
+    """
+    Linear chain of n_atoms carbons with CG331 ends and interior carbons cycling through n_types atom types
+
+    :param n_atoms: int. at least 4
+    :param n_types: int
+    :param resname: str. Residue name (the name of the offset of the fragment in the model)
+    :return: parmed.charmm.CharmmPsfFile
+    """
+    import parmed
+    from parmed.charmm import CharmmPsfFile
+
+    if n_atoms < 4:
+        raise ValueError("A chain needs at least 4 atoms")
+    types = ['CG321'] + ['CX{}'.format(i) for i in range(1, n_types)]
+    structure = CharmmPsfFile()
+    for i in range(n_atoms):
+        atom_type = 'CG331' if i in (0, n_atoms - 1) else types[(i - 1) % n_types]
+        atom = parmed.Atom(name='C{}'.format(i + 1), type=atom_type, atomic_number=6, mass=12.011, charge=0.0)
+        structure.add_atom(atom, resname, 1)
+    atoms = structure.atoms
+    for i in range(n_atoms - 1):
+        structure.bonds.append(parmed.Bond(atoms[i], atoms[i + 1]))
+    for i in range(n_atoms - 2):
+        structure.angles.append(parmed.Angle(atoms[i], atoms[i + 1], atoms[i + 2]))
+    for i in range(n_atoms - 3):
+        structure.dihedrals.append(parmed.Dihedral(atoms[i], atoms[i + 1], atoms[i + 2], atoms[i + 3]))
+    return structure
+
+
+def chain_positions(n_atoms, n_frames, seed=0, length=0.153, angle=112.0):
+    """
+    Chain conformations with random dihedrals (natural extension reference frame)
+
+    :return: np.array (n_frames, n_atoms, 3) in nm
+    """
+    rng = np.random.RandomState(seed)
+    theta = np.radians(180.0 - angle)
+    positions = np.zeros((n_frames, n_atoms, 3))
+    positions[:, 1] = [length, 0, 0]
+    positions[:, 2] = positions[:, 1] + length * np.array([np.cos(theta), np.sin(theta), 0])
+    phis = rng.uniform(-np.pi, np.pi, size=(n_frames, n_atoms))
+    for i in range(3, n_atoms):
+        a, b, c = positions[:, i - 3], positions[:, i - 2], positions[:, i - 1]
+        bc = c - b
+        bc /= np.linalg.norm(bc, axis=1)[:, np.newaxis]
+        n = np.cross(b - a, bc)
+        n /= np.linalg.norm(n, axis=1)[:, np.newaxis]
+        m = np.cross(n, bc)
+        d = length * np.array([np.cos(theta) * np.ones(n_frames), np.sin(theta) * np.cos(phis[:, i]),
+                               np.sin(theta) * np.sin(phis[:, i])]).T
+        positions[:, i] = c + d[:, [0]] * bc + d[:, [1]] * m + d[:, [2]] * n
+    return positions
+
+
+def synthetic_database(n_atoms, n_frames, n_types, resname='SYN', seed=0):
+    """
+    Synthetic QMDataBase of a chain with random conformations and energies
+
+    :return: (QMDataBase, CharmmParameterSet)
+    """
+    import mdtraj as md
+    from simtk.unit import Quantity, kilojoules_per_mole
+    from torsionfit.database.qmdatabase import QMDataBase
+
+    param = synthetic_parameters(n_types)
+    structure = synthetic_structure(n_atoms, n_types, resname=resname)
+    structure.load_parameters(param, copy_parameters=False)
+    positions = chain_positions(n_atoms, n_frames, seed=seed)
+    topology = md.Topology.from_openmm(structure.topology)
+    torsions = np.zeros((n_frames, 4))
+    torsions[:] = [1, 2, 3, 4]
+    qm_energies = np.random.RandomState(seed).normal(0, 5, n_frames)
+    db = QMDataBase(positions=positions, topology=topology, structure=structure, torsions=torsions,
+                    qm_energies=qm_energies - qm_energies.min())
+    db.delta_energy = Quantity(value=db.qm_energy._value.copy(), unit=kilojoules_per_mole)
+    return db, param
+
+
+def to_optimize(structure):
+    """
+    Torsion types of structure that are fitted, oriented like the keys of QMDataBase.phis
+
+    :param structure: parmed.Structure
+    :return: list of tuples of atom types
+    """
+    torsions = []
+    for dihedral in structure.dihedrals:
+        t = (dihedral.atom1.type, dihedral.atom2.type, dihedral.atom3.type, dihedral.atom4.type)
+        if t[0] >= t[-1]:
+            t = tuple(reversed(t))
+        if t not in torsions:
+            torsions.append(t)
+    return torsions
+
+
+class Value(object):
+    """ Stands in for a pymc variable (value) or model (pymc_parameters) """
+
+    def __init__(self, value=None, pymc_parameters=None):
+        self.value = value
+        self.pymc_parameters = pymc_parameters
+
+
+def timeit(func, repeat=3, number=1):
+    """
+    Time func
+
+    :return: dict with min, mean and max seconds per call
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {'min': min(times), 'mean': float(np.mean(times)), 'max': max(times), 'repeat': repeat, 'number': number}
+
+
+def run_workload(n_atoms, n_frames, n_types, n_frags, repeat=3, steps=20):
+    """
+    Time all benchmarks on one synthetic workload
+
+    :return: dict mapping benchmark to timings. Benchmarks whose dependencies are missing have an 'error'.
+    """
+    results = {}
+    frags = []
+    for i in range(n_frags):
+        db, param = synthetic_database(n_atoms, n_frames, n_types, resname='SYN{}'.format(i), seed=i)
+        frags.append(db)
+    param_to_opt = to_optimize(frags[0].structure)
+
+    results['build_phis'] = timeit(lambda: [db.build_phis(to_optimize=param_to_opt) for db in frags], repeat=repeat)
+
+    def mm_energy():
+        frags[0].compute_energy(param)
+    frags[0].compute_energy(param)
+    results['mm_energy'] = timeit(mm_energy, repeat=repeat, number=steps)
+
+    from torsionfit import parameters as par
+    # model with the values update_param_from_sample reads
+    pymc_parameters = {}
+    for t in param_to_opt:
+        name = '_'.join(t)
+        pymc_parameters[name + '_K'] = Value(np.random.normal(0, 1, 6))
+        pymc_parameters[name + '_multiplicity_bitstring'] = Value(63)
+    model = Value(pymc_parameters=pymc_parameters)
+    results['update_param'] = timeit(lambda: par.update_param_from_sample(param_to_opt, param, model=model, rj=True),
+                                     repeat=repeat, number=steps)
+
+    from torsionfit.utils import logger
+    log = logger()
+
+    def debug():
+        for m in range(1000):
+            log.debug('Working on %s', m)
+    results['logging'] = timeit(debug, repeat=repeat)
+
+    try:
+        import pymc
+        from torsionfit.model import TorsionFitModel
+        from torsionfit.sampler import TorsionFitMCMC
+        from torsionfit.backends import sqlite_plus
+    except ImportError as e:
+        for name in ('model', 'torsion_energy', 'sample', 'trace_read'):
+            results[name] = {'error': str(e)}
+        return results
+
+    results['model'] = timeit(lambda: TorsionFitModel(param, frags, param_to_opt=param_to_opt, rj=True),
+                              repeat=repeat)
+
+    model = TorsionFitModel(param, frags, param_to_opt=param_to_opt, rj=True)
+    Ks = [model.pymc_parameters[name] for name in model.pymc_parameters if name.endswith('_K')]
+
+    def torsion_energy():
+        for K in Ks:
+            K.value = np.random.normal(0, 1, 6)
+        model.pymc_parameters['torsion_energy'].value
+    results['torsion_energy'] = timeit(torsion_energy, repeat=repeat, number=steps)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        dbname = os.path.join(tmp, 'benchmark.sqlite')
+        sampler = TorsionFitMCMC(model.pymc_parameters, db=sqlite_plus, dbname=dbname, dbmode='w')
+        start = time.perf_counter()
+        sampler.sample(steps * repeat, progress_bar=False)
+        seconds = (time.perf_counter() - start) / (steps * repeat)
+        results['sample'] = {'min': seconds, 'mean': seconds, 'max': seconds, 'repeat': 1, 'number': steps * repeat}
+        sampler.db.close()
+
+        db = sqlite_plus.load(dbname)
+        names = list(db.trace_names[-1])
+        results['trace_read'] = timeit(lambda: [db.trace(name)[:] for name in names], repeat=repeat)
+        db.close()
+    finally:
+        shutil.rmtree(tmp)
+    return results
+
+
+def run_parse(repeat=3):
+    """ Time parsing the reference psi4 torsion scan """
+    try:
+        from torsionfit.database.qmdatabase import parse_psi4_out
+    except ImportError as e:
+        return {'error': str(e)}
+    structure = get_fun('butane.psf')
+    scan = get_fun('MP2_torsion_scan/')
+    return timeit(lambda: parse_psi4_out(scan, structure, pattern='*.out2'), repeat=repeat)
+
+
+def metadata():
+    """ Versions and machine of a benchmark run """
+    import torsionfit
+    info = {'time': time.time(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'node': platform.node(),
+            'cpus': os.cpu_count()}
+    info['torsionfit'] = getattr(torsionfit, '__version__', None)
+    return info
+
+
+def run(output=None, quick=False, repeat=3, steps=20):
+    """
+    Run all benchmarks. Every parameter is scaled in turn while the others stay at BASE.
+
+    :param output: str. JSON file to write results to. Default None
+    :param quick: bool. Use small workloads. Default False
+    :param repeat: int. Default 3
+    :param steps: int. steps per repeat of per-step benchmarks. Default 20
+    :return: dict with metadata and results (list of {'benchmark', 'workload', timings})
+    """
+    scaling = QUICK_SCALING if quick else SCALING
+    base = {key: values[len(values) // 2] for key, values in scaling.items()} if quick else dict(BASE)
+    workloads = []
+    for key, values in sorted(scaling.items()):
+        for value in values:
+            workload = dict(base, **{key: value})
+            if workload not in workloads:
+                workloads.append(workload)
+
+    results = []
+    for workload in workloads:
+        for name, timing in sorted(run_workload(repeat=repeat, steps=steps, **workload).items()):
+            results.append(dict(timing, benchmark=name, workload=workload))
+    results.append(dict(run_parse(repeat=repeat), benchmark='parse_psi4_out', workload={}))
+
+    report = {'metadata': metadata(), 'results': results}
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+
+def _key(result):
+    return result['benchmark'], json.dumps(result['workload'], sort_keys=True)
+
+
+def compare(baseline, new, tolerance=1.2):
+    """
+    Compare two benchmark runs
+
+    :param baseline: str or dict. JSON file or output of run
+    :param new: str or dict
+    :param tolerance: float. Benchmarks that are slower than tolerance * baseline are regressions. Default 1.2
+    :return: (regressions, comparison). Both are lists of (benchmark, workload, baseline seconds, new seconds, ratio)
+    sorted by decreasing ratio
+    """
+    runs = []
+    for report in (baseline, new):
+        if isinstance(report, str):
+            with open(report) as f:
+                report = json.load(f)
+        runs.append({_key(r): r for r in report['results'] if 'min' in r})
+    comparison = []
+    for key in sorted(set(runs[0]) & set(runs[1])):
+        old_seconds, new_seconds = runs[0][key]['min'], runs[1][key]['min']
+        ratio = new_seconds / old_seconds if old_seconds > 0 else float('inf')
+        comparison.append((key[0], json.loads(key[1]), old_seconds, new_seconds, ratio))
+    comparison.sort(key=lambda c: -c[-1])
+    return [c for c in comparison if c[-1] > tolerance], comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='torsionfit benchmarks')
+    parser.add_argument('-o', '--output', default='torsionfit_benchmarks.json')
+    parser.add_argument('--quick', action='store_true', help='small workloads')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'NEW'))
+    parser.add_argument('--tolerance', type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        regressions, comparison = compare(*args.compare, tolerance=args.tolerance)
+        for benchmark, workload, old, new, ratio in comparison:
+            flag = ' REGRESSION' if ratio > args.tolerance else ''
+            print('{:16s} {:60s} {:10.4g} {:10.4g} {:6.2f}{}'.format(benchmark, json.dumps(workload, sort_keys=True),
+                                                                  old, new, ratio, flag))
+        return 1 if regressions else 0
+
+    report = run(output=args.output, quick=args.quick, repeat=args.repeat, steps=args.steps)
+    for result in report['results']:
+        seconds = '{:.4g}'.format(result['min']) if 'min' in result else result['error']
+        print('{:16s} {:60s} {}'.format(result['benchmark'], json.dumps(result['workload'], sort_keys=True), seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Command line runner for torsion fits
+
+A fit is described by a YAML config. The scans are parsed once (in a process pool and cached in a QMStore if `store` is
+given), the fitted torsions are prepared and every chain is sampled in its own process. Chains are forked after the data
+is loaded so they share it. Every chain gets the seed `seed + chain` so a config always reproduces the same run. The
+resolved config is written next to the databases.
+
+Example config:
+
+    name: butane
+    output: fit
+    param: [top_all36_cgenff.rtf, par_all36_cgenff.prm]
+    stream: null
+    param_to_opt: [[CG331, CG321, CG321, CG331]]
+    scans:
+      - directory: MP2_torsion_scan
+        structure: butane.psf
+        pattern: '*.out'
+        store: butane_qm.sqlite      # optional cache of parsed output files
+        mapping: null                # optional scan_mapping.json of dedup.dedup_scan
+    model:
+      type: numpy                    # numpy or openmm
+      rj: true
+      tau: mult
+      sample_phase: false
+      sample_n5: false
+      continuous_phase: false
+      init_random: true
+      platform: null                 # OpenMM platform of the openmm model
+      parallel: false                # openmm model: one persistent energy worker per fragment
+      incremental: false             # numpy model: update residuals of the likelihood in place
+    sampler:
+      iterations: 10000
+      burn: 0
+      thin: 1
+      save_interval: 100
+      seed: 1234
+      run_log: 100
+      summaries: null                # streaming summaries every N tallies (true for every tally)
+    backend: sqlite_plus             # sqlite_plus, netcdf4 or ram
+    chains: 4
+    workers:
+      chains: 4
+      parse: 8
+    shared: true                     # share per frame arrays between chains in memory mapped files
+    profile: false
+
+Usage:
+    torsionfit fit.yaml
+    torsionfit fit.yaml --chains 8 --iterations 20000
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import warnings
+import multiprocessing
+from fnmatch import fnmatch
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from torsionfit.utils import logger, RunLog
+from torsionfit import profiling
+
+DEFAULTS = {
+    'name': 'torsionfit',
+    'output': '.',
+    'param': [],
+    'stream': None,
+    'param_to_opt': None,
+    'scans': [],
+    'structure': None,
+    'model': {'type': 'numpy', 'rj': True, 'tau': 'mult', 'sample_phase': False, 'sample_n5': False,
+              'continuous_phase': False, 'init_random': True, 'platform': None, 'parallel': False,
+              'incremental': False},
+    'sampler': {'iterations': 10000, 'burn': 0, 'thin': 1, 'save_interval': None, 'tune_interval': 1000,
+                'seed': None, 'run_log': None, 'summaries': None, 'resume': False},
+    'backend': 'sqlite_plus',
+    'chains': 1,
+    'workers': {'chains': None, 'parse': None},
+    'optimized_only': True,
+    'shared': False,
+    'profile': False,
+}
+EXTENSIONS = {'sqlite_plus': 'sqlite', 'netcdf4': 'nc'}
+
+# Data of the fit. Set before chains are forked so they share it
+_shared = {}
+
+
+def _merge(defaults, config):
+    merged = copy.deepcopy(defaults)
+    for key, value in config.items():
+        if isinstance(merged.get(key), dict) and isinstance(value, dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(config):
+    """
+    Read a fit config and fill in defaults. Relative paths are relative to the directory of the config file.
+
+    :param config: str (path to YAML file) or dict
+    :return: dict
+    """
+    root = None
+    if isinstance(config, str):
+        import yaml
+        root = os.path.dirname(os.path.abspath(config))
+        with open(config, 'r') as f:
+            config = yaml.safe_load(f)
+    unknown = set(config) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown config keys {}".format(sorted(unknown)))
+    config = _merge(DEFAULTS, config)
+    if isinstance(config['param'], str):
+        config['param'] = [config['param']]
+    if config['backend'] not in ('sqlite_plus', 'netcdf4', 'ram'):
+        raise ValueError("Only sqlite_plus, netcdf4 and ram backends are allowed")
+    if config['model']['type'] not in ('numpy', 'openmm'):
+        raise ValueError("Only numpy and openmm models are allowed")
+    if not config['scans']:
+        raise ValueError("The config has no scans")
+    if config['param_to_opt'] is None and config['stream'] is None:
+        raise ValueError("Either param_to_opt or stream must be given")
+    if config['param_to_opt'] is not None:
+        config['param_to_opt'] = [tuple(t) for t in config['param_to_opt']]
+
+    if root is not None:
+        def path(p):
+            return p if p is None or os.path.isabs(p) else os.path.normpath(os.path.join(root, p))
+        config['output'] = path(config['output'])
+        config['param'] = [path(p) for p in config['param']]
+        config['stream'] = path(config['stream'])
+        config['structure'] = path(config['structure'])
+        for scan in config['scans']:
+            for key in ('directory', 'structure', 'store', 'mapping'):
+                if key in scan:
+                    scan[key] = path(scan[key])
+    return config
+
+
+def _parse(out_file):
+    from torsionfit.database.qmdatabase import parse_psi4_out_file
+    try:
+        return out_file, parse_psi4_out_file(out_file), None
+    except Exception as e:
+        return out_file, None, '{}: {}'.format(type(e).__name__, e)
+
+
+def load_scan(scan, structure=None, processes=None, optimized_only=True):
+    """
+    Parse a psi4 torsion scan. Output files are parsed in a process pool into a QMStore. Files that are already in the
+    store and did not change are not parsed again.
+
+    :param scan: dict with directory and optional structure, pattern ('*.out'), store (path to sqlite file of QMStore)
+    and mapping (scan point mapping of dedup.dedup_scan)
+    :param structure: str. structure to use if scan has none. Default None
+    :param processes: int. Default None uses all cores
+    :param optimized_only: bool. Only use points where the optimizer finished. Default True
+    :return: QMDataBase
+    """
+    from torsionfit.database.qmstore import QMStore
+    from torsionfit.database.qmdatabase import parse_psi4_out
+
+    structure = scan.get('structure', structure)
+    if structure is None:
+        raise ValueError("Scan {} has no structure".format(scan['directory']))
+    pattern = scan.get('pattern', '*.out')
+    if scan.get('mapping') is not None:
+        # duplicate scan points are only filled in by parse_psi4_out
+        frag = parse_psi4_out(scan['directory'], structure, pattern=pattern, mapping=scan['mapping'])
+        return frag.remove_nonoptimized() if optimized_only else frag
+
+    store = QMStore(scan.get('store') or ':memory:')
+    out_files = []
+    for path, subdir, files in os.walk(scan['directory']):
+        for name in sorted(files):
+            if fnmatch(name, pattern) and not name.startswith('timer'):
+                out_file = os.path.join(path, name)
+                stored = store.mtime(out_file)
+                if stored is None or stored < os.path.getmtime(out_file):
+                    out_files.append(out_file)
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for out_file, point, error in executor.map(_parse, out_files):
+            if error is not None:
+                warnings.warn("Could not parse {}: {}".format(out_file, error))
+                continue
+            store.add(out_file, point)
+    logger().info('parsed {} output files of {} in {:.1f} s. {} points in store'.format(
+        len(out_files), scan['directory'], time.time() - start, len(store)))
+    frag = store.to_qmdatabase(structure, optimized_only=optimized_only)
+    store.close()
+    return frag
+
+
+def prepare(config):
+    """
+    Load parameters and scans and prepare them for the model in config
+
+    :param config: dict. output of load_config
+    :return: (CharmmParameterSet, list of QMDataBase, list of torsions to optimize)
+    """
+    from parmed.charmm import CharmmParameterSet
+    from torsionfit import parameters as par
+    from torsionfit.database.qmdatabase import to_optimize
+
+    param = CharmmParameterSet(*config['param'])
+    param_to_opt = config['param_to_opt']
+    if param_to_opt is None:
+        param_to_opt = to_optimize(param, config['stream'])
+    frags = [load_scan(scan, structure=config['structure'], processes=config['workers']['parse'],
+                       optimized_only=config['optimized_only']) for scan in config['scans']]
+
+    if config['model']['type'] == 'numpy':
+        # The numpy model fits the difference between QM and MM energies without the fitted torsions
+        par.add_missing(param_to_opt, param, sample_n5=True)
+        par.set_phase_0(param_to_opt, param)
+        for t in param_to_opt:
+            for reverse in (t, tuple(reversed(t))):
+                for term in param.dihedral_types[reverse]:
+                    term.phi_k = 0
+        for frag in frags:
+            frag.compute_energy(param)
+            frag.build_phis(to_optimize=param_to_opt)
+    return param, frags, param_to_opt
+
+
+def build_model(config, param, frags, param_to_opt):
+    """
+    TorsionFitModel with the options in config['model']
+
+    :return: torsionfit.model.TorsionFitModel or torsionfit.model_omm.TorsionFitModel
+    """
+    options = config['model']
+    if options['type'] == 'numpy':
+        from torsionfit.model import TorsionFitModel
+        return TorsionFitModel(param, frags, param_to_opt=param_to_opt, rj=options['rj'],
+                               init_random=options['init_random'], tau=options['tau'],
+                               incremental=options['incremental'])
+    from torsionfit.model_omm import TorsionFitModel
+    platform = None
+    if options['platform'] is not None:
+        import simtk.openmm as mm
+        platform = mm.Platform.getPlatformByName(options['platform'])
+    return TorsionFitModel(param, frags, platform=platform, param_to_opt=param_to_opt, rj=options['rj'],
+                           sample_n5=options['sample_n5'], continuous_phase=options['continuous_phase'],
+                           sample_phase=options['sample_phase'], init_random=options['init_random'],
+                           parallel=options['parallel'])
+
+
+def dbname(config, chain):
+    """ Path to database of chain """
+    if config['backend'] == 'ram':
+        return None
+    return os.path.join(config['output'], '{}_{}.{}'.format(config['name'], chain, EXTENSIONS[config['backend']]))
+
+
+def run_chain(chain):
+    """
+    Sample one chain of the fit in _shared. Runs in worker processes.
+
+    :param chain: int
+    :return: str. path to database of chain
+    """
+    from torsionfit.sampler import TorsionFitMCMC, resume
+    config = _shared['config']
+    options = config['sampler']
+    if options['seed'] is not None:
+        np.random.seed(options['seed'] + chain)
+    if config['profile']:
+        profiling.enable(filename=os.path.join(config['output'], '{}_{}.profile.json'.format(config['name'], chain)),
+                         interval=60)
+
+    model = build_model(config, _shared['param'], _shared['frags'], _shared['param_to_opt'])
+    filename = dbname(config, chain)
+    if config['backend'] == 'ram':
+        backend = 'ram'
+    else:
+        backend = __import__('torsionfit.backends.{}'.format(config['backend']), fromlist=[config['backend']])
+    run_log = None
+    if options['run_log']:
+        run_log = RunLog(interval=options['run_log'],
+                         filename=os.path.join(config['output'], '{}_{}.log.jsonl'.format(config['name'], chain)))
+
+    start = time.time()
+    if options['resume'] and filename is not None and os.path.exists(filename):
+        sampler = resume(model, filename, db=backend, save_interval=options['save_interval'],
+                         tune_interval=options['tune_interval'],
+                         sampler_kwargs={'run_log': run_log, 'summaries': options['summaries']})
+    else:
+        kwargs = {} if filename is None else {'dbname': filename, 'dbmode': 'w'}
+        sampler = TorsionFitMCMC(model.pymc_parameters, db=backend, run_log=run_log, summaries=options['summaries'],
+                                 **kwargs)
+        sampler.sample(iter=options['iterations'], burn=options['burn'], thin=options['thin'],
+                       save_interval=options['save_interval'], tune_interval=options['tune_interval'],
+                       progress_bar=False)
+    sampler.db.close()
+    if hasattr(model, 'close'):
+        model.close()
+    logger().info('chain {} finished in {:.1f} s'.format(chain, time.time() - start))
+    if config['profile']:
+        profiling.dump(profiling.profiler.filename)
+    return filename
+
+
+def run(config, chains=None):
+    """
+    Run a fit
+
+    :param config: str (path to YAML config) or dict
+    :param chains: list of int. chains to run. Default None runs all config['chains'] chains
+    :return: list of paths to databases of chains
+    """
+    config = load_config(config)
+    if not os.path.exists(config['output']):
+        os.makedirs(config['output'])
+    with open(os.path.join(config['output'], '{}.config.json'.format(config['name'])), 'w') as f:
+        json.dump(config, f, indent=2, sort_keys=True)
+
+    start = time.time()
+    param, frags, param_to_opt = prepare(config)
+    logger().info('loaded {} scans with {} frames in {:.1f} s'.format(len(frags), sum(f.n_frames for f in frags),
+                                                                     time.time() - start))
+    shared_directory = None
+    if config['shared']:
+        from torsionfit.database import shared
+        shared_directory = os.path.join(config['output'], '{}_shared'.format(config['name']))
+        frags = shared.share(frags, shared_directory, inner_sum=config['model']['type'] == 'numpy')
+    _shared.update(config=config, param=param, frags=frags, param_to_opt=param_to_opt)
+
+    if chains is None:
+        chains = list(range(config['chains']))
+    processes = config['workers']['chains'] or min(len(chains), os.cpu_count() or 1)
+    try:
+        if processes == 1 or len(chains) == 1:
+            return [run_chain(chain) for chain in chains]
+        # fork so the chains share the loaded data
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork')) as executor:
+            return list(executor.map(run_chain, chains))
+    finally:
+        if shared_directory is not None:
+            shared.release(shared_directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bayesian torsion fit')
+    parser.add_argument('config', help='YAML config of fit')
+    parser.add_argument('--chains', type=int, help='number of chains. Overrides config')
+    parser.add_argument('--chain', type=int, action='append', help='only run this chain. Can be repeated')
+    parser.add_argument('--iterations', type=int, help='iterations per chain. Overrides config')
+    parser.add_argument('--seed', type=int, help='Overrides config')
+    parser.add_argument('--workers', type=int, help='number of chains run at a time. Overrides config')
+    parser.add_argument('--resume', action='store_true', help='continue chains from their last checkpoint')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        from torsionfit import utils
+        utils.verbose = True
+    config = load_config(args.config)
+    if args.chains is not None:
+        config['chains'] = args.chains
+    if args.iterations is not None:
+        config['sampler']['iterations'] = args.iterations
+    if args.seed is not None:
+        config['sampler']['seed'] = args.seed
+    if args.workers is not None:
+        config['workers']['chains'] = args.workers
+    if args.resume:
+        config['sampler']['resume'] = True
+    for filename in run(config, chains=args.chain):
+        if filename is not None:
+            print(filename)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,30 @@
 __author__ = 'Chaya D. Stern'
 
-from torsionfit.database.database import DataBase
-from torsionfit.database.qmdatabase import QMDataBase
-#from torsionfit.database.mmdatabase import MMDataBase
\ No newline at end of file
+import sys
+import types
+import importlib
+
+# Classes are imported on first use so importing torsionfit.database does not load OpenMM, mdtraj and ParmEd
+_classes = {'DataBase': 'torsionfit.database.database',
+            'QMDataBase': 'torsionfit.database.qmdatabase',
+            'QMStore': 'torsionfit.database.qmstore'}
+#from torsionfit.database.mmdatabase import MMDataBase
+
+__all__ = list(_classes)
+
+
+class _LazyModule(types.ModuleType):
+    """ Module that imports its classes on first attribute access. Module level __getattr__ needs Python 3.7 """
+
+    def __getattr__(self, name):
+        if name in _classes:
+            value = getattr(importlib.import_module(_classes[name]), name)
+            setattr(self, name, value)
+            return value
+        raise AttributeError("module {!r} has no attribute {!r}".format(self.__name__, name))
+
+    def __dir__(self):
+        return sorted(list(self.__dict__) + list(_classes))
+
+
+sys.modules[__name__].__class__ = _LazyModule
@@ -13,6 +13,7 @@ from simtk.unit import Quantity, nanometers, kilojoules_per_mole, picoseconds
 
 from  mdtraj import Trajectory
 from torsionfit import parameters as par
+from torsionfit import profiling
 
 
 class DataBase(Trajectory):
@@ -47,6 +48,7 @@ class DataBase(Trajectory):
             msg += str(positions)
             raise Exception(msg)
 
+    @profiling.timed('database.create_context')
     def create_context(self, param, platform=None):
         """
 
@@ -62,6 +64,7 @@ class DataBase(Trajectory):
         else:
             self.context = mm.Context(self.system, self.integrator)
 
+    @profiling.timed('database.copy_torsions')
     def copy_torsions(self, param=None, platform=None):
         """
 
@@ -99,6 +102,15 @@ class DataBase(Trajectory):
         # clean up
         del new_torsion_force
 
+    def release_context(self):
+        """ Delete the OpenMM context, system and integrator. compute_energy creates them again. """
+        del self.context
+        del self.system
+        del self.integrator
+        self.context = None
+        self.system = None
+        self.integrator = mm.VerletIntegrator(0.004*picoseconds)
+
     def _string_summary_basic(self):
         """Basic summary of TorsionScanSet in string form."""
         energy_str = 'with MM Energy' if self._have_mm_energy else 'without MM Energy'
@@ -106,6 +118,7 @@ class DataBase(Trajectory):
                      self.n_frames, self.n_atoms, self.n_residues, energy_str)
         return value
 
+    @profiling.timed('database.compute_energy')
     def compute_energy(self, param, platform=None):
         """ Computes energy for a given structure with a given parameter set
 
@@ -128,10 +141,12 @@ class DataBase(Trajectory):
 
         # Compute potential energies for all snapshots.
         self.mm_energy = Quantity(value=np.zeros([self.n_frames], np.float64), unit=kilojoules_per_mole)
-        for i in range(self.n_frames):
-            self.context.setPositions(self.positions[i])
-            state = self.context.getState(getEnergy=True)
-            self.mm_energy[i] = state.getPotentialEnergy()
+        with profiling.phase('database.openmm_energy'):
+            for i in range(self.n_frames):
+                self.context.setPositions(self.positions[i])
+                state = self.context.getState(getEnergy=True)
+                self.mm_energy[i] = state.getPotentialEnergy()
+        profiling.count('database.openmm_frames', self.n_frames)
 
     def mm_from_param_sample(self, param, db, start=0, end=-1, decouple_n=False, phase=False, n_5=True, model_type='openmm'):
 
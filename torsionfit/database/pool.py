@@ -0,0 +1,187 @@
+"""
+Evaluate MM energies of fragments concurrently in persistent worker processes
+
+Every fragment gets its own worker process that keeps the OpenMM Context of the fragment alive across steps. At every
+step the workers only receive the vector of force constants and phases of the fitted torsions that are in their
+fragment, and only when that vector changed. They copy the torsions into their Context and write the energies (minimum
+subtracted) into a preallocated array in shared memory so the latency of a step scales with the largest fragment
+instead of the sum over fragments.
+
+Example:
+    pool = FragmentEnergyPool(frags, param, to_optimize)
+    energies = pool.compute(param)  # np.array of energies of all frames of all fragments in kJ/mol
+    ...
+    pool.close()
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import multiprocessing
+import traceback
+import numpy as np
+from torsionfit.utils import logger
+from torsionfit.database.torsion_index import TorsionIndex
+
+
+def torsion_terms(param, param_to_opt):
+    """
+    Dihedral types of the torsions that are fitted
+
+    :param param: parmed.charmm.CharmmParameterSet
+    :param param_to_opt: list of tuples of torsions
+    :return: list of (torsion, index) of every term in param.dihedral_types
+    """
+    return [(t, i) for t in param_to_opt for i in range(len(param.dihedral_types[t]))]
+
+
+def parameter_vector(param, terms):
+    """
+    Force constants and phases of terms
+
+    :param param: parmed.charmm.CharmmParameterSet
+    :param terms: list of (torsion, index) from torsion_terms
+    :return: np.array (n_terms, 2) of phi_k and phase
+    """
+    return np.array([(param.dihedral_types[t][i].phi_k, param.dihedral_types[t][i].phase) for t, i in terms],
+                    dtype=np.float64).reshape(-1, 2)
+
+
+def _set_parameters(param, terms, vector):
+    for (t, i), (phi_k, phase) in zip(terms, vector):
+        for key in (t, tuple(reversed(t))):
+            if key in param.dihedral_types:
+                param.dihedral_types[key][i].phi_k = phi_k
+                param.dihedral_types[key][i].phase = phase
+
+
+def _worker(conn, frag, param, terms, platform, energies, start, stop):
+    """ Loop of the worker process. Receives parameter vectors until it receives None """
+    out = np.frombuffer(energies, dtype=np.float64)[start:stop]
+    while True:
+        vector = conn.recv()
+        if vector is None:
+            break
+        try:
+            _set_parameters(param, terms, vector)
+            frag.compute_energy(param, platform=platform)
+            out[:] = frag.mm_energy._value
+            conn.send(None)
+        except Exception:
+            conn.send(traceback.format_exc())
+    conn.close()
+
+
+class FragmentEnergyPool(object):
+    """
+    Persistent worker processes, one per fragment, that compute MM energies of the fragments concurrently.
+
+    The workers are forked when the pool is created so they own a copy of the fragments and of param. Changes to param
+    in the parent only reach the workers through compute.
+    """
+
+    def __init__(self, frags, param, param_to_opt, platform=None, index=None):
+        """
+
+        Parameters
+        ----------
+        frags : list of torsionfit.QMDataBase
+        param : parmed.charmm.CharmmParameterSet
+            All dihedral types of param_to_opt need to be in param (par.add_missing) before the pool is created
+        param_to_opt : list of tuples of torsions
+        platform : openmm.Platform
+            Default None.
+        index : torsionfit.database.torsion_index.TorsionIndex
+            Default None. When None, it is built from the structures of frags
+        """
+        if type(frags) != list:
+            frags = [frags]
+        if index is None:
+            index = TorsionIndex(frags, param_to_opt)
+        self.index = index
+        self.slices = index.slices
+        # terms of the fitted torsions in every fragment
+        self.terms = [torsion_terms(param, torsions) for torsions in index.torsions_of]
+        self._energies = multiprocessing.RawArray('d', index.n_frames)
+        self.energies = np.frombuffer(self._energies, dtype=np.float64)
+        self._vectors = [None for frag in frags]
+        self.n_computed = 0
+
+        # OpenMM contexts do not survive a fork. Workers create their own Context on the first step
+        for frag in frags:
+            if getattr(frag, 'context', None) is not None:
+                frag.release_context()
+
+        context = multiprocessing.get_context('fork')
+        self._connections = []
+        self._processes = []
+        for frag, s, terms in zip(frags, self.slices, self.terms):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker, args=(child_conn, frag, param, terms, platform,
+                                                            self._energies, s.start, s.stop))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._connections.append(parent_conn)
+            self._processes.append(process)
+        logger().debug('started %s fragment energy workers', len(self._processes))
+
+    def __len__(self):
+        return len(self._processes)
+
+    def compute(self, param):
+        """
+        Compute energies of all fragments with the torsion parameters in param
+
+        :param param: parmed.charmm.CharmmParameterSet
+        :return: np.array of energies in kJ/mol of all frames of all fragments. The minimum of every fragment is
+        subtracted. The array is shared with the workers and is overwritten by the next step that changes parameters.
+        """
+        if not self._processes:
+            raise RuntimeError("FragmentEnergyPool is closed")
+        # only fragments with changed torsions. Send to all of them before waiting for any of them
+        sent = []
+        for i, conn in enumerate(self._connections):
+            vector = parameter_vector(param, self.terms[i])
+            if self._vectors[i] is not None and np.array_equal(vector, self._vectors[i]):
+                continue
+            conn.send(vector)
+            sent.append((i, vector))
+        errors = []
+        for i, vector in sent:
+            error = self._connections[i].recv()
+            if error is None:
+                self._vectors[i] = vector
+            else:
+                self._vectors[i] = None
+                errors.append(error)
+        self.n_computed = len(sent)
+        if errors:
+            raise RuntimeError("Fragment energy worker failed:\n{}".format(errors[0]))
+        return self.energies
+
+    def close(self):
+        """ Stop the workers """
+        for conn, process in zip(self._connections, self._processes):
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        self._connections = []
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -1,17 +1,14 @@
 __author__ = 'Chaya D. Stern'
 
-import pandas as pd
 import numpy as np
 
 from simtk.unit import Quantity, nanometers, kilojoules_per_mole
 
-from cclib.parser import Gaussian, Psi
-from cclib.parser.utils import convertor
-
 import mdtraj as md
 from parmed.charmm import CharmmPsfFile, CharmmParameterSet
 import parmed
-from torsionfit.database import DataBase
+from torsionfit.database.database import DataBase
+from torsionfit.qmscan.dedup import load_mapping
 
 from copy import deepcopy
 from fnmatch import fnmatch
@@ -134,7 +131,83 @@ def parse_psi4_log(logfiles, structure):
     return QMDataBase(positions, topology, structure, torsions, directions, angles, qm_energies)
 
 
-def parse_psi4_out(oufiles_dir, structure, pattern="*.out"):
+def _load_structure(structure):
+    """
+    Load topology and parmed structure from a psf, mol2 or pdb file
+    :param structure: str
+        path to structure file
+    :return: (mdtraj.Topology, parmed.Structure)
+    """
+    # Check extension of structure file
+    if structure.endswith('psf'):
+        topology = md.load_psf(structure)
+        structure = CharmmPsfFile(structure)
+    else:
+        topology = md.load(structure).topology
+        structure = parmed.load_file(structure)
+    return topology, structure
+
+
+def psi4_scan_name(name):
+    """
+    Torsion scan that a psi4 output file belongs to. Output files are named molecule_a_b_c_d_angle.out
+    :param name: str
+        output file name
+    :return: str
+        a_b_c_d. 'only_one_scan' if the file name does not have the torsion
+    """
+    name_split = name.split('_')
+    try:
+        return name_split[1] + '_' + name_split[2] + '_' + name_split[3] + '_' + name_split[4]
+    except IndexError:
+        return 'only_one_scan'
+
+
+def parse_psi4_out_file(out_file):
+    """
+    Parse one psi4 output file of a distributed torsion scan
+    :param out_file: str
+        path to psi4 output file
+    :return: dict
+        torsions: np.ndarray (n, 4) of fixed dihedrals (0 based), angle: int, positions: np.ndarray (n_atoms, 3) in nm,
+        qm_energy: np.ndarray (1) absolute energy in kJ/mol, optimized: bool
+    """
+    torsions = np.ndarray((0, 4), dtype=int)
+    torsion = np.ndarray((1, 4), dtype=int)
+    fi = open(out_file, 'r')
+    for line in fi:
+        if line.startswith('dih_string'):
+            t = line.strip().split('"')[1].split(' ')[:4]
+            for i in range(len(t)):
+                torsion[0][i] = int(t[i]) - 1
+            torsions = np.append(torsions, torsion, axis=0)
+    fi.close()
+    optimizer = True
+    from cclib.parser import Psi
+    from cclib.parser.utils import convertor
+    log = Psi(out_file)
+    data = log.parse()
+    try:
+        data.optdone
+    except AttributeError:
+        optimizer = False
+        warnings.warn("Warning: Optimizer failed for {}".format(out_file))
+
+    # Try MP2 energies. Otherwise take SCFenergies
+    try:
+        qm_energy = convertor(data.mpenergies[-1], "eV", "kJmol-1")
+    except AttributeError:
+        try:
+            qm_energy = convertor(np.array([data.scfenergies[-1]]), "eV", "kJmol-1")
+        except AttributeError:
+            warnings.warn("Warning: Check if the file terminated before completing SCF")
+            qm_energy = np.array([np.nan])
+
+    return {'torsions': torsions, 'angle': int(out_file.split('_')[-1].split('.')[0]),
+            'positions': data.atomcoords[-1]*0.1, 'qm_energy': qm_energy, 'optimized': optimizer}
+
+
+def parse_psi4_out(oufiles_dir, structure, pattern="*.out", mapping=None):
     """
     Parse psi4 out files from distributed torsion scan (there are many output files, one for each structure)
     :param oufiles_dir: str
@@ -143,16 +216,14 @@ def parse_psi4_out(oufiles_dir, structure, pattern="*.out"):
         path to psf, mol2 or pbd file of structure
     :param pattern: str
         pattern for psi4 output file. Default is *.out
+    :param mapping: str or dict
+        scan point mapping from torsionfit.qmscan.dedup.dedup_scan. Duplicate scan points that were not computed are
+        added with the energy of the scan point they map to and its geometry with the atoms permuted onto the duplicate
+        torsion. Default None
     :return: TorsionScanSet
 
     """
-    # Check extension of structure file
-    if structure.endswith('psf'):
-        topology = md.load_psf(structure)
-        structure = CharmmPsfFile(structure)
-    else:
-        topology = md.load(structure).topology
-        structure = parmed.load_file(structure)
+    topology, structure = _load_structure(structure)
 
     positions = np.ndarray((0, topology.n_atoms, 3))
     qm_energies = np.ndarray(0)
@@ -160,69 +231,60 @@ def parse_psi4_out(oufiles_dir, structure, pattern="*.out"):
     angles = np.ndarray(0, dtype=float)
     optimized = np.ndarray(0, dtype=bool)
 
+    # maps torsion scan to list of (angle, output file, duplicate scan point or None)
     out_files = {}
     for path, subdir, files in os.walk(oufiles_dir):
         for name in files:
             if fnmatch(name, pattern):
                 if name.startswith('timer'):
                     continue
-                name_split = name.split('_')
-                try:
-                    torsion_angle = (name_split[1] + '_' + name_split[2] + '_' + name_split[3] + '_' + name_split[4])
-                except IndexError:
+                torsion_angle = psi4_scan_name(name)
+                if torsion_angle == 'only_one_scan':
                     warnings.warn("Do you only have one torsion scan? The output files will be treated as one scan")
-                    torsion_angle = 'only_one_scan'
                 try:
                     out_files[torsion_angle]
                 except KeyError:
                     out_files[torsion_angle] = []
                 path = os.path.join(os.getcwd(), path, name)
-                out_files[torsion_angle].append(path)
+                out_files[torsion_angle].append((int(path.split('_')[-1].split('.')[0]), path, None))
+    if not out_files:
+        raise Exception("There are no psi4 output files. Did you choose the right directory?")
+
+    if mapping is not None:
+        point_files = {tor + '/' + str(angle): f for tor in out_files for (angle, f, _) in out_files[tor]}
+        for key, duplicate in sorted(load_mapping(mapping).items()):
+            try:
+                source = point_files[duplicate['source']]
+            except KeyError:
+                warnings.warn("There is no output file for {} which {} maps to".format(duplicate['source'], key))
+                continue
+            out_files.setdefault(key.split('/')[0], []).append((duplicate['angle'], source, duplicate))
+
     # Sort files in increasing angles order for each torsion
     sorted_files = []
     dih_angles = []
     for tor in out_files:
-        dih_angle = []
-        for file in out_files[tor]:
-            dih_angle.append(int(file.split('_')[-1].split('.')[0]))
-        sorted_files.append([out_file for (angle, out_file) in sorted(zip(dih_angle, out_files[tor]))])
-        dih_angle.sort()
-        dih_angles.append(dih_angle)
-    if not out_files:
-        raise Exception("There are no psi4 output files. Did you choose the right directory?")
+        scan_points = sorted(out_files[tor], key=lambda point: point[:2])
+        sorted_files.append([(out_file, duplicate) for (angle, out_file, duplicate) in scan_points])
+        dih_angles.append([angle for (angle, out_file, duplicate) in scan_points])
 
     # Parse files
-    for f in itertools.chain.from_iterable(sorted_files):
-        torsion = np.ndarray((1, 4), dtype=int)
-        fi = open(f, 'r')
-        for line in fi:
-            if line.startswith('dih_string'):
-                t = line.strip().split('"')[1].split(' ')[:4]
-                for i in range(len(t)):
-                    torsion[0][i] = int(t[i]) - 1
-                torsions = np.append(torsions, torsion, axis=0)
-        fi.close()
-        optimizer = True
-        log = Psi(f)
-        data = log.parse()
-        try:
-            data.optdone
-        except AttributeError:
-            optimizer = False
-            warnings.warn("Warning: Optimizer failed for {}".format(f))
-        optimized = np.append(optimized, optimizer)
-
-        positions = np.append(positions, data.atomcoords[-1][np.newaxis]*0.1, axis=0)
-        # Try MP2 energies. Otherwise take SCFenergies
-        try:
-            qm_energy = convertor(data.mpenergies[-1], "eV", "kJmol-1")
-        except AttributeError:
-            try:
-                qm_energy = convertor(np.array([data.scfenergies[-1]]), "eV", "kJmol-1")
-            except AttributeError:
-                warnings.warn("Warning: Check if the file terminated before completing SCF")
-                qm_energy = np.array([np.nan])
-        qm_energies = np.append(qm_energies, qm_energy, axis=0)
+    parsed = {}
+    for f, duplicate in itertools.chain.from_iterable(sorted_files):
+        if f not in parsed:
+            parsed[f] = parse_psi4_out_file(f)
+        point = parsed[f]
+        point_positions = point['positions']
+        if duplicate is None:
+            torsions = np.append(torsions, point['torsions'], axis=0)
+        else:
+            torsions = np.append(torsions, np.array([duplicate['torsion']], dtype=int) - 1, axis=0)
+            if duplicate.get('permutation') is not None:
+                point_positions = np.empty_like(point_positions)
+                point_positions[duplicate['permutation']] = point['positions']
+        optimized = np.append(optimized, point['optimized'])
+        positions = np.append(positions, point_positions[np.newaxis], axis=0)
+        qm_energies = np.append(qm_energies, point['qm_energy'], axis=0)
 
     # Subtract lowest energy to find relative energies
     qm_energies = qm_energies - min(qm_energies)
@@ -260,6 +322,8 @@ def parse_gauss(logfiles, structure):
         torsion = np.ndarray((1, 4), dtype=int)
         step = np.ndarray((0, 3), dtype=int)
         index = (2, 12, -1)
+        from cclib.parser import Gaussian
+        from cclib.parser.utils import convertor
         log = Gaussian(file)
         data = log.parse()
         # convert angstroms to nanometers
@@ -392,6 +456,7 @@ class QMDataBase(DataBase):
             columns = ['Torsion', 'direction','steps', 'QM energy (KJ/mol)', 'MM energy (KJ/mol)',
                        'Delta energy (KJ/mol)']
 
+        import pandas as pd
         torsion_set = pd.DataFrame(data, columns=columns)
         return torsion_set
 
@@ -0,0 +1,112 @@
+__author__ = 'Chaya D. Stern'
+
+import os
+import time
+import sqlite3
+import numpy as np
+from copy import deepcopy
+
+from torsionfit.database.qmdatabase import QMDataBase, parse_psi4_out_file, psi4_scan_name, _load_structure
+
+
+class QMStore(object):
+    """
+    Persistent store of parsed psi4 torsion scan points
+
+    Every psi4 output file is parsed once and stored in a sqlite file. A QMDataBase of all points in the store can be
+    built without parsing the output files again so a growing scan can be reloaded cheaply.
+
+    Attributes
+    ----------
+    filename: str
+        path to sqlite file
+    """
+
+    def __init__(self, filename):
+        """
+
+        Parameters
+        ----------
+        filename : str
+            path to sqlite file. Will be created if it does not exist
+        """
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS points
+                             (out_file TEXT PRIMARY KEY, scan TEXT, angle INT, torsions BLOB, positions BLOB,
+                              qm_energy REAL, optimized INT, mtime REAL, added REAL)""")
+        self.conn.commit()
+        self._structures = {}
+
+    def add(self, out_file, point=None):
+        """
+        Add or replace a scan point
+
+        Parameters
+        ----------
+        out_file : str
+            path to psi4 output file
+        point : dict
+            output of parse_psi4_out_file. Default None will parse out_file
+        """
+        out_file = os.path.abspath(out_file)
+        if point is None:
+            point = parse_psi4_out_file(out_file)
+        self.conn.execute("INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                          (out_file, psi4_scan_name(os.path.basename(out_file)), point['angle'],
+                           np.asarray(point['torsions'], dtype=np.int64).tobytes(),
+                           np.asarray(point['positions'], dtype=np.float64).tobytes(),
+                           float(np.asarray(point['qm_energy']).reshape(-1)[-1]), int(point['optimized']),
+                           os.path.getmtime(out_file), time.time()))
+        self.conn.commit()
+
+    def mtime(self, out_file):
+        """ Modification time of out_file when it was stored. None if it is not in the store """
+        row = self.conn.execute("SELECT mtime FROM points WHERE out_file=?", (os.path.abspath(out_file),)).fetchone()
+        return None if row is None else row[0]
+
+    def __contains__(self, out_file):
+        return self.mtime(out_file) is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM points").fetchone()[0]
+
+    def to_qmdatabase(self, structure, optimized_only=False):
+        """
+        Build a QMDataBase of the stored points. Points are ordered by scan and increasing angle like parse_psi4_out.
+
+        Parameters
+        ----------
+        structure : str
+            path to psf, mol2 or pdb file of structure
+        optimized_only : bool
+            only use points where the optimizer finished. Default False
+
+        Returns
+        -------
+        QMDataBase
+        """
+        if structure not in self._structures:
+            self._structures[structure] = _load_structure(structure)
+        topology, parmed_structure = deepcopy(self._structures[structure])
+
+        query = "SELECT torsions, angle, positions, qm_energy, optimized FROM points"
+        if optimized_only:
+            query += " WHERE optimized=1"
+        rows = self.conn.execute(query + " ORDER BY scan, angle").fetchall()
+        if not rows:
+            raise Exception("There are no scan points in {}".format(self.filename))
+
+        torsions = np.concatenate([np.frombuffer(row[0], dtype=np.int64).reshape(-1, 4) for row in rows])
+        angles = np.array([row[1] for row in rows])
+        positions = np.array([np.frombuffer(row[2], dtype=np.float64).reshape(-1, 3) for row in rows])
+        qm_energies = np.array([row[3] for row in rows])
+        optimized = np.array([bool(row[4]) for row in rows])
+
+        # Subtract lowest energy to find relative energies
+        qm_energies = qm_energies - min(qm_energies)
+        return QMDataBase(positions=positions, topology=topology, structure=parmed_structure, torsions=torsions,
+                          angles=angles, qm_energies=qm_energies, optimized=optimized)
+
+    def close(self):
+        self.conn.close()
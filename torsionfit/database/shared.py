@@ -0,0 +1,138 @@
+"""
+Share the immutable per frame arrays of QMDataBases between processes
+
+`share` writes the positions (xyz and positions), phis, inner sums of the Fourier series and QM and delta energies of
+every fragment to .npy files and replaces the arrays of the fragments with read-only memory maps of those files. Chains
+that are forked afterwards (or processes that attach to the files with `load`) read the same pages of the page cache
+so every additional chain only needs memory for its parameters and sampler state.
+
+Example:
+    frags = share(frags, 'butane_shared')
+    model = TorsionFitModel(param, frags, param_to_opt=to_optimize, rj=True)  # uses the shared inner sums
+    ...
+    release('butane_shared')
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import json
+import shutil
+import numpy as np
+from collections import OrderedDict
+from simtk.unit import Quantity
+
+MULTIPLICITIES = np.array([1., 2., 3., 4., 5., 6.])
+
+
+def fourier_inner_sum(phis):
+    """
+    Inner sum of the Fourier series of every torsion type
+
+    :param phis: dict mapping torsion type to np.array (n_frames, n_torsions) of dihedral angles
+    :return: OrderedDict mapping torsion type to np.array (n_frames, 6) of sum over torsions of 1 + cos(n*phi)
+    """
+    inner_sum = OrderedDict()
+    for t in phis:
+        inner_sum[t] = (1 + np.cos(phis[t][:, np.newaxis]*MULTIPLICITIES[:, np.newaxis])).sum(-1)
+    return inner_sum
+
+
+def _key(t):
+    return '_'.join(t)
+
+
+def _save(directory, name, array):
+    filename = os.path.join(directory, name + '.npy')
+    np.save(filename, np.ascontiguousarray(array))
+    return np.load(filename, mmap_mode='r')
+
+
+def _quantity(quantity, array):
+    return Quantity(value=array, unit=quantity.unit)
+
+
+def share(frags, directory, inner_sum=True, release_context=True):
+    """
+    Move the immutable per frame arrays of frags to read-only memory maps in directory. The modifications are in place.
+
+    Parameters
+    ----------
+    frags : list of QMDataBase
+        phis need to be built (build_phis) and delta_energy computed before they are shared
+    directory : str
+        directory for the .npy files. Will be created if it does not exist
+    inner_sum : bool
+        precalculate inner sums of the Fourier series for torsionfit.model.TorsionFitModel. Default True
+    release_context : bool
+        delete the OpenMM contexts and systems so they are not copied into chains. They are created again by
+        compute_energy. Default True
+
+    Returns
+    -------
+    list of QMDataBase
+    """
+    if type(frags) != list:
+        frags = [frags]
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    manifest = []
+    for i, frag in enumerate(frags):
+        prefix = 'frag{}_'.format(i)
+        arrays = {}
+        # mdtraj checks dtype and shape in the xyz setter. The memory map already has them
+        frag._xyz = _save(directory, prefix + 'xyz', np.asarray(frag.xyz, dtype=np.float32))
+        arrays['xyz'] = prefix + 'xyz'
+        positions = frag.positions._value if isinstance(frag.positions, Quantity) else frag.positions
+        positions = _save(directory, prefix + 'positions', positions)
+        frag.positions = _quantity(frag.positions, positions) if isinstance(frag.positions, Quantity) else positions
+        arrays['positions'] = prefix + 'positions'
+        for name in ('qm_energy', 'delta_energy'):
+            quantity = getattr(frag, name)
+            if len(quantity) != frag.n_frames:
+                continue
+            setattr(frag, name, _quantity(quantity, _save(directory, prefix + name, quantity._value)))
+            arrays[name] = prefix + name
+        phis = OrderedDict()
+        for t in frag.phis:
+            phis[t] = _save(directory, prefix + 'phis_' + _key(t), frag.phis[t])
+        frag.phis = phis
+        if inner_sum:
+            frag.inner_sum = OrderedDict((t, _save(directory, prefix + 'inner_sum_' + _key(t), s))
+                                         for t, s in fourier_inner_sum(phis).items())
+        if release_context:
+            frag.release_context()
+        manifest.append({'arrays': arrays, 'torsions': [list(t) for t in phis], 'inner_sum': inner_sum})
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return frags
+
+
+def load(directory):
+    """
+    Attach read-only to the arrays shared in directory
+
+    :param directory: str
+    :return: list of dicts (one per fragment) mapping 'xyz', 'positions', 'qm_energy', 'delta_energy' to np.memmap and
+    'phis' and 'inner_sum' to OrderedDicts mapping torsion type to np.memmap
+    """
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    frags = []
+    for i, entry in enumerate(manifest):
+        prefix = 'frag{}_'.format(i)
+        frag = {name: np.load(os.path.join(directory, filename + '.npy'), mmap_mode='r')
+                for name, filename in entry['arrays'].items()}
+        for name in ('phis', 'inner_sum') if entry['inner_sum'] else ('phis',):
+            frag[name] = OrderedDict((tuple(t), np.load(os.path.join(directory, '{}{}_{}.npy'.format(prefix, name,
+                                                                                                   _key(t))),
+                                                        mmap_mode='r'))
+                                     for t in entry['torsions'])
+        frags.append(frag)
+    return frags
+
+
+def release(directory):
+    """ Delete the shared arrays in directory. Memory maps that are still open stay valid until they are closed """
+    shutil.rmtree(directory)
@@ -0,0 +1,99 @@
+"""
+Index from fitted torsion types to the fragments and frames that contain them
+
+A Metropolis step that changes the force constants of one torsion type only changes the MM energies of the fragments
+that contain that torsion type. The models use the index to recompute the energies of those fragments and keep cached
+energies of all other fragments.
+
+Example:
+    index = TorsionIndex(frags, to_optimize)
+    index.fragments[('CG331', 'CG321', 'CG321', 'CG331')]  # [0, 2]
+    index.affected([('CG331', 'CG321', 'CG321', 'CG331')])  # [0, 2]
+    index.frames(0)  # slice of fragment 0 in the concatenated energies of all fragments
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+from collections import OrderedDict
+
+
+def canonical(t):
+    """ Torsion type in the same orientation regardless of which end it starts at """
+    t = tuple(t)
+    r = tuple(reversed(t))
+    return t if t <= r else r
+
+
+def structure_torsions(structure):
+    """
+    Proper torsion types of structure
+
+    :param structure: parmed.Structure
+    :return: set of canonical torsion types
+    """
+    return set(canonical((d.atom1.type, d.atom2.type, d.atom3.type, d.atom4.type)) for d in structure.dihedrals
+               if not d.improper)
+
+
+class TorsionIndex(object):
+    """
+    Sparse index from fitted torsion types to fragments and frames
+
+    Attributes
+    ----------
+    torsions : list of tuples. fitted torsion types in the order of param_to_opt
+    fragments : OrderedDict mapping torsion type to list of indices of the fragments that contain it
+    torsions_of : list (one per fragment) of lists of fitted torsion types in the fragment
+    slices : list (one per fragment) of slices of the fragment in the concatenated frames of all fragments
+    """
+
+    def __init__(self, frags, param_to_opt, torsions=None):
+        """
+
+        Parameters
+        ----------
+        frags : list of torsionfit.QMDataBase
+        param_to_opt : list of tuples of torsions
+        torsions : list (one per fragment) of iterables of torsion types in the fragment
+            Default None. When None, the torsion types are taken from the dihedrals of the structure of the fragments
+        """
+        if type(frags) != list:
+            frags = [frags]
+        if torsions is None:
+            torsions = [structure_torsions(frag.structure) for frag in frags]
+        else:
+            torsions = [set(canonical(t) for t in ts) for ts in torsions]
+
+        self.torsions = [tuple(t) for t in param_to_opt]
+        self.fragments = OrderedDict((t, [i for i, ts in enumerate(torsions) if canonical(t) in ts])
+                                     for t in self.torsions)
+        self._fitted = dict((canonical(t), t) for t in self.torsions)
+        self.torsions_of = [[t for t in self.torsions if canonical(t) in ts] for ts in torsions]
+        self.slices = []
+        start = 0
+        for frag in frags:
+            self.slices.append(slice(start, start + frag.n_frames))
+            start += frag.n_frames
+        self.n_frames = start
+
+    def __len__(self):
+        return len(self.slices)
+
+    def affected(self, torsions):
+        """
+        Fragments that contain any of torsions
+
+        :param torsions: iterable of torsion types in either orientation
+        :return: sorted list of indices of fragments
+        """
+        fragments = set()
+        for t in torsions:
+            t = self._fitted.get(canonical(t))
+            if t is not None:
+                fragments.update(self.fragments[t])
+        return sorted(fragments)
+
+    def frames(self, fragment):
+        """ Slice of fragment in the concatenated frames of all fragments """
+        return self.slices[fragment]
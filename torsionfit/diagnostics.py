@@ -0,0 +1,154 @@
+"""
+Convergence diagnostics for torsionfit traces
+
+Computes equilibration time, statistical inefficiency, effective sample size and split R-hat for many traces in a
+process pool. Results are cached per (variable, burn, n_samples). The length of a trace is checked without reading its
+samples, so an update only reads and recomputes the traces that grew since the last update. A grown trace is recomputed
+from scratch because the equilibration time is searched over the whole trace.
+"""
+
+__author__ = 'Chaya D. Stern'
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from torsionfit.utils import trace_length
+
+
+def detect_equilibration(trace, nskip=1):
+    """ pymbar.timeseries.detectEquilibration. pymbar is imported on first use """
+    import pymbar
+    try:
+        detect = pymbar.timeseries.detectEquilibration
+    except AttributeError:
+        # pymbar >= 4
+        detect = pymbar.timeseries.detect_equilibration
+    return detect(trace, nskip=nskip)
+
+TraceStatistics = namedtuple('TraceStatistics', ['t0', 'g', 'ess', 'rhat'])
+TraceStatistics.__doc__ = """Statistics of a trace. The first three fields are the same as the output of
+pymbar.timeseries.detectEquilibration so it can be used wherever that output was used."""
+
+
+def split_rhat(trace):
+    """
+    Gelman-Rubin potential scale reduction factor of a single chain split in two halves
+
+    :param trace: np.array (n_samples)
+    :return: float. nan if there are less than 4 samples or the trace is constant
+    """
+    trace = np.asarray(trace, dtype=float)
+    n = len(trace) // 2
+    if n < 2:
+        return np.nan
+    halves = np.vstack((trace[:n], trace[-n:]))
+    within = halves.var(axis=1, ddof=1).mean()
+    if within == 0:
+        return np.nan
+    between = n * halves.mean(axis=1).var(ddof=1)
+    var_hat = (n - 1.0) / n * within + between / n
+    return np.sqrt(var_hat / within)
+
+
+def trace_statistics(trace, nskip=1):
+    """
+    Computes equilibration time, statistical inefficiency, effective sample size and split R-hat of a trace.
+    The effective sample size and R-hat are computed on the equilibrated part of the trace.
+
+    :param trace: np.array (n_samples) or (n_samples, n). Multidimensional traces are computed per column.
+    :param nskip: int. Try every nskip samples as equilibration time. Default 1
+    :return: TraceStatistics
+    """
+    trace = np.asarray(trace, dtype=float)
+    if trace.ndim > 1:
+        columns = [trace_statistics(trace[:, i], nskip=nskip) for i in range(trace.shape[1])]
+        return TraceStatistics(*[np.array(field) for field in zip(*columns)])
+    t0, g, ess = detect_equilibration(trace, nskip=nskip)
+    return TraceStatistics(t0, g, ess, split_rhat(trace[int(t0):]))
+
+
+def _trace_statistics(args):
+    return trace_statistics(*args)
+
+
+class ConvergenceDiagnostics(object):
+    """
+    Computes and caches convergence statistics for traces in a pymc database.
+
+    Attributes
+    ----------
+    db: pymc.database or pymc.sampler
+    processes: int. Number of worker processes. If None, will use number of cpus. If 1, will compute serially.
+    statistics: dict mapping (variable name, burn, n_samples) to TraceStatistics
+    """
+
+    def __init__(self, db, processes=None, nskip=1):
+        """
+
+        Parameters
+        ----------
+        db : pymc.database (can also be pymc.sampler)
+        processes : int
+            Number of worker processes. Default None uses number of cpus. If 1, statistics are computed serially. The
+            pool is started on the first update that needs it and kept until close is called.
+        nskip : int
+            Try every nskip samples as equilibration time. Default 1
+        """
+        self.db = db
+        self.processes = processes
+        self.nskip = nskip
+        self.statistics = {}
+        self._latest = {}
+        self._lengths = {}
+        self._executor = None
+
+    def update(self, names, burn=0):
+        """
+        Computes statistics for traces that are new or have grown since the last update with the same burn.
+
+        :param names: list of variable names
+        :param burn: int. number of samples to skip
+        :return: dict mapping names to TraceStatistics
+        """
+        keys = {}
+        to_compute = []
+        for name in names:
+            n_samples = max(trace_length(self.db.trace(name)) - burn, 0)
+            key = (name, burn, n_samples)
+            keys[name] = key
+            if key not in self.statistics:
+                to_compute.append(key)
+
+        args = [(self.db.trace(name)[burn:], self.nskip) for name, burn, n_samples in to_compute]
+        if self.processes == 1 or len(to_compute) < 2:
+            results = map(_trace_statistics, args)
+        else:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.processes)
+            results = self._executor.map(_trace_statistics, args)
+        for key, result in zip(to_compute, results):
+            # statistics of the shorter trace with the same burn are not needed anymore
+            old = self._lengths.get(key[:2])
+            self.statistics.pop(key[:2] + (old,), None)
+            self._lengths[key[:2]] = key[2]
+            self.statistics[key] = result
+
+        for name in names:
+            self._latest[name] = keys[name]
+        return {name: self.statistics[keys[name]] for name in names}
+
+    def __getitem__(self, name):
+        """ Statistics of the last update of name """
+        return self.statistics[self._latest[name]]
+
+    def close(self):
+        """ Shut down the worker processes """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,108 @@
+"""
+Incremental Gaussian likelihood of the residual energies of torsionfit.model.TorsionFitModel
+
+Metropolis proposes one stochastic at a time. The likelihood keeps the current residuals (QM - MM without the fitted
+torsions - torsion energy) and their sum of squares. A change of one K block only changes the residuals of the fragments
+that contain the torsion, and only through the columns of the inner sums of the multiplicities that changed, so the
+update costs O(frames of affected fragments). A change of log_sigma only rescales the sum of squares.
+
+Example:
+    likelihood = IncrementalLikelihood(residual_energy, model.inner_sum, model.index)
+    likelihood.logp({t: K}, log_sigma)
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import numpy as np
+from collections import OrderedDict
+
+
+class IncrementalLikelihood(object):
+    """
+    Normal log likelihood of observed residual energies with mean sum_t K_t * inner_sum_t and precision
+    exp(-2 * log_sigma). The residuals are updated in place when Ks change.
+
+    Attributes
+    ----------
+    residual : np.array. observed - torsion energy of the current Ks
+    sse : float. sum of squares of residual
+    K : OrderedDict mapping torsion type to the current (effective) np.array of 6 Ks
+    """
+
+    def __init__(self, observed, inner_sum, index, refresh_interval=10000):
+        """
+
+        Parameters
+        ----------
+        observed : np.array
+            concatenated residual energies (delta_energy) of all fragments
+        inner_sum : list (one per fragment) of dicts mapping torsion type to np.array (n_frames, 6)
+        index : torsionfit.database.torsion_index.TorsionIndex
+        refresh_interval : int
+            recompute the residuals from scratch after this many updates so rounding errors do not accumulate.
+            Default 10000
+        """
+        self.observed = np.asarray(observed, dtype=np.float64)
+        if len(self.observed) != index.n_frames:
+            raise ValueError("{} observed energies for {} frames".format(len(self.observed), index.n_frames))
+        self.inner_sum = inner_sum
+        self.index = index
+        self.refresh_interval = refresh_interval
+        self.K = OrderedDict((t, np.zeros(6)) for t in index.torsions)
+        self.residual = self.observed.copy()
+        self.sse = float(np.dot(self.residual, self.residual))
+        self.n_updates = 0
+
+    def __len__(self):
+        return len(self.observed)
+
+    def energy(self):
+        """ Torsion energy of the current Ks """
+        return self.observed - self.residual
+
+    def refresh(self):
+        """ Recompute residuals and sum of squares from the current Ks """
+        self.residual = self.observed.copy()
+        for i, s in enumerate(self.index.slices):
+            for t in self.index.torsions_of[i]:
+                self.residual[s] -= np.dot(self.inner_sum[i][t], self.K[t])
+        self.sse = float(np.dot(self.residual, self.residual))
+        self.n_updates = 0
+
+    def update(self, K):
+        """
+        Update the residuals to new Ks
+
+        :param K: dict mapping torsion type to np.array of 6 Ks. Torsions that are missing keep their Ks
+        :return: float. sum of squares of the residuals
+        """
+        for t, k in K.items():
+            k = np.asarray(k, dtype=np.float64)
+            dK = k - self.K[t]
+            columns = np.flatnonzero(dK)
+            if not len(columns):
+                continue
+            for i in self.index.fragments[t]:
+                s = self.index.slices[i]
+                residual = self.residual[s]
+                old = np.dot(residual, residual)
+                residual -= np.dot(self.inner_sum[i][t][:, columns], dK[columns])
+                self.sse += np.dot(residual, residual) - old
+            self.K[t] = k.copy()
+            self.n_updates += 1
+        if self.n_updates >= self.refresh_interval:
+            self.refresh()
+        return self.sse
+
+    def logp(self, K, log_sigma):
+        """
+        Normal log likelihood (the same as pymc.normal_like of the residuals with tau = exp(-2 * log_sigma))
+
+        :param K: dict mapping torsion type to np.array of 6 Ks
+        :param log_sigma: float
+        :return: float
+        """
+        sse = self.update(K)
+        tau = np.exp(-2 * log_sigma)
+        return 0.5 * len(self.observed) * np.log(0.5 * tau / np.pi) - 0.5 * tau * sse
@@ -4,6 +4,10 @@ import pymc
 import numpy as np
 import torsionfit.database.qmdatabase as TorsionScan
 from torsionfit.utils import logger
+from torsionfit import profiling
+from torsionfit.database.shared import fourier_inner_sum
+from torsionfit.database.torsion_index import TorsionIndex
+from torsionfit.likelihood import IncrementalLikelihood
 from collections import OrderedDict
 import itertools
 
@@ -20,9 +24,11 @@ class TorsionFitModel(object):
     parameters_to_optimize: list of tuples (dihedrals to optimize)
     models: list of models to sample over.
     inner_sum: list of precalculated inner sum. This is also the gradient.
+    index: TorsionIndex from torsion types to the fragments that contain them
 
     """
-    def __init__(self, param, frags, stream=None,  param_to_opt=None, rj=False, init_random=True, tau='mult'):
+    def __init__(self, param, frags, stream=None,  param_to_opt=None, rj=False, init_random=True, tau='mult',
+                 incremental=False):
         """
 
         Parameters
@@ -43,6 +49,10 @@ class TorsionFitModel(object):
             options are 'mult' or 'single'. When 'mult', every element in K_m will have its own 'tau', when 'single',
             each K_m will have one tau.
             Default 'mult'
+        incremental: bool
+            If True, qm_fit is a likelihood node that updates the residuals and their sum of squares in place when one K
+            block or log_sigma changes (see torsionfit.likelihood). torsion_energy is then read from the residuals of
+            the likelihood and is not traced. Default False
 
         Returns
         -------
@@ -105,10 +115,11 @@ class TorsionFitModel(object):
 
         if init_random:
             # randomize initial value
+            log = logger()
             for parameter in self.pymc_parameters:
                 if type(self.pymc_parameters[parameter]) != pymc.CommonDeterministics.Lambda and parameter[:11] != 'log_sigma_k':
                     self.pymc_parameters[parameter].random()
-                    logger().info('initial value for {} is {}'.format(parameter, self.pymc_parameters[parameter].value))
+                    log.info('initial value for %s is %s', parameter, self.pymc_parameters[parameter].value)
 
         self.pymc_parameters['log_sigma'] = pymc.Uniform('log_sigma', lower=-10, upper=3, value=np.log(0.01))
         self.pymc_parameters['sigma'] = pymc.Lambda('sigma',
@@ -119,42 +130,94 @@ class TorsionFitModel(object):
                                                             -2 * log_sigma))
 
         # Precalculate phis
-        n = np.array([1., 2., 3., 4., 5., 6.])
         self.models = []
         for i in itertools.product((0, 1), repeat=6):
             self.models.append(i)
 
         inner_sum = []
         for i, frag in enumerate(frags):
-            inner_sum.append(OrderedDict())
-            for t in frag.phis:
-                inner_sum[i][t] = (1 + np.cos(frag.phis[t][:, np.newaxis]*n[:, np.newaxis])).sum(-1)
+            # inner sums shared between processes by torsionfit.database.shared.share
+            shared = getattr(frag, 'inner_sum', None)
+            if shared is not None and list(shared) == list(frag.phis):
+                inner_sum.append(shared)
+            else:
+                inner_sum.append(fourier_inner_sum(frag.phis))
         self.inner_sum = inner_sum
 
-        @pymc.deterministic
-        def torsion_energy(pymc_parameters=self.pymc_parameters):
-            mm = np.ndarray(0)
-
-            for i, mol in enumerate(self.frags):
-                Fourier_sum = np.zeros((mol.n_frames))
-                for t in inner_sum[i]:
-                    name = t[0] + '_' + t[1] + '_' + t[2] + '_' + t[3]
-                    if self.rj:
-                        K = pymc_parameters['{}_K'.format(name)] * self.models[pymc_parameters['{}_multiplicity_bitstring'.format(name)]]
-                    else:
-                        K = pymc_parameters['{}_K'.format(name)]
-                    Fourier_sum += (K*inner_sum[i][t]).sum(1)
-                Fourier_sum_rel = Fourier_sum - min(Fourier_sum)
-                Fourier_sum_rel += pymc_parameters['{}_offset'.format(mol.topology._residues[0])]
-                mm = np.append(mm, Fourier_sum)
-            return mm
+        # torsion types -> fragments that contain them. Only fragments with a changed K are recomputed
+        torsions = []
+        for i in range(len(frags)):
+            torsions.extend(t for t in inner_sum[i] if t not in torsions)
+        self.index = TorsionIndex(frags, torsions, torsions=[list(s) for s in inner_sum])
+        self._K = OrderedDict()
+        self._contributions = [OrderedDict() for frag in frags]
+        self._fourier_sum = [np.zeros(frag.n_frames) for frag in frags]
 
         size = sum([len(i.qm_energy) for i in self.frags])
         residual_energy = np.ndarray(0)
         for i in range(len(frags)):
             residual_energy = np.append(residual_energy, frags[i].delta_energy)
 
-        self.pymc_parameters['torsion_energy'] = torsion_energy
-        self.pymc_parameters['qm_fit'] = pymc.Normal('qm_fit', mu=self.pymc_parameters['torsion_energy'],
-                                                     tau=self.pymc_parameters['precision'], size=size, observed=True,
-                                                     value=residual_energy)
+        self.likelihood = None
+        if not incremental:
+            @pymc.deterministic
+            def torsion_energy(pymc_parameters=self.pymc_parameters):
+                with profiling.phase('model.torsion_energy'):
+                    changed = OrderedDict()
+                    for t in self.index.torsions:
+                        name = t[0] + '_' + t[1] + '_' + t[2] + '_' + t[3]
+                        if self.rj:
+                            K = pymc_parameters['{}_K'.format(name)] * self.models[pymc_parameters['{}_multiplicity_bitstring'.format(name)]]
+                        else:
+                            K = pymc_parameters['{}_K'.format(name)]
+                        K = np.asarray(K, dtype=np.float64)
+                        if t not in self._K or not np.array_equal(K, self._K[t]):
+                            changed[t] = K
+                    affected = self.index.affected(changed)
+                    for i in affected:
+                        for t in self.index.torsions_of[i]:
+                            if t in changed:
+                                self._contributions[i][t] = (changed[t]*inner_sum[i][t]).sum(1)
+                        Fourier_sum = np.zeros((self.frags[i].n_frames))
+                        for t in inner_sum[i]:
+                            Fourier_sum += self._contributions[i][t]
+                        self._fourier_sum[i] = Fourier_sum
+                    self._K.update(changed)
+                    profiling.count('model.fragments_recomputed', len(affected))
+                    return np.concatenate(self._fourier_sum)
+
+            self.pymc_parameters['torsion_energy'] = torsion_energy
+            self.pymc_parameters['qm_fit'] = pymc.Normal('qm_fit', mu=self.pymc_parameters['torsion_energy'],
+                                                         tau=self.pymc_parameters['precision'], size=size,
+                                                         observed=True, value=residual_energy)
+            return
+
+        self.likelihood = IncrementalLikelihood(residual_energy, inner_sum, self.index)
+        names = OrderedDict((t[0] + '_' + t[1] + '_' + t[2] + '_' + t[3], t) for t in self.index.torsions)
+        parents = {'K': {name: self.pymc_parameters['{}_K'.format(name)] for name in names}}
+        if self.rj:
+            parents['bitstrings'] = {name: self.pymc_parameters['{}_multiplicity_bitstring'.format(name)]
+                                     for name in names}
+
+        def effective_K(K, bitstrings=None):
+            if bitstrings is not None:
+                K = {name: K[name] * self.models[bitstrings[name]] for name in K}
+            return {names[name]: K[name] for name in K}
+
+        def qm_fit_logp(value, K, log_sigma, bitstrings=None):
+            return self.likelihood.logp(effective_K(K, bitstrings), log_sigma)
+
+        def likelihood_energy(K, bitstrings=None):
+            # a rejected proposal leaves the likelihood at the proposed Ks
+            self.likelihood.update(effective_K(K, bitstrings))
+            return self.likelihood.energy()
+
+        # The likelihood already keeps the torsion energy in its residuals. It is not traced so tallies do not pay
+        # for it
+        self.pymc_parameters['torsion_energy'] = pymc.Deterministic(eval=likelihood_energy, name='torsion_energy',
+                                                                    parents=dict(parents), doc='Torsion energy',
+                                                                    trace=False, dtype=float)
+        parents['log_sigma'] = self.pymc_parameters['log_sigma']
+        self.pymc_parameters['qm_fit'] = pymc.Stochastic(logp=qm_fit_logp, doc='Normal likelihood of residual energies',
+                                                         name='qm_fit', parents=parents, value=residual_energy,
+                                                         dtype=float, observed=True)
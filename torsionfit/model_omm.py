@@ -7,6 +7,9 @@ import torsionfit.database.qmdatabase as TorsionScan
 import torsionfit.parameters as par
 import warnings
 from torsionfit.utils import logger
+from torsionfit import profiling
+from torsionfit.database.pool import FragmentEnergyPool, torsion_terms, parameter_vector
+from torsionfit.database.torsion_index import TorsionIndex
 
 
 class TorsionFitModel(object):
@@ -24,7 +27,7 @@ class TorsionFitModel(object):
 
     """
     def __init__(self, param, frags, stream=None,  platform=None, param_to_opt=None, rj=False, sample_n5=False,
-                 continuous_phase=False, sample_phase=False, init_random=True):
+                 continuous_phase=False, sample_phase=False, init_random=True, parallel=False):
         """
 
         Parameters
@@ -51,6 +54,10 @@ class TorsionFitModel(object):
             Randomize starting condition. Default is True. If false, will resort to whatever value is in the parameter set.
         tau: float
             hyperparameter on Gaussian prior on K
+        parallel: bool
+            If True, evaluate the MM energies of all fragments concurrently in persistent worker processes (one per
+            fragment, see torsionfit.database.pool). The workers keep their OpenMM contexts. Call close() to stop them.
+            Default False
 
 
         Returns
@@ -69,6 +76,7 @@ class TorsionFitModel(object):
         self.sample_n5 = sample_n5
         self.continuous_phase = continuous_phase
         self.sample_phase = sample_phase
+        self.pool = None
         if param_to_opt:
             self.parameters_to_optimize = param_to_opt
         else:
@@ -166,10 +174,11 @@ class TorsionFitModel(object):
 
         if init_random:
             # randomize initial value
+            log = logger()
             for parameter in self.pymc_parameters:
                 if type(self.pymc_parameters[parameter]) != pymc.CommonDeterministics.Lambda: # and parameter[:11] != 'log_sigma_k':
                     self.pymc_parameters[parameter].random()
-                    logger().info('initial value for {} is {}'.format(parameter, self.pymc_parameters[parameter].value))
+                    log.info('initial value for %s is %s', parameter, self.pymc_parameters[parameter].value)
 
 
         self.pymc_parameters['log_sigma'] = pymc.Uniform('log_sigma', lower=-10, upper=3, value=np.log(0.01))
@@ -183,17 +192,37 @@ class TorsionFitModel(object):
         # add missing multiplicity terms to parameterSet so that the system has the same number of parameters
         par.add_missing(self.parameters_to_optimize, param, sample_n5=self.sample_n5)
 
+        # torsion types -> fragments that contain them. Only fragments with changed torsions are recomputed
+        self.index = TorsionIndex(self.frags, self.parameters_to_optimize)
+        if parallel and len(self.frags) > 1:
+            self.pool = FragmentEnergyPool(self.frags, param, self.parameters_to_optimize, platform=self.platform,
+                                           index=self.index)
+        self._terms = [torsion_terms(param, torsions) for torsions in self.index.torsions_of]
+        self._vectors = [None for frag in self.frags]
+        self._energies = np.zeros(self.index.n_frames)
+
         @pymc.deterministic
         def mm_energy(pymc_parameters=self.pymc_parameters, param=param):
-            mm = np.ndarray(0)
-            par.update_param_from_sample(self.parameters_to_optimize, param, model=self, rj=self.rj,
-                                         phase=self.sample_phase, n_5=self.sample_n5, continuous=self.continuous_phase,
-                                         model_type='openmm')
-            for mol in self.frags:
-                mol.compute_energy(param, offset=self.pymc_parameters['%s_offset' % mol.topology._residues[0]],
-                                   platform=self.platform)
-                mm = np.append(mm, mol.mm_energy / kilojoules_per_mole)
-            return mm
+            with profiling.phase('model_omm.mm_energy'):
+                par.update_param_from_sample(self.parameters_to_optimize, param, model=self, rj=self.rj,
+                                             phase=self.sample_phase, n_5=self.sample_n5,
+                                             continuous=self.continuous_phase, model_type='openmm')
+                if self.pool is not None:
+                    energies = self.pool.compute(param)
+                else:
+                    energies = self._energies
+                    for i, mol in enumerate(self.frags):
+                        vector = parameter_vector(param, self._terms[i])
+                        if self._vectors[i] is not None and np.array_equal(vector, self._vectors[i]):
+                            continue
+                        mol.compute_energy(param, platform=self.platform)
+                        energies[self.index.slices[i]] = mol.mm_energy / kilojoules_per_mole
+                        self._vectors[i] = vector
+                        profiling.count('model_omm.fragments_recomputed')
+                mm = energies.copy()
+                for mol, s in zip(self.frags, self.index.slices):
+                    mm[s] += self.pymc_parameters['%s_offset' % mol.topology._residues[0]].value
+                return mm
 
         size = sum([len(i.qm_energy) for i in self.frags])
         qm_energy = np.ndarray(0)
@@ -206,3 +235,9 @@ class TorsionFitModel(object):
         self.pymc_parameters['qm_fit'] = pymc.Normal('qm_fit', mu=self.pymc_parameters['mm_energy'],
                                                      tau=self.pymc_parameters['precision'], size=size, observed=True,
                                                      value=qm_energy)
+
+    def close(self):
+        """ Stop the fragment energy workers if parallel is True """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
@@ -4,10 +4,11 @@ Useful functions for manipulating parameters in a Parmed CharmmParameterSet.
 """
 __author__ = 'Chaya D. Stern'
 
-from parmed.topologyobjects import DihedralType
 from torsionfit.utils import logger
+from torsionfit import profiling
 from copy import copy as _copy
 import warnings
+import logging
 
 
 def add_missing(param_list, param, sample_n5=False):
@@ -24,6 +25,7 @@ def add_missing(param_list, param, sample_n5=False):
     sample_n5 : bool
         Flag if multiplicity of 5 should be added. Default False.
     """
+    from parmed.topologyobjects import DihedralType
     multiplicities = [1, 2, 3, 4, 6]
     if sample_n5:
         multiplicities = [1, 2, 3, 4, 5, 6]
@@ -61,6 +63,7 @@ def set_phase_0(param_list, param):
             param.dihedral_types[reverse_p][i].phase = 0
 
 
+@profiling.timed('parameters.update_param_from_sample')
 def update_param_from_sample(param_list, param, db=None, model=None, i=-1, rj=False, phase=False, n_5=True, continuous=False,
                              model_type='numpy'):
     """
@@ -87,7 +90,10 @@ def update_param_from_sample(param_list, param, db=None, model=None, i=-1, rj=Fa
     model: string
         which torsionfit model was used
     """
-    logger().debug('updating parameters')
+    log = logger()
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug('updating parameters')
     if type(param_list) is not list:
         param_list = [param_list]
     for t in param_list:
@@ -103,7 +109,8 @@ def update_param_from_sample(param_list, param, db=None, model=None, i=-1, rj=Fa
         reverse_t = tuple(reversed(t))
         for n in range(len(param.dihedral_types[t])):
             m = int(param.dihedral_types[t][n].per)
-            logger().debug('Working on {}'.format(m))
+            if debug:
+                log.debug('Working on %s', m)
             multiplicity_bitmask = 2 ** (m - 1)  # multiplicity bitmask
             if (multiplicity_bitstring & multiplicity_bitmask) or not rj:
                 sample = None
@@ -125,7 +132,8 @@ def update_param_from_sample(param_list, param, db=None, model=None, i=-1, rj=Fa
                 elif model is not None and model_type == 'openmm':
                     sample = model.pymc_parameters[k].value
 
-                logger().debug('K sample value {}'.format(sample))
+                if debug:
+                    log.debug('K sample value %s', sample)
                 param.dihedral_types[t][n].phi_k = sample
                 param.dihedral_types[reverse_t][n].phi_k = sample
                 if phase:
@@ -135,15 +143,18 @@ def update_param_from_sample(param_list, param, db=None, model=None, i=-1, rj=Fa
                     if model is not None:
                         sample = model.pymc_parameters[p].value
                     if not continuous:
-                        logger().debug('Not continuous')
+                        if debug:
+                            log.debug('Not continuous')
                         if sample == 1:
                             sample = 180.0
-                    logger().debug('Phase sample value {}'.format(sample))
+                    if debug:
+                        log.debug('Phase sample value %s', sample)
                     param.dihedral_types[t][n].phase = sample
                     param.dihedral_types[reverse_t][n].phase = sample
             else:
                 # This torsion periodicity is disabled.
-                logger().debug('Turning off {}'.format(m))
+                if debug:
+                    log.debug('Turning off %s', m)
                 param.dihedral_types[t][n].phi_k = 0
                 param.dihedral_types[reverse_t][n].phi_k = 0
 
@@ -9,7 +9,11 @@ __author__ = 'Chaya D. Stern'
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
-import pymbar
+import importlib
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from torsionfit.diagnostics import ConvergenceDiagnostics
+from torsionfit.utils import decode_multiplicity_bitstring, trace_length
 
 # global parameter
 multiplicities = (1, 2, 3, 4, 6)
@@ -62,36 +66,123 @@ def get_multiplicity_traces(torsion_parameters, db, n5=False):
     multiplicity_traces = {}
     for torsion_name in torsion_parameters:
         multiplicity_bitstring = torsion_name + '_multiplicity_bitstring'
-        for m in multiplicities:
-            multiplicity_traces[torsion_name + '_' + str(m)] = []
-            for i in db.trace(multiplicity_bitstring)[:]:
-                if 2**(m-1) & int(i):
-                    multiplicity_traces[torsion_name + '_' + str(m)].append(1)
-                else:
-                    multiplicity_traces[torsion_name + '_' + str(m)].append(0)
+        decoded = decode_multiplicity_bitstring(db.trace(multiplicity_bitstring)[:], multiplicities)
+        for i, m in enumerate(multiplicities):
+            multiplicity_traces[torsion_name + '_' + str(m)] = decoded[:, i]
     return multiplicity_traces
 
 
-def get_statistics(db, torsion_parameters):
+def get_statistics(db, torsion_parameters, processes=None, diagnostics=None):
     """
-    uses pymbar.timeseries.detectEquilibration module to get equilibration time, statistical inefficiency and effective
-    samples for each trace. Returns a dictionary that maps all parameters to statistics.
+    Computes equilibration time, statistical inefficiency, effective samples and split R-hat for each trace in a process
+    pool (see torsionfit.diagnostics). Returns a dictionary that maps all parameters to statistics. The first three
+    fields of the statistics are the output of pymbar.timeseries.detectEquilibration
 
     :param db: pymc.database (can also use pymc.sampler)
     :param torsion_parameters: dict mapping torsion name to associated parameters
+    :param processes: int. Number of worker processes. Default None uses number of cpus.
+    :param diagnostics: torsionfit.diagnostics.ConvergenceDiagnostics. Pass the same instance on a growing run to only
+    recompute traces that have new samples. Default None
 
     :return: dict that maps parameters to statistics
     """
+    params = [param for parameters in torsion_parameters for param in torsion_parameters[parameters]]
+    if diagnostics is None:
+        with ConvergenceDiagnostics(db, processes=processes) as diagnostics:
+            return diagnostics.update(params)
+    return diagnostics.update(params)
+
+
+def envelope(trace, width):
+    """
+    Min/max envelope decimation of a trace. The trace is split into width bins and only the minimum and maximum of every
+    bin is kept so the plot looks the same at a resolution of width pixels.
+
+    :param trace: np.array (n_samples)
+    :param width: int. number of bins
+    :return: (x, lower, upper) np.arrays. x is the center of every bin in sample index. If the trace is not longer than
+    2*width, returns the trace with lower = upper.
+    """
+    trace = np.asarray(trace)
+    n_samples = len(trace)
+    if n_samples <= 2 * width:
+        return np.arange(n_samples), trace, trace
+    edges = np.linspace(0, n_samples, width + 1).astype(int)
+    lower = np.minimum.reduceat(trace, edges[:-1])
+    upper = np.maximum.reduceat(trace, edges[:-1])
+    x = (edges[:-1] + edges[1:] - 1) / 2.0
+    return x, lower, upper
 
-    statistics = {}
-    for parameters in torsion_parameters:
-        for param in torsion_parameters[parameters]:
-            statistics[param] = pymbar.timeseries.detectEquilibration(db.trace(param)[:])
 
-    return statistics
+# envelopes of traces for every database. Keyed by (trace name, number of samples, width)
+_envelope_cache = weakref.WeakKeyDictionary()
+
+
+def _plot_trace(db, key, fmt, markersize, label, downsample=None, traces=None):
+    """
+    Plot a trace from db (or from traces dict if given) on the current axes. If downsample, plots the cached min/max
+    envelope of the trace.
+    """
+    if not downsample:
+        trace = db.trace(key)[:] if traces is None else traces[key]
+        return plt.plot(trace, fmt, markersize=markersize, label=label)
+
+    if downsample is True:
+        width = int(plt.gca().get_window_extent().width)
+    else:
+        width = int(downsample)
+    # the samples are only read when the trace grew since its envelope was cached
+    n_samples = trace_length(db.trace(key)) if traces is None else len(traces[key])
+    cache = _envelope_cache.setdefault(db, {})
+    cache_key = (key, n_samples, width)
+    if cache_key not in cache:
+        trace = db.trace(key)[:] if traces is None else traces[key]
+        for old in [k for k in cache if k[0] == key and k[2] == width]:
+            del cache[old]
+        cache[cache_key] = envelope(trace, width)
+    x, lower, upper = cache[cache_key]
+    lines = plt.plot(np.repeat(x, 2), np.column_stack((lower, upper)).ravel(), fmt, markersize=markersize,
+                     label=label)
+    plt.vlines(x, lower, upper, colors=lines[0].get_color(), linewidth=0.5)
+    return lines
+
+
+def _render_trace_page(args):
+    plot, name, dbname, backend, kwargs = args
+    plt.switch_backend('Agg')
+    db = importlib.import_module(backend).load(dbname)
+    if not kwargs.get('statistics') and kwargs.get('equil', True):
+        mult = range(1, 7) if plot is trace_no_phase_n5 else multiplicities
+        kwargs['statistics'] = get_statistics(db, {name: [name + '_' + str(m) + '_K' for m in mult]}, processes=1)
+    plot(name, db, **kwargs)
+    plt.close('all')
+    db.close()
+    return name
+
+
+def render_trace_pages(names, dbname, backend='torsionfit.backends.sqlite_plus', plot=None, processes=None, **kwargs):
+    """
+    Render trace plots of many torsions in parallel. Every worker opens the database by filename and writes
+    %s_traces.pdf for its torsions.
+
+    :param names: list of torsion names A_B_C_D
+    :param dbname: str. path to database
+    :param backend: str. module of database backend. Default torsionfit.backends.sqlite_plus
+    :param plot: trace plot function. Default trace_no_phase
+    :param processes: int. number of worker processes. Default None uses number of cpus
+    :param kwargs: keyword arguments for the plot function (markersize is required)
+    :return: list of names that were rendered
+    """
+    if plot is None:
+        plot = trace_no_phase
+    kwargs.setdefault('downsample', True)
+    args = [(plot, name, dbname, backend, dict(kwargs)) for name in names]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_render_trace_page, args))
 
 
-def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=False, continuous=False, filename=None):
+def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=False, continuous=False, filename=None,
+                downsample=None):
     """
     Generate trace plot for all parameters of a given torsion
 
@@ -100,6 +191,8 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
     :param markersize: int.
     :param statistics: dict that maps parameters to statistics from pymbar.timeseries.detectEquilibrium. Default: False
     :param multiplicity_traces: dict that maps multiplicity term to (0,1) trace. Default is False.
+    :param downsample: int or bool. Reduce every trace to a min/max envelope with this many bins before plotting. If
+    True, uses the pixel width of the subplot. Default None plots every sample.
     """
 
     if not multiplicity_traces:
@@ -108,17 +201,16 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
         except KeyError:
             pass
 
+    if not statistics:
+        statistics = get_statistics(db, {name: [name + '_' + str(m) + '_K' for m in multiplicities]})
+
     pp = PdfPages('%s_traces.pdf' % name)
     fig = plt.figure()
 
     axes_k = plt.subplot(9, 2, 1)
-    plt.plot(db.trace(name + '_' + str(1) + '_K')[:], 'k.', markersize=markersize, label='K')
+    _plot_trace(db, name + '_' + str(1) + '_K', 'k.', markersize, 'K', downsample)
     plt.title(name, fontweight='bold')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '1' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(1) + '_K')[:])[0], color='red',
-                       lw=1)
+    axes_k.axvline(statistics[name + '_' + '1' + '_K'][0], color='red', lw=1)
     plt.ylim(0, 20)
     plt.ylabel('kJ/mole')
     plt.xticks([])
@@ -126,7 +218,7 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
     plt.yticks([0, 20])
 
     axes_phase = plt.subplot(9, 2, 3)
-    plt.plot(db.trace(name + '_' + str(1) + '_Phase')[:], '.', markersize=markersize, label='Phase')
+    _plot_trace(db, name + '_' + str(1) + '_Phase', '.', markersize, 'Phase', downsample)
     if continuous:
         plt.ylim(-1.0, 181)
         plt.yticks([1, 180])
@@ -138,7 +230,7 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
 
     axes_n = plt.subplot(9, 2, 5)
     try:
-        plt.plot(multiplicity_traces[name + '_' + str(1)], 'k.', markersize=markersize, label='1')
+        _plot_trace(db, name + '_' + str(1), 'k.', markersize, '1', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([0, 1])
@@ -147,12 +239,8 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
         pass
 
     axes_k = plt.subplot(9, 2, 7)
-    plt.plot(db.trace(name + '_' + str(2) + '_K')[:], 'k.', markersize=markersize, label='K')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '2' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(2) + '_K')[:])[0], color='red',
-                       lw=1)
+    _plot_trace(db, name + '_' + str(2) + '_K', 'k.', markersize, 'K', downsample)
+    axes_k.axvline(statistics[name + '_' + '2' + '_K'][0], color='red', lw=1)
     plt.ylim(0, 20)
     plt.ylabel('kJ/mole')
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
@@ -160,7 +248,7 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
     plt.yticks([0, 20])
 
     axes_phase = plt.subplot(9, 2, 9)
-    plt.plot(db.trace(name + '_' + str(2) + '_Phase')[:], '.', markersize=markersize, label='Phase')
+    _plot_trace(db, name + '_' + str(2) + '_Phase', '.', markersize, 'Phase', downsample)
     if continuous:
         plt.ylim(-1.0, 181)
         plt.yticks([1, 180])
@@ -172,7 +260,7 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
 
     axes_n = plt.subplot(9, 2, 11)
     try:
-        plt.plot(multiplicity_traces[name + '_' + str(2)], 'k.', markersize=markersize, label='2')
+        _plot_trace(db, name + '_' + str(2), 'k.', markersize, '2', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([0, 1])
@@ -181,12 +269,8 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
         pass
 
     axes_k = plt.subplot(9, 2, 13)
-    plt.plot(db.trace(name + '_' + str(3) + '_K')[:], 'k.', markersize=markersize, label='K')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '3' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(3) + '_K')[:])[0], color='red',
-                       lw=1)
+    _plot_trace(db, name + '_' + str(3) + '_K', 'k.', markersize, 'K', downsample)
+    axes_k.axvline(statistics[name + '_' + '3' + '_K'][0], color='red', lw=1)
     plt.ylim(0, 20)
     plt.ylabel('kJ/mole')
     plt.xticks([])
@@ -194,7 +278,7 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
     plt.yticks([0, 20])
 
     axes_phase = plt.subplot(9, 2, 15)
-    plt.plot(db.trace(name + '_' + str(3) + '_Phase')[:], '.', markersize=markersize, label='Phase')
+    _plot_trace(db, name + '_' + str(3) + '_Phase', '.', markersize, 'Phase', downsample)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.xticks([])
     if continuous:
@@ -206,7 +290,7 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
 
     axes_n = plt.subplot(9, 2, 17)
     try:
-        plt.plot(multiplicity_traces[name + '_' + str(3)], 'k.', markersize=markersize, label='3')
+        _plot_trace(db, name + '_' + str(3), 'k.', markersize, '3', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([0, 1])
@@ -216,19 +300,15 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
 
     axes_k = plt.subplot(9, 2, 2)
     plt.title(name, fontweight='bold')
-    plt.plot(db.trace(name + '_' + str(4) + '_K')[:], 'k.', markersize=markersize, label='K')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '4' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(4) + '_K')[:])[0], color='red',
-                       lw=1)
+    _plot_trace(db, name + '_' + str(4) + '_K', 'k.', markersize, 'K', downsample)
+    axes_k.axvline(statistics[name + '_' + '4' + '_K'][0], color='red', lw=1)
     plt.ylim(0, 20)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.xticks([])
     plt.yticks([])
 
     axes_phase = plt.subplot(9, 2, 4)
-    plt.plot(db.trace(name + '_' + str(4) + '_Phase')[:], '.', markersize=markersize, label='Phase')
+    _plot_trace(db, name + '_' + str(4) + '_Phase', '.', markersize, 'Phase', downsample)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     if continuous:
         plt.ylim(-1.0, 181)
@@ -241,7 +321,7 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
 
     try:
         axes_n = plt.subplot(9, 2, 6)
-        plt.plot(multiplicity_traces[name + '_' + str(4)], 'k.', markersize=markersize, label='4')
+        _plot_trace(db, name + '_' + str(4), 'k.', markersize, '4', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([])
@@ -250,19 +330,15 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
         pass
 
     axes_k = plt.subplot(9, 2, 8)
-    plt.plot(db.trace(name + '_' + str(6) + '_K')[:], 'k.', markersize=markersize, label='K')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '6' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(6) + '_K')[:])[0], color='red',
-                       lw=1)
+    _plot_trace(db, name + '_' + str(6) + '_K', 'k.', markersize, 'K', downsample)
+    axes_k.axvline(statistics[name + '_' + '6' + '_K'][0], color='red', lw=1)
     plt.ylim(0, 20)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.xticks([])
     plt.yticks([])
 
     axes_phase = plt.subplot(9, 2, 10)
-    plt.plot(db.trace(name + '_' + str(6) + '_Phase')[:], '.', markersize=markersize, label='Phase')
+    _plot_trace(db, name + '_' + str(6) + '_Phase', '.', markersize, 'Phase', downsample)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     if continuous:
         plt.ylim(-1.0, 181)
@@ -275,7 +351,7 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
 
     axes_n = plt.subplot(9, 2, 12)
     try:
-        plt.plot(multiplicity_traces[name + '_' + str(6)], 'k.', markersize=markersize, label='6')
+        _plot_trace(db, name + '_' + str(6), 'k.', markersize, '6', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([])
@@ -291,7 +367,8 @@ def trace_plots(name, db, markersize, statistics=False, multiplicity_traces=Fals
     pp.close()
 
 
-def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=False, ymin=-20, ymax=20, filename=None):
+def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=False, ymin=-20, ymax=20, filename=None,
+                   downsample=None):
     """
     Generate trace plot for all parameters of a given torsion
 
@@ -300,6 +377,8 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
     :param markersize: int.
     :param statistics: dict that maps parameters to statistics from pymbar.timeseries.detectEquilibrium. Default: False
     :param multiplicity_traces: dict that maps multiplicity term to (0,1) trace. Default is False.
+    :param downsample: int or bool. Reduce every trace to a min/max envelope with this many bins before plotting. If
+    True, uses the pixel width of the subplot. Default None plots every sample.
     """
 
     if not multiplicity_traces:
@@ -308,17 +387,16 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
         except KeyError:
             pass
 
+    if not statistics:
+        statistics = get_statistics(db, {name: [name + '_' + str(m) + '_K' for m in multiplicities]})
+
     pp = PdfPages('%s_traces.pdf' % name)
     fig = plt.figure()
 
     axes_k = plt.subplot(5, 2, 1)
-    plt.plot(db.trace(name + '_' + str(1) + '_K')[:], 'k.', markersize=markersize, label='K')
+    _plot_trace(db, name + '_' + str(1) + '_K', 'k.', markersize, 'K', downsample)
     plt.title(name, fontweight='bold')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '1' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(1) + '_K')[:])[0], color='red',
-                       lw=1)
+    axes_k.axvline(statistics[name + '_' + '1' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.ylabel('kJ/mole')
     plt.xticks([])
@@ -327,7 +405,7 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
 
     axes_n = plt.subplot(5, 2, 2)
     try:
-        plt.plot(multiplicity_traces[name + '_' + str(1)], 'k.', markersize=markersize, label='1')
+        _plot_trace(db, name + '_' + str(1), 'k.', markersize, '1', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([0, 1])
@@ -336,12 +414,8 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
         pass
 
     axes_k = plt.subplot(5, 2, 3)
-    plt.plot(db.trace(name + '_' + str(2) + '_K')[:], 'k.', markersize=markersize, label='K')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '2' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(2) + '_K')[:])[0], color='red',
-                       lw=1)
+    _plot_trace(db, name + '_' + str(2) + '_K', 'k.', markersize, 'K', downsample)
+    axes_k.axvline(statistics[name + '_' + '2' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.ylabel('kJ/mole')
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
@@ -350,7 +424,7 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
 
     axes_n = plt.subplot(5, 2, 4)
     try:
-        plt.plot(multiplicity_traces[name + '_' + str(2)], 'k.', markersize=markersize, label='2')
+        _plot_trace(db, name + '_' + str(2), 'k.', markersize, '2', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([0, 1])
@@ -359,12 +433,8 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
         pass
 
     axes_k = plt.subplot(5, 2, 5)
-    plt.plot(db.trace(name + '_' + str(3) + '_K')[:], 'k.', markersize=markersize, label='K')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '3' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(3) + '_K')[:])[0], color='red',
-                       lw=1)
+    _plot_trace(db, name + '_' + str(3) + '_K', 'k.', markersize, 'K', downsample)
+    axes_k.axvline(statistics[name + '_' + '3' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.ylabel('kJ/mole')
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
@@ -375,7 +445,7 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
     axes_n = plt.subplot(5, 2, 6)
     plt.title(name, fontweight='bold')
     try:
-        plt.plot(multiplicity_traces[name + '_' + str(3)], 'k.', markersize=markersize, label='3')
+        _plot_trace(db, name + '_' + str(3), 'k.', markersize, '3', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([])
@@ -384,12 +454,8 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
         pass
 
     axes_k = plt.subplot(5, 2, 7)
-    plt.plot(db.trace(name + '_' + str(4) + '_K')[:], 'k.', markersize=markersize, label='K')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '4' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(4) + '_K')[:])[0], color='red',
-                       lw=1)
+    _plot_trace(db, name + '_' + str(4) + '_K', 'k.', markersize, 'K', downsample)
+    axes_k.axvline(statistics[name + '_' + '4' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.xticks([])
@@ -397,7 +463,7 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
 
     axes_n = plt.subplot(5, 2, 8)
     try:
-        plt.plot(multiplicity_traces[name + '_' + str(4)], 'k.', markersize=markersize, label='4')
+        _plot_trace(db, name + '_' + str(4), 'k.', markersize, '4', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([])
@@ -406,12 +472,8 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
         pass
 
     axes_k = plt.subplot(5, 2, 9)
-    plt.plot(db.trace(name + '_' + str(6) + '_K')[:], 'k.', markersize=markersize, label='K')
-    if statistics:
-        axes_k.axvline(statistics[name + '_' + '6' + '_K'][0], color='red', lw=1)
-    else:
-        axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(6) + '_K')[:])[0], color='red',
-                       lw=1)
+    _plot_trace(db, name + '_' + str(6) + '_K', 'k.', markersize, 'K', downsample)
+    axes_k.axvline(statistics[name + '_' + '6' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.yticks([])
@@ -419,7 +481,7 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
 
     axes_n = plt.subplot(5, 2, 10)
     try:
-        plt.plot(multiplicity_traces[name + '_' + str(6)], 'k.', markersize=markersize, label='6')
+        _plot_trace(db, name + '_' + str(6), 'k.', markersize, '6', downsample, multiplicity_traces)
         plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
         plt.ylim(-0.1, 1.1)
         plt.yticks([])
@@ -434,7 +496,8 @@ def trace_no_phase(name, db, markersize, statistics=False, multiplicity_traces=F
     pp.savefig(fig, dpi=80)
     pp.close()
 
-def trace_no_phase_n5(name, db, markersize, statistics=False, equil=True,  multiplicity_traces=False, ymin=-20, ymax=20, filename=None):
+def trace_no_phase_n5(name, db, markersize, statistics=False, equil=True,  multiplicity_traces=False, ymin=-20, ymax=20, filename=None,
+                      downsample=None):
     """
     Generate trace plot for all parameters of a given torsion
 
@@ -443,23 +506,24 @@ def trace_no_phase_n5(name, db, markersize, statistics=False, equil=True,  multi
     :param markersize: int.
     :param statistics: dict that maps parameters to statistics from pymbar.timeseries.detectEquilibrium. Default: False
     :param multiplicity_traces: dict that maps multiplicity term to (0,1) trace. Default is False.
+    :param downsample: int or bool. Reduce every trace to a min/max envelope with this many bins before plotting. If
+    True, uses the pixel width of the subplot. Default None plots every sample.
     """
 
     if not multiplicity_traces:
         multiplicity_traces = get_multiplicity_traces(torsion_parameters=name, db=db, n5=True)
 
+    if equil and not statistics:
+        statistics = get_statistics(db, {name: [name + '_' + str(m) + '_K' for m in range(1, 7)]})
+
     pp = PdfPages('%s_traces.pdf' % name)
     fig = plt.figure()
 
     axes_k = plt.subplot(6, 2, 1)
-    plt.plot(db.trace(name + '_' + str(1) + '_K')[:], 'k.', markersize=markersize, label='K')
+    _plot_trace(db, name + '_' + str(1) + '_K', 'k.', markersize, 'K', downsample)
     plt.title(name, fontweight='bold')
     if equil:
-        if statistics:
-            axes_k.axvline(statistics[name + '_' + '1' + '_K'][0], color='red', lw=1)
-        else:
-            axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(1) + '_K')[:])[0], color='red',
-                       lw=1)
+        axes_k.axvline(statistics[name + '_' + '1' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.ylabel('kJ/mole')
     plt.xticks([])
@@ -468,20 +532,16 @@ def trace_no_phase_n5(name, db, markersize, statistics=False, equil=True,  multi
 
     axes_n = plt.subplot(6, 2, 2)
     plt.title(name, fontweight='bold')
-    plt.plot(multiplicity_traces[name + '_' + str(1)], 'k.', markersize=markersize, label='1')
+    _plot_trace(db, name + '_' + str(1), 'k.', markersize, '1', downsample, multiplicity_traces)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.ylim(-0.1, 1.1)
     plt.yticks([0, 1])
     plt.xticks([])
 
     axes_k = plt.subplot(6, 2, 3)
-    plt.plot(db.trace(name + '_' + str(2) + '_K')[:], 'k.', markersize=markersize, label='K')
+    _plot_trace(db, name + '_' + str(2) + '_K', 'k.', markersize, 'K', downsample)
     if equil:
-        if statistics:
-            axes_k.axvline(statistics[name + '_' + '2' + '_K'][0], color='red', lw=1)
-        else:
-            axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(2) + '_K')[:])[0], color='red',
-                       lw=1)
+        axes_k.axvline(statistics[name + '_' + '2' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.ylabel('kJ/mole')
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
@@ -489,20 +549,16 @@ def trace_no_phase_n5(name, db, markersize, statistics=False, equil=True,  multi
     plt.yticks([ymin, 0, ymax])
 
     axes_n = plt.subplot(6, 2, 4)
-    plt.plot(multiplicity_traces[name + '_' + str(2)], 'k.', markersize=markersize, label='2')
+    _plot_trace(db, name + '_' + str(2), 'k.', markersize, '2', downsample, multiplicity_traces)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.ylim(-0.1, 1.1)
     plt.yticks([0, 1])
     plt.xticks([])
 
     axes_k = plt.subplot(6, 2, 5)
-    plt.plot(db.trace(name + '_' + str(3) + '_K')[:], 'k.', markersize=markersize, label='K')
+    _plot_trace(db, name + '_' + str(3) + '_K', 'k.', markersize, 'K', downsample)
     if equil:
-        if statistics:
-            axes_k.axvline(statistics[name + '_' + '3' + '_K'][0], color='red', lw=1)
-        else:
-            axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(3) + '_K')[:])[0], color='red',
-                       lw=1)
+        axes_k.axvline(statistics[name + '_' + '3' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.ylabel('kJ/mole')
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
@@ -510,20 +566,16 @@ def trace_no_phase_n5(name, db, markersize, statistics=False, equil=True,  multi
     plt.xticks([])
 
     axes_n = plt.subplot(6, 2, 6)
-    plt.plot(multiplicity_traces[name + '_' + str(3)], 'k.', markersize=markersize, label='3')
+    _plot_trace(db, name + '_' + str(3), 'k.', markersize, '3', downsample, multiplicity_traces)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.ylim(-0.1, 1.1)
     plt.yticks([0, 1])
     plt.xticks([])
 
     axes_k = plt.subplot(6, 2, 7)
-    plt.plot(db.trace(name + '_' + str(4) + '_K')[:], 'k.', markersize=markersize, label='K')
+    _plot_trace(db, name + '_' + str(4) + '_K', 'k.', markersize, 'K', downsample)
     if equil:
-        if statistics:
-            axes_k.axvline(statistics[name + '_' + '4' + '_K'][0], color='red', lw=1)
-        else:
-            axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(4) + '_K')[:])[0], color='red',
-                       lw=1)
+        axes_k.axvline(statistics[name + '_' + '4' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.xticks([])
@@ -531,20 +583,16 @@ def trace_no_phase_n5(name, db, markersize, statistics=False, equil=True,  multi
     plt.ylabel('KJ/mol')
 
     axes_n = plt.subplot(6, 2, 8)
-    plt.plot(multiplicity_traces[name + '_' + str(4)], 'k.', markersize=markersize, label='4')
+    _plot_trace(db, name + '_' + str(4), 'k.', markersize, '4', downsample, multiplicity_traces)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.ylim(-0.1, 1.1)
     plt.yticks([0, 1])
     plt.xticks([])
 
     axes_k = plt.subplot(6, 2, 9)
-    plt.plot(db.trace(name + '_' + str(5) + '_K')[:], 'k.', markersize=markersize, label='K')
+    _plot_trace(db, name + '_' + str(5) + '_K', 'k.', markersize, 'K', downsample)
     if equil:
-        if statistics:
-            axes_k.axvline(statistics[name + '_' + '5' + '_K'][0], color='red', lw=1)
-        else:
-            axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(5) + '_K')[:])[0], color='red',
-                       lw=1)
+        axes_k.axvline(statistics[name + '_' + '5' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.xticks([])
@@ -552,20 +600,16 @@ def trace_no_phase_n5(name, db, markersize, statistics=False, equil=True,  multi
     plt.ylabel('KJ/mol')
 
     axes_n = plt.subplot(6, 2, 10)
-    plt.plot(multiplicity_traces[name + '_' + str(5)], 'k.', markersize=markersize, label='5')
+    _plot_trace(db, name + '_' + str(5), 'k.', markersize, '5', downsample, multiplicity_traces)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.ylim(-0.1, 1.1)
     plt.yticks([0, 1])
     plt.xticks([])
 
     axes_k = plt.subplot(6, 2, 11)
-    plt.plot(db.trace(name + '_' + str(6) + '_K')[:], 'k.', markersize=markersize, label='K')
+    _plot_trace(db, name + '_' + str(6) + '_K', 'k.', markersize, 'K', downsample)
     if equil:
-        if statistics:
-            axes_k.axvline(statistics[name + '_' + '6' + '_K'][0], color='red', lw=1)
-        else:
-            axes_k.axvline(pymbar.timeseries.detectEquilibration(db.trace(name + '_' + str(6) + '_K')[:])[0], color='red',
-                       lw=1)
+        axes_k.axvline(statistics[name + '_' + '6' + '_K'][0], color='red', lw=1)
     plt.ylim(ymin, ymax)
     plt.yticks([ymin, 0, ymax])
     plt.ylabel('KJ/mol')
@@ -573,7 +617,7 @@ def trace_no_phase_n5(name, db, markersize, statistics=False, equil=True,  multi
     plt.xlabel('mcmc steps')
 
     axes_n = plt.subplot(6, 2, 12)
-    plt.plot(multiplicity_traces[name + '_' + str(6)], 'k.', markersize=markersize, label='6')
+    _plot_trace(db, name + '_' + str(6), 'k.', markersize, '6', downsample, multiplicity_traces)
     plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
     plt.ylim(-0.1, 1.1)
     plt.yticks([0, 1])
@@ -592,7 +636,7 @@ def marg_mult(model, db, samples, burn=0, filename=None, n5=False):
 
     :param model: TorsionFitModel
     :param db: pymc.database for model
-    :param samples: length of trace
+    :param samples: length of trace. Only the first samples after burn are counted
     :param burn: int. number of steps to skip
     :param filename: filename for plot to save
     """
@@ -604,18 +648,12 @@ def marg_mult(model, db, samples, burn=0, filename=None, n5=False):
     for i in model.pymc_parameters.keys():
         if i.split('_')[-1] == 'bitstring':
             mult_bitstring.append(i)
-    if n5:
-        histogram = np.zeros((len(mult_bitstring), samples, 5))
-    else:
-        histogram = np.zeros((len(mult_bitstring), samples, 5))
+    histogram = np.zeros((len(mult_bitstring), len(multiplicities)))
 
     for m, torsion in enumerate(mult_bitstring):
-        for i, j in enumerate(db.trace('%s' % torsion)[burn:]):
-            for k, l in enumerate(multiplicities):
-                if 2**(l-1) & int(j):
-                    histogram[m][i][k] = 1
+        histogram[m] = decode_multiplicity_bitstring(db.trace('%s' % torsion)[burn:][:samples], multiplicities).sum(0)
 
-    plt.matshow(histogram.sum(1), cmap='Blues',  extent=[0, 5, 0, 20]), plt.colorbar()
+    plt.matshow(histogram, cmap='Blues',  extent=[0, 5, 0, 20]), plt.colorbar()
     plt.yticks([])
     plt.xlabel('multiplicity term')
     plt.ylabel('torsion')
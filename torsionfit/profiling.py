@@ -0,0 +1,233 @@
+"""
+Opt-in timers and counters for the hot paths of a fit
+
+Phases (the model deterministics, update_param_from_sample, copy_torsions, OpenMM energies, backend tallies, ...) are
+timed with `timed` (decorator) or `phase` (context manager). When profiling is disabled (the default) both only check
+one attribute before calling through. When it is enabled every phase keeps a count, the total, min and max time and a
+histogram of times in power of 2 microsecond bins. Counters count events without timing them.
+
+Example:
+    from torsionfit import profiling
+    profiling.enable(filename='profile.json', interval=60)
+    sampler.sample(10000)
+    profiling.dump('profile.json')
+    print(profiling.summary())
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import json
+import math
+import time
+import functools
+
+N_BINS = 32
+
+
+class PhaseStats(object):
+    """
+    Timing statistics of a phase
+
+    Attributes
+    ----------
+    count: int
+    total: float. seconds
+    min: float. seconds
+    max: float. seconds
+    histogram: list of counts. Bin i counts calls that took less than 2**i microseconds (and at least 2**(i-1))
+    """
+
+    __slots__ = ('count', 'total', 'min', 'max', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.histogram = [0] * N_BINS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        microseconds = seconds * 1e6
+        b = math.frexp(microseconds)[1] if microseconds >= 1 else 0
+        self.histogram[min(b, N_BINS - 1)] += 1
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.total / self.count if self.count else 0.0,
+                'min': self.min if self.count else 0.0, 'max': self.max, 'histogram_us': self.histogram}
+
+
+class Profiler(object):
+    """
+    Aggregates phase timings and counters
+
+    Attributes
+    ----------
+    enabled: bool
+    phases: dict mapping phase name to PhaseStats
+    counters: dict mapping counter name to int
+    filename: str. JSON file the profile is dumped to every interval seconds while profiling. None does not dump
+    interval: float. seconds
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.filename = None
+        self.interval = None
+        self.reset()
+
+    def reset(self):
+        self.phases = {}
+        self.counters = {}
+        self.start = time.time()
+        self._last_dump = time.perf_counter()
+
+    def record(self, name, seconds):
+        """ Add a timing of phase name """
+        try:
+            stats = self.phases[name]
+        except KeyError:
+            stats = self.phases[name] = PhaseStats()
+        stats.add(seconds)
+        if self.filename is not None and self.interval is not None:
+            now = time.perf_counter()
+            if now - self._last_dump >= self.interval:
+                self._last_dump = now
+                self.dump(self.filename)
+
+    def count(self, name, n=1):
+        """ Increment counter name by n """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        return {'start': self.start, 'time': time.time(),
+                'phases': {name: stats.to_dict() for name, stats in self.phases.items()},
+                'counters': dict(self.counters)}
+
+    def dump(self, filename):
+        """ Write the profile to a JSON file. The file is replaced atomically so it can be read during a run """
+        tmp = '{}.tmp'.format(filename)
+        with open(tmp, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+        os.replace(tmp, filename)
+
+    def summary(self):
+        """ Phases as a table ordered by decreasing total time """
+        lines = ['{:40s} {:>10s} {:>12s} {:>12s} {:>12s}'.format('phase', 'count', 'total (s)', 'mean (ms)',
+                                                                  'max (ms)')]
+        for name, stats in sorted(self.phases.items(), key=lambda item: -item[1].total):
+            lines.append('{:40s} {:10d} {:12.4f} {:12.4f} {:12.4f}'.format(name, stats.count, stats.total,
+                                                                           1e3 * stats.total / stats.count,
+                                                                           1e3 * stats.max))
+        for name, n in sorted(self.counters.items()):
+            lines.append('{:40s} {:10d}'.format(name, n))
+        return '\n'.join(lines)
+
+
+profiler = Profiler()
+
+
+class _Phase(object):
+    """ Context manager that times a phase """
+
+    __slots__ = ('name', '_start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler.record(self.name, time.perf_counter() - self._start)
+        return False
+
+
+class _NullPhase(object):
+    """ Context manager that does nothing """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+def phase(name):
+    """
+    Context manager that times the block as phase name when profiling is enabled
+
+    :param name: str
+    """
+    if profiler.enabled:
+        return _Phase(name)
+    return _null_phase
+
+
+def timed(name):
+    """
+    Decorator that times every call of the function as phase name when profiling is enabled
+
+    :param name: str
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """ Increment counter name by n when profiling is enabled """
+    if profiler.enabled:
+        profiler.count(name, n)
+
+
+def enable(filename=None, interval=None, reset=True):
+    """
+    Turn on profiling
+
+    :param filename: str. JSON file to dump the profile to every interval seconds. Default None
+    :param interval: float. seconds. Default None only dumps when dump is called
+    :param reset: bool. Discard timings of earlier runs. Default True
+    """
+    if reset:
+        profiler.reset()
+    profiler.filename = filename
+    profiler.interval = interval
+    profiler.enabled = True
+
+
+def disable():
+    """ Turn off profiling. The timings are kept """
+    profiler.enabled = False
+
+
+def dump(filename):
+    """ Write the profile to a JSON file """
+    profiler.dump(filename)
+
+
+def summary():
+    """ Phases as a table ordered by decreasing total time """
+    return profiler.summary()
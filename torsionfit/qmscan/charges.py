@@ -0,0 +1,148 @@
+"""
+Persistent cache of AM1 partial charges and Wiberg bond orders
+
+Charging a molecule (openmoltools.openeye.get_charges) is the most expensive step of fragmenting a molecule. The charged
+molecule, its partial charges and the Wiberg bond order of every bond are stored in a sqlite file keyed by canonical
+isomeric SMILES so molecules are charged once across runs and across parents that share fragments.
+
+Example:
+    cache = ChargeCache('charges.sqlite')
+    charged, frags = generate_fragments(mol, cache=cache)
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import json
+import time
+import sqlite3
+from openeye import oechem
+from openmoltools import openeye
+from torsionfit.utils import logger
+
+
+class ChargeCache(object):
+    """
+    Charged molecules keyed by canonical isomeric SMILES
+
+    Attributes
+    ----------
+    filename: str
+        path to sqlite file
+    hits: int
+    misses: int
+    """
+
+    def __init__(self, filename=':memory:'):
+        """
+
+        Parameters
+        ----------
+        filename : str
+            path to sqlite file. Will be created if it does not exist. Default ':memory:' only caches in this session
+        """
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS charges
+                             (smiles TEXT PRIMARY KEY, mol BLOB, charges TEXT, wbo TEXT, added REAL)""")
+        self.conn.commit()
+        self._mols = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def smiles(mol):
+        """ Canonical isomeric SMILES of mol """
+        return oechem.OECreateIsoSmiString(mol)
+
+    def __contains__(self, smiles):
+        if smiles in self._mols:
+            return True
+        return self.conn.execute("SELECT 1 FROM charges WHERE smiles=?", (smiles,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM charges").fetchone()[0]
+
+    def get(self, smiles):
+        """
+        Charged molecule with partial charges and 'WibergBondOrder' data on every bond
+
+        :param smiles: str. canonical isomeric SMILES
+        :return: OEMol (a copy that can be modified) or None if it is not in the cache
+        """
+        if smiles not in self._mols:
+            row = self.conn.execute("SELECT mol, charges, wbo FROM charges WHERE smiles=?", (smiles,)).fetchone()
+            if row is None:
+                return None
+            mol = oechem.OEMol()
+            oechem.OEReadMolFromBytes(mol, '.oeb', bytes(row[0]))
+            self._mols[smiles] = (mol, json.loads(row[1]), json.loads(row[2]))
+        mol, charges, wbo = self._mols[smiles]
+        # Generic data is not always kept by copies so charges and bond orders are set again
+        mol = oechem.OEMol(mol)
+        for atom in mol.GetAtoms():
+            atom.SetPartialCharge(charges[atom.GetIdx()])
+        for bond in mol.GetBonds():
+            bond.SetData('WibergBondOrder', wbo[bond.GetIdx()])
+        return mol
+
+    def add(self, smiles, charged):
+        """
+        Add or replace a charged molecule
+
+        :param smiles: str. canonical isomeric SMILES
+        :param charged: OEMol with partial charges and 'WibergBondOrder' data on every bond
+        """
+        charges = [0.0] * charged.GetMaxAtomIdx()
+        for atom in charged.GetAtoms():
+            charges[atom.GetIdx()] = atom.GetPartialCharge()
+        wbo = [None] * charged.GetMaxBondIdx()
+        for bond in charged.GetBonds():
+            wbo[bond.GetIdx()] = bond.GetData('WibergBondOrder')
+        self.conn.execute("INSERT OR REPLACE INTO charges VALUES (?, ?, ?, ?, ?)",
+                          (smiles, sqlite3.Binary(oechem.OEWriteMolToBytes('.oeb', charged)), json.dumps(charges),
+                           json.dumps(wbo), time.time()))
+        self.conn.commit()
+        self._mols[smiles] = (oechem.OEMol(charged), charges, wbo)
+
+    def get_charges(self, mol, **kwargs):
+        """
+        Charged copy of mol. Charges are only computed if the molecule is not in the cache
+
+        :param mol: OEMol
+        :param kwargs: keyword arguments for openmoltools.openeye.get_charges. Default keep_confs=1
+        :return: charged OEMol
+        """
+        smiles = self.smiles(mol)
+        charged = self.get(smiles)
+        if charged is not None:
+            self.hits += 1
+            return charged
+        self.misses += 1
+        kwargs.setdefault('keep_confs', 1)
+        start = time.time()
+        charged = openeye.get_charges(mol, **kwargs)
+        logger().debug('charged {} in {:.1f} s'.format(smiles, time.time() - start))
+        self.add(smiles, charged)
+        return charged
+
+    def close(self):
+        self.conn.close()
+
+
+def get_charges(mol, cache=None):
+    """
+    Charge mol with AM1 and compute Wiberg bond orders, using cache if given
+
+    :param mol: OEMol
+    :param cache: ChargeCache or str (path to sqlite file of cache). Default None does not cache
+    :return: charged OEMol
+    """
+    if cache is None:
+        return openeye.get_charges(mol, keep_confs=1)
+    if isinstance(cache, ChargeCache):
+        return cache.get_charges(mol)
+    cache = ChargeCache(cache)
+    charged = cache.get_charges(mol)
+    cache.close()
+    return charged
@@ -15,10 +15,10 @@ def start_psi4_calculation(path, input_file, threads=4):
     input_file = os.path.join(path, input_file)
     output_file = os.path.join(path, output_file)
     psi4_binary = which('psi4', mode=os.X_OK)
-    cmd = psi4_binary + ' ' + input_file + ' -o ' + output_file + ' -n' + threads
-    process = subprocess.Popen(cmd, stderr=subprocess.PIPE, shell=True)
+    cmd = [psi4_binary, input_file, '-o', output_file, '-n', str(threads)]
+    process = subprocess.Popen(cmd, stderr=subprocess.PIPE)
     output = process.communicate()
-    return(cmd, process.wait(), output)
+    return(' '.join(cmd), process.wait(), output)
 
 def run_psi4_distributed(directory, threads):
     to_submit = []
@@ -0,0 +1,252 @@
+"""
+Deduplication of torsion scan points
+
+Torsions that are equivalent by a proper symmetry of the molecule give the same relaxed torsion scan, and angles that
+are the same modulo 360 (0 and 360) give the same geometry. `dedup_scan` finds these duplicates in a scan tree written by
+generate_torsions (root/a_b_c_d/angle/mol_a_b_c_d_angle.pdb) and writes a mapping from every duplicate scan point to the
+point that will be computed. `generate_scan_input` skips the duplicates and `parse_psi4_out` expands the mapping back
+into the full scan, permuting the atoms of the computed geometry onto the duplicate torsion.
+
+Color refinement of the molecular graph only proposes candidates. It cannot tell apart prochiral atoms that are related
+by a mirror (the two hydrogens of a CH2), and a mirror maps a scan at theta to a scan at -theta. Candidates are only
+merged when there is an automorphism of the graph that maps one torsion onto the other and keeps the handedness of every
+stereo center in the starting geometry.
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import json
+import itertools
+from fnmatch import fnmatch
+import numpy as np
+from torsionfit.utils import logger
+
+# Covalent radii in nm used to guess bonds when the starting geometry does not have any
+COVALENT_RADII = {'H': 0.031, 'C': 0.076, 'N': 0.071, 'O': 0.066, 'F': 0.057, 'P': 0.107, 'S': 0.105, 'Cl': 0.102,
+                  'Br': 0.120, 'I': 0.139}
+
+
+def guess_bonds(xyz, elements, tolerance=1.2):
+    """
+    Guess bonds from distances
+
+    :param xyz: np.array (n_atoms, 3) in nm
+    :param elements: list of element symbols
+    :param tolerance: float. atoms are bonded if their distance is less than tolerance * sum of covalent radii
+    :return: list of (i, j) tuples
+    """
+    radii = np.array([COVALENT_RADII.get(e, 0.075) for e in elements])
+    distances = np.linalg.norm(xyz[:, np.newaxis] - xyz[np.newaxis], axis=-1)
+    bonded = distances < tolerance * (radii[:, np.newaxis] + radii[np.newaxis])
+    i, j = np.nonzero(np.triu(bonded, k=1))
+    return list(zip(i.tolist(), j.tolist()))
+
+
+def atom_classes(elements, bonds):
+    """
+    Symmetry classes of atoms by color refinement of the molecular graph (atoms with the same class are equivalent).
+
+    :param elements: list of element symbols
+    :param bonds: list of (i, j) tuples
+    :return: list of int. class of every atom
+    """
+    neighbors = [[] for _ in elements]
+    for i, j in bonds:
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+    labels = {e: i for i, e in enumerate(sorted(set(elements)))}
+    classes = [labels[e] for e in elements]
+    n_classes = len(set(classes))
+    while True:
+        signatures = [(classes[i], tuple(sorted(classes[j] for j in neighbors[i]))) for i in range(len(elements))]
+        labels = {s: i for i, s in enumerate(sorted(set(signatures)))}
+        classes = [labels[s] for s in signatures]
+        if len(labels) == n_classes:
+            return classes
+        n_classes = len(labels)
+
+
+def canonical_torsion(torsion, classes):
+    """
+    Canonical key of a torsion. Torsions with the same key are equivalent by the symmetry of the molecular graph but may
+    be mirror images (see proper_permutation).
+
+    :param torsion: sequence of 4 atom indices (0 based)
+    :param classes: list of atom classes (atom_classes)
+    :return: tuple
+    """
+    key = tuple(classes[i] for i in torsion)
+    return min(key, tuple(reversed(key)))
+
+
+def _handedness(xyz, center, neighbors, tolerance=0.1):
+    """ Sign of the triple product of the bond vectors from center to three neighbors. 0 if they are (almost) planar """
+    vectors = xyz[list(neighbors)] - xyz[center]
+    vectors /= np.linalg.norm(vectors, axis=1)[:, np.newaxis]
+    det = np.linalg.det(vectors)
+    if abs(det) < tolerance:
+        return 0
+    return int(np.sign(det))
+
+
+def stereo_centers(xyz, bonds):
+    """
+    Handedness of every atom with three or more neighbors
+
+    :param xyz: np.array (n_atoms, 3)
+    :param bonds: list of (i, j) tuples
+    :return: list of (center, (n1, n2, n3), sign) for every non planar triple of neighbors
+    """
+    neighbors = {}
+    for i, j in bonds:
+        neighbors.setdefault(i, []).append(j)
+        neighbors.setdefault(j, []).append(i)
+    centers = []
+    for center in sorted(neighbors):
+        for triple in itertools.combinations(sorted(neighbors[center]), 3):
+            sign = _handedness(xyz, center, triple)
+            if sign:
+                centers.append((center, triple, sign))
+    return centers
+
+
+def proper_permutation(source, target, elements, bonds, xyz, centers=None):
+    """
+    Automorphism of the molecular graph that maps torsion source onto torsion target (in either direction) and keeps the
+    handedness of all stereo centers of xyz. Mirror images (theta -> -theta) are not proper.
+
+    :param source: sequence of 4 atom indices (0 based)
+    :param target: sequence of 4 atom indices (0 based)
+    :param elements: list of element symbols
+    :param bonds: list of (i, j) tuples
+    :param xyz: np.array (n_atoms, 3) starting geometry
+    :param centers: stereo_centers of xyz. Default None calculates them
+    :return: list. atom i of source geometry is atom permutation[i] of target geometry. None if there is no proper
+    automorphism
+    """
+    if list(source) == list(target):
+        return list(range(len(elements)))
+    import networkx as nx
+    from networkx.algorithms import isomorphism
+    if centers is None:
+        centers = stereo_centers(xyz, bonds)
+
+    def graph(torsion):
+        g = nx.Graph()
+        g.add_nodes_from((i, {'label': e}) for i, e in enumerate(elements))
+        for position, i in enumerate(torsion):
+            g.nodes[i]['label'] = (elements[i], position)
+        g.add_edges_from(bonds)
+        return g
+
+    g_source = graph(source)
+    for t in (list(target), list(reversed(target))):
+        matcher = isomorphism.GraphMatcher(g_source, graph(t), node_match=lambda a, b: a['label'] == b['label'])
+        for mapping in matcher.isomorphisms_iter():
+            if all(_handedness(xyz, mapping[c], [mapping[n] for n in triple]) == sign
+                   for c, triple, sign in centers):
+                return [mapping[i] for i in range(len(elements))]
+    return None
+
+
+def find_scan_points(root, pattern='*.pdb'):
+    """
+    Find starting geometries of a scan tree
+
+    :param root: str. root of scan tree (root/a_b_c_d/angle/file)
+    :param pattern: str. Default '*.pdb'
+    :return: dict mapping 'a_b_c_d/angle' to path
+    """
+    points = {}
+    for path, subdir, files in os.walk(root):
+        for name in files:
+            if fnmatch(name, pattern):
+                filename = os.path.join(path, name)
+                tor_name, angle = filename.split(os.sep)[-3:-1]
+                points[tor_name + '/' + angle] = filename
+    return points
+
+
+def _torsion(key):
+    """ 1 based atom indices and angle of a scan point key """
+    tor_name, angle = key.split('/')
+    return [int(i) for i in tor_name.split('_')], int(angle)
+
+
+def dedup_scan(root, structure=None, pattern='*.pdb', mapping_file='scan_mapping.json'):
+    """
+    Find duplicate scan points in a scan tree and write the mapping to root/mapping_file
+
+    :param root: str. root of scan tree (root/a_b_c_d/angle/file)
+    :param structure: str or mdtraj.Topology. Used for bonds. Default None uses bonds of the starting geometries or
+    guesses them from distances
+    :param pattern: str. Default '*.pdb'
+    :param mapping_file: str. Default scan_mapping.json. If None, mapping is not written
+    :return: dict mapping every duplicate 'a_b_c_d/angle' to {'source': 'a_b_c_d/angle', 'torsion': [a, b, c, d],
+    'angle': angle, 'permutation': list} where source is the scan point that is computed and atom i of its geometry is
+    atom permutation[i] of the duplicate
+    """
+    points = find_scan_points(root, pattern)
+    if not points:
+        raise Exception("There are no starting geometries in {}".format(root))
+
+    import mdtraj as md
+    traj = md.load(points[sorted(points)[0]])
+    if structure is None:
+        topology = traj.topology
+    elif isinstance(structure, str):
+        topology = md.load_psf(structure) if structure.endswith('psf') else md.load(structure).topology
+    else:
+        topology = structure
+    elements = [atom.element.symbol for atom in topology.atoms]
+    bonds = [(bond[0].index, bond[1].index) for bond in topology.bonds]
+    if not bonds:
+        bonds = guess_bonds(traj.xyz[0], elements)
+    classes = atom_classes(elements, bonds)
+    xyz = traj.xyz[0]
+    centers = stereo_centers(xyz, bonds)
+
+    groups = {}
+    for key in points:
+        torsion, angle = _torsion(key)
+        group = (canonical_torsion([i - 1 for i in torsion], classes), angle % 360)
+        groups.setdefault(group, []).append(key)
+
+    mapping = {}
+    permutations = {}
+    for group, keys in groups.items():
+        # compute the lowest torsion at the angle in [0, 360) of every set of properly equivalent torsions
+        keys = sorted(keys, key=lambda k: (_torsion(k)[1] >= 360, _torsion(k)))
+        sources = []
+        for key in keys:
+            torsion, angle = _torsion(key)
+            for source in sources:
+                pair = (source.split('/')[0], key.split('/')[0])
+                if pair not in permutations:
+                    permutations[pair] = proper_permutation([i - 1 for i in _torsion(source)[0]],
+                                                            [i - 1 for i in torsion], elements, bonds, xyz, centers)
+                if permutations[pair] is not None:
+                    mapping[key] = {'source': source, 'torsion': torsion, 'angle': angle,
+                                    'permutation': permutations[pair]}
+                    break
+            else:
+                sources.append(key)
+    logger().info('{} of {} scan points are duplicates'.format(len(mapping), len(points)))
+
+    if mapping_file is not None:
+        with open(os.path.join(root, mapping_file), 'w') as f:
+            json.dump(mapping, f, indent=2, sort_keys=True)
+    return mapping
+
+
+def load_mapping(mapping):
+    """
+    :param mapping: str (path to mapping json) or dict
+    :return: dict
+    """
+    if isinstance(mapping, dict):
+        return mapping
+    with open(mapping) as f:
+        return json.load(f)
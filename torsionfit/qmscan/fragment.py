@@ -27,23 +27,24 @@ from openeye import oedepict
 from openeye import oegrapheme
 from openeye import oemedchem
 
-import networkx as nx
 from openmoltools import openeye
+from torsionfit.qmscan.charges import get_charges
+from torsionfit.qmscan.fragment_graph import connected_subgraphs, BondTable, fragment_bonds
 
-import yaml
 import os
-from pkg_resources import resource_filename
 import copy
 import itertools
 
 
-def generate_fragments(mol):
+def generate_fragments(mol, cache=None):
     """
     This function generates fragments from a molecule.
 
     Parameters
     ----------
     mol: OEMol
+    cache: ChargeCache or str (path to sqlite file of cache)
+        cache of charges and Wiberg bond orders. Default None will charge molecule
 
     Returns
     -------
@@ -51,7 +52,7 @@ def generate_fragments(mol):
     frags: dict of AtomBondSet mapped to rotatable bond index the fragment was built up from.
     """
 
-    charged = openeye.get_charges(mol, keep_confs=1)
+    charged = get_charges(mol, cache=cache)
 
     tagged_rings, tagged_fgroups = tag_molecule(charged)
 
@@ -85,6 +86,8 @@ def _tag_fgroups(mol, fgroups_smarts=None):
     """
     if not fgroups_smarts:
         # Load yaml file
+        import yaml
+        from pkg_resources import resource_filename
         fn = resource_filename('torsionfit', os.path.join('qmscan', 'fgroup_smarts.yml'))
         fgroups_smarts = yaml.safe_load(open(fn, 'r'))
     fgroup_tagged = {}
@@ -678,6 +681,7 @@ def OeMolToGraph(oemol):
     G: NetworkX Graph of molecule
 
     """
+    import networkx as nx
     G = nx.Graph()
     for atom in oemol.GetAtoms():
         G.add_node(atom.GetIdx(), name=atom.GetName())
@@ -706,21 +710,72 @@ def FragGraph(G, bondOrderThreshold=1.2):
     subgraphs: list of subgraphs
     """
     ebunch = []
-    for node in G.edge:
+    for node in G.adj:
         if G.degree(node) <= 1:
             continue
-        for node2 in G.edge[node]:
-            if G.edge[node][node2]['weight'] < bondOrderThreshold and G.degree(node2) >1 \
-                    and not G.edge[node][node2]['aromatic'] and not G.edge[node][node2]['in_ring']\
-                    and not G.edge[node][node2]['fgroup']:
+        for node2 in G.adj[node]:
+            if G.adj[node][node2]['weight'] < bondOrderThreshold and G.degree(node2) >1 \
+                    and not G.adj[node][node2]['aromatic'] and not G.adj[node][node2]['in_ring']\
+                    and not G.adj[node][node2]['fgroup']:
                 ebunch.append((node, node2))
     # Cut molecule
     G.remove_edges_from(ebunch)
     # Generate fragments
-    subgraphs = list(nx.connected_component_subgraphs(G))
+    import networkx as nx
+    subgraphs = [G.subgraph(c).copy() for c in nx.connected_components(G)]
     return subgraphs
 
 
+def OeMolToBondTable(oemol):
+    """
+    Convert charged molecule to array backed bond list with Wiberg bond orders
+
+    Parameters
+    ----------
+    oemol: charged OEMolGraph
+
+    Returns
+    -------
+    table: fragment_graph.BondTable
+    """
+    atoms, wbo, index, aromatic, in_ring, fgroup = [], [], [], [], [], []
+    for bond in oemol.GetBonds():
+        atoms.append((bond.GetBgnIdx(), bond.GetEndIdx()))
+        wbo.append(bond.GetData("WibergBondOrder"))
+        index.append(bond.GetIdx())
+        aromatic.append(bond.IsAromatic())
+        in_ring.append(bond.IsInRing())
+        fgroup.append(bond.HasData('fgroup') and bool(bond.GetData('fgroup')))
+    return BondTable(oemol.GetMaxAtomIdx(), atoms, wbo, index=index, aromatic=aromatic, in_ring=in_ring,
+                     fgroup=fgroup)
+
+
+def FragmentsToAtomBondSets(oemol, fragments):
+    """
+    Build Openeye AtomBondSets from atom and bond index arrays
+
+    Parameters
+    ----------
+    oemol: Openeye OEMolGraph
+    fragments: list of (atom indices, bond indices) (fragment_graph.fragment_bonds)
+
+    Returns
+    -------
+    frags: list of Openeye AtomBondSets
+    """
+    atoms = {atom.GetIdx(): atom for atom in oemol.GetAtoms()}
+    bonds = {bond.GetIdx(): bond for bond in oemol.GetBonds()}
+    frags = []
+    for atom_indices, bond_indices in fragments:
+        atomBondSet = oechem.OEAtomBondSet()
+        for idx in atom_indices:
+            atomBondSet.AddAtom(atoms[int(idx)])
+        for idx in bond_indices:
+            atomBondSet.AddBond(bonds[int(idx)])
+        frags.append(atomBondSet)
+    return frags
+
+
 def subgraphToAtomBondSet(graph, subgraph, oemol):
     """
     Build Openeye AtomBondSet from subrgaphs for enumerating fragments recipe
@@ -737,15 +792,15 @@ def subgraphToAtomBondSet(graph, subgraph, oemol):
     """
     # Build openeye atombondset from subgraphs
     atomBondSet = oechem.OEAtomBondSet()
-    for node in subgraph.node:
+    for node in subgraph.nodes:
         atomBondSet.AddAtom(oemol.GetAtom(oechem.OEHasAtomIdx(node)))
     for node1, node2 in subgraph.edges():
-        index = graph.edge[node1][node2]['index']
+        index = graph.adj[node1][node2]['index']
         atomBondSet.AddBond(oemol.GetBond(oechem.OEHasBondIdx(index)))
     return atomBondSet
 
 
-def SmilesToFragments(smiles, fgroup_smarts, bondOrderThreshold=1.2, chargesMol=True):
+def SmilesToFragments(smiles, fgroup_smarts, bondOrderThreshold=1.2, chargesMol=True, cache=None):
     """
     Fragment molecule at bonds below Bond Order Threshold
 
@@ -753,6 +808,8 @@ def SmilesToFragments(smiles, fgroup_smarts, bondOrderThreshold=1.2, chargesMol=
     ----------
     smiles: str
         smiles string of molecule to fragment
+    cache: ChargeCache or str (path to sqlite file of cache)
+        cache of charges and Wiberg bond orders. Default None will charge molecule
 
     Returns
     -------
@@ -762,18 +819,14 @@ def SmilesToFragments(smiles, fgroup_smarts, bondOrderThreshold=1.2, chargesMol=
     # Charge molecule
     mol = oechem.OEGraphMol()
     oemol = openeye.smiles_to_oemol(smiles)
-    charged = openeye.get_charges(oemol, keep_confs=1)
+    charged = get_charges(oemol, cache=cache)
 
     # Tag functional groups
-    tag_fgroups(charged, fgroups_smarts=fgroup_smarts)
+    _tag_fgroups(charged, fgroups_smarts=fgroup_smarts)
 
     # Generate fragments
-    G = OeMolToGraph(charged)
-    subraphs = FragGraph(G, bondOrderThreshold=bondOrderThreshold)
-
-    frags = []
-    for subraph in subraphs:
-        frags.append(subgraphToAtomBondSet(G, subraph, charged))
+    fragments = fragment_bonds(OeMolToBondTable(charged), threshold=bondOrderThreshold)
+    frags = FragmentsToAtomBondSets(charged, fragments)
 
     if chargesMol:
         return frags, charged
@@ -945,54 +998,81 @@ def CombineAndConnectAtomBondSets(fraglist):
 
     # add connecting bonds
 
-    for atomA in combined.GetAtoms():
-        for atomB in combined.GetAtoms():
-            if atomA.GetIdx() < atomB.GetIdx():
-                continue
+    for atom in combined.GetAtoms():
+        for bond in atom.GetBonds():
+            if combined.HasAtom(bond.GetNbr(atom)) and not combined.HasBond(bond):
+                combined.AddBond(bond)
 
-            bond = atomA.GetBond(atomB)
-            if bond is None:
-                continue
-            if combined.HasBond(bond):
-                continue
+    return combined
 
-            combined.AddBond(bond)
 
-    return combined
+def FragmentAdjacencyGraph(fraglist):
+    """
+    Build fragment adjacency graph with the rotatable bonds of every fragment and of the bonds connecting fragments
+
+    Parameters
+    ----------
+    fraglist: list of OE AtomBondSet
+
+    Returns
+    -------
+    edges: list of (i, j) tuples of adjacent fragments
+    node_rotors: list of sets of rotatable bond indices in every fragment (including bonds between its atoms)
+    edge_rotors: dict mapping (i, j) to set of rotatable bond indices connecting fragments i and j
+    """
+    atom_frags = {}
+    for i, frag in enumerate(fraglist):
+        for atom in frag.GetAtoms():
+            atom_frags.setdefault(atom.GetIdx(), set()).add(i)
+
+    node_rotors = [set(bond.GetIdx() for bond in CombineAndConnectAtomBondSets([frag]).GetBonds() if bond.IsRotor())
+                   for frag in fraglist]
+    edge_rotors = {}
+    for i, frag in enumerate(fraglist):
+        for atom in frag.GetAtoms():
+            for bond in atom.GetBonds():
+                for j in atom_frags.get(bond.GetNbr(atom).GetIdx(), ()):
+                    if i == j or bond.GetIdx() in node_rotors[i] or bond.GetIdx() in node_rotors[j]:
+                        continue
+                    rotors = edge_rotors.setdefault((min(i, j), max(i, j)), set())
+                    if bond.IsRotor():
+                        rotors.add(bond.GetIdx())
+    return list(edge_rotors), node_rotors, edge_rotors
 
 
 def GetFragmentAtomBondSetCombinations(fraglist, MAX_ROTORS=3, MIN_ROTORS=1):
     """
     Enumerate connected combinations from list of fragments
+
+    Connected combinations are enumerated on the fragment adjacency graph and combinations with more than MAX_ROTORS
+    rotatable bonds are pruned while they grow.
+
     Parameters
     ----------
     mol: OEMolGraph
     fraglist: list of OE AtomBondSet
     MAX_ROTORS: int
-        min rotors in each fragment combination
-    MIN_ROTORS: int
         max rotors in each fragment combination
+    MIN_ROTORS: int
+        min rotors in each fragment combination
 
     Returns
     -------
     fragcombs: list of connected combinations (OE AtomBondSet)
     """
 
-    fragcombs = []
-
     nrfrags = len(fraglist)
-    for n in range(1, nrfrags):
-
-        for fragcomb in combinations(fraglist, n):
-
-            if IsAdjacentAtomBondSetCombination(fragcomb):
+    edges, node_rotors, edge_rotors = FragmentAdjacencyGraph(fraglist)
 
-                frag = CombineAndConnectAtomBondSets(fragcomb)
-
-                if (CountRotorsInFragment(frag) <= MAX_ROTORS) and (CountRotorsInFragment(frag) >= MIN_ROTORS):
-                    fragcombs.append(frag)
-
-    return fragcombs
+    fragcombs = []
+    for fragcomb, rotors in connected_subgraphs(nrfrags, edges, node_items=node_rotors, edge_items=edge_rotors,
+                                                max_items=MAX_ROTORS, max_size=nrfrags - 1):
+        if len(rotors) >= MIN_ROTORS:
+            fragcombs.append(fragcomb)
+
+    # Same order as enumerating combinations of increasing size
+    fragcombs.sort(key=lambda fragcomb: (len(fragcomb), fragcomb))
+    return [CombineAndConnectAtomBondSets([fraglist[i] for i in fragcomb]) for fragcomb in fragcombs]
 
 
 def GetFragmentationFunction(itf):
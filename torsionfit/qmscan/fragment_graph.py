@@ -0,0 +1,168 @@
+"""
+Graph algorithms for fragmentation
+
+Fragments of a molecule are the nodes of a fragment adjacency graph. Connected combinations of fragments are the
+connected induced subgraphs of that graph and are enumerated with ESU (Wernicke, IEEE/ACM Trans Comput Biol Bioinform
+3, 347 (2006)) which generates every connected subgraph exactly once. Every node and edge can carry items (rotatable
+bonds) and subgraphs with more than max_items items are pruned while they grow, since adding a node never removes items.
+
+Molecules are fragmented on an array backed bond list (BondTable) by cutting bonds with a low Wiberg bond order and
+finding the connected components with union-find.
+
+This module does not need OpenEye. fragment.py builds the bond tables and converts fragments to AtomBondSets.
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import numpy as np
+
+
+def connected_subgraphs(n_nodes, edges, node_items=None, edge_items=None, max_items=None, max_size=None):
+    """
+    Enumerate connected induced subgraphs
+
+    :param n_nodes: int
+    :param edges: list of (i, j) tuples
+    :param node_items: list of sets of items of every node. Default None
+    :param edge_items: dict mapping (i, j) with i < j to set of items of the edge. Default None
+    :param max_items: int. subgraphs with more items are not generated. Default None
+    :param max_size: int. maximum number of nodes. Default None
+    :return: generator of (tuple of sorted nodes, set of items)
+    """
+    if node_items is None:
+        node_items = [set() for _ in range(n_nodes)]
+    if edge_items is None:
+        edge_items = {}
+    if max_size is None:
+        max_size = n_nodes
+    neighbors = [set() for _ in range(n_nodes)]
+    for i, j in edges:
+        if i != j:
+            neighbors[i].add(j)
+            neighbors[j].add(i)
+
+    def items_with(subgraph, items, node):
+        new = set(items) | node_items[node]
+        for other in neighbors[node] & subgraph:
+            new |= edge_items.get((min(node, other), max(node, other)), set())
+        return new
+
+    def extend(subgraph, items, extension, root, adjacent):
+        yield tuple(sorted(subgraph)), items
+        if len(subgraph) == max_size:
+            return
+        extension = set(extension)
+        while extension:
+            node = extension.pop()
+            new_items = items_with(subgraph, items, node)
+            if max_items is not None and len(new_items) > max_items:
+                # every subgraph in this branch contains node
+                continue
+            exclusive = set(n for n in neighbors[node] if n > root and n not in adjacent)
+            for subgraph_ in extend(subgraph | {node}, new_items, extension | exclusive, root,
+                                    adjacent | neighbors[node] | {node}):
+                yield subgraph_
+
+    if max_size < 1:
+        return
+    for root in range(n_nodes):
+        items = set(node_items[root])
+        if max_items is not None and len(items) > max_items:
+            continue
+        for subgraph in extend({root}, items, set(n for n in neighbors[root] if n > root), root,
+                               neighbors[root] | {root}):
+            yield subgraph
+
+
+class BondTable(object):
+    """
+    Array backed bond list of a molecule
+
+    Attributes
+    ----------
+    n_atoms: int
+    atoms: np.array (n_bonds, 2) of atom indices
+    wbo: np.array (n_bonds) of Wiberg bond orders
+    index: np.array (n_bonds) of bond indices in the molecule
+    aromatic: np.array (n_bonds) of bool
+    in_ring: np.array (n_bonds) of bool
+    fgroup: np.array (n_bonds) of bool. True if the bond is in a functional group
+    """
+
+    def __init__(self, n_atoms, atoms, wbo, index=None, aromatic=None, in_ring=None, fgroup=None):
+        self.n_atoms = n_atoms
+        self.atoms = np.asarray(atoms, dtype=int).reshape(-1, 2)
+        n_bonds = len(self.atoms)
+        self.wbo = np.asarray(wbo, dtype=float)
+        self.index = np.arange(n_bonds) if index is None else np.asarray(index, dtype=int)
+        self.aromatic = np.zeros(n_bonds, dtype=bool) if aromatic is None else np.asarray(aromatic, dtype=bool)
+        self.in_ring = np.zeros(n_bonds, dtype=bool) if in_ring is None else np.asarray(in_ring, dtype=bool)
+        self.fgroup = np.zeros(n_bonds, dtype=bool) if fgroup is None else np.asarray(fgroup, dtype=bool)
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def degree(self):
+        """ Number of bonds of every atom """
+        return np.bincount(self.atoms.ravel(), minlength=self.n_atoms)
+
+    def cut_mask(self, threshold=1.2):
+        """
+        Bonds that are cut: Wiberg bond order below threshold between non terminal atoms and not aromatic, in a ring or
+        in a functional group
+
+        :param threshold: float. Default 1.2
+        :return: np.array (n_bonds) of bool
+        """
+        degree = self.degree()
+        return (self.wbo < threshold) & (degree[self.atoms[:, 0]] > 1) & (degree[self.atoms[:, 1]] > 1) & \
+            ~self.aromatic & ~self.in_ring & ~self.fgroup
+
+
+def union_find(n_atoms, edges):
+    """
+    Connected components with union-find
+
+    :param n_atoms: int
+    :param edges: np.array (n_edges, 2)
+    :return: np.array (n_atoms) of component labels, numbered in order of the lowest atom index in every component
+    """
+    parent = list(range(n_atoms))
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    for i, j in np.asarray(edges, dtype=int).reshape(-1, 2).tolist():
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            # the lower index is the root so roots are the lowest atom of every component
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    roots = np.array([find(i) for i in range(n_atoms)], dtype=int)
+    _, labels = np.unique(roots, return_inverse=True)
+    return labels.reshape(-1)
+
+
+def fragment_bonds(table, threshold=1.2):
+    """
+    Fragment a molecule at bonds with Wiberg bond order below threshold
+
+    :param table: BondTable
+    :param threshold: float. Default 1.2
+    :return: list of (np.array of atom indices, np.array of bond indices) of every fragment in order of the lowest
+    atom index
+    """
+    kept = ~table.cut_mask(threshold)
+    labels = union_find(table.n_atoms, table.atoms[kept])
+    bond_labels = labels[table.atoms[kept, 0]]
+    kept_index = table.index[kept]
+    atom_order = np.argsort(labels, kind='stable')
+    atom_splits = np.cumsum(np.bincount(labels))[:-1]
+    bond_order = np.argsort(bond_labels, kind='stable')
+    bond_splits = np.cumsum(np.bincount(bond_labels, minlength=labels.max() + 1))[:-1]
+    return list(zip(np.split(atom_order, atom_splits), np.split(kept_index[bond_order], bond_splits)))
@@ -0,0 +1,197 @@
+"""
+Fragment library of many parent molecules
+
+Streams molecules from an SD or SMILES file through charging, tag_molecule, fragment building and SMILES output in a
+process pool. Fragments are deduplicated by canonical isomeric SMILES across the whole library and stored in one indexed
+sqlite file with the parents and rotatable bonds every unique fragment covers. Parents that are already in the library
+are skipped so an interrupted run can be continued.
+
+Example:
+    library = fragment_library('drugs.smi', 'fragments.sqlite', processes=16, cache='charges.sqlite')
+    for smiles, n_parents in library.fragments():
+        ...
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import time
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+try:
+    import openeye.oechem as oechem
+    from openmoltools import openeye
+    from torsionfit.qmscan import fragment
+except ImportError:
+    pass
+from torsionfit.utils import logger
+
+
+class FragmentLibrary(object):
+    """
+    Indexed sqlite file of unique fragments and the parents and bonds they cover
+
+    Tables
+    ------
+    parents: id, title, smiles, n_fragments, error
+    fragments: id, smiles (unique)
+    coverage: fragment, parent, bond (index of rotatable bond in the charged parent)
+    """
+
+    def __init__(self, filename):
+        """
+
+        Parameters
+        ----------
+        filename : str
+            path to sqlite file. Will be created if it does not exist
+        """
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS parents
+                (id INTEGER PRIMARY KEY, title TEXT, smiles TEXT UNIQUE, n_fragments INT, error TEXT, added REAL);
+            CREATE TABLE IF NOT EXISTS fragments (id INTEGER PRIMARY KEY, smiles TEXT UNIQUE);
+            CREATE TABLE IF NOT EXISTS coverage (fragment INT, parent INT, bond INT);
+            CREATE INDEX IF NOT EXISTS coverage_fragment ON coverage (fragment);
+            CREATE INDEX IF NOT EXISTS coverage_parent ON coverage (parent);
+            """)
+        self.conn.commit()
+
+    def __contains__(self, smiles):
+        """ True if parent smiles is in the library """
+        return self.conn.execute("SELECT 1 FROM parents WHERE smiles=?", (smiles,)).fetchone() is not None
+
+    def __len__(self):
+        """ Number of unique fragments """
+        return self.conn.execute("SELECT COUNT(*) FROM fragments").fetchone()[0]
+
+    def add(self, title, smiles, fragments, error=None):
+        """
+        Add a parent and its fragments
+
+        Parameters
+        ----------
+        title : str
+        smiles : str
+            canonical isomeric SMILES of parent
+        fragments : dict
+            maps fragment SMILES to list of rotatable bond indices of parent the fragment was built from
+        error : str
+            error message if the parent could not be fragmented. Default None
+        """
+        cursor = self.conn.execute("INSERT OR IGNORE INTO parents (title, smiles, n_fragments, error, added) "
+                                   "VALUES (?, ?, ?, ?, ?)", (title, smiles, len(fragments), error, time.time()))
+        if cursor.rowcount == 0:
+            # duplicate parent
+            return
+        parent = cursor.lastrowid
+        for frag_smiles, bonds in fragments.items():
+            self.conn.execute("INSERT OR IGNORE INTO fragments (smiles) VALUES (?)", (frag_smiles,))
+            frag = self.conn.execute("SELECT id FROM fragments WHERE smiles=?", (frag_smiles,)).fetchone()[0]
+            self.conn.executemany("INSERT INTO coverage VALUES (?, ?, ?)", [(frag, parent, bond) for bond in bonds])
+        self.conn.commit()
+
+    def fragments(self):
+        """
+        Unique fragments
+
+        :return: list of (SMILES, number of parents) ordered by decreasing number of parents
+        """
+        return self.conn.execute("""SELECT fragments.smiles, COUNT(DISTINCT coverage.parent) AS n FROM fragments
+                                    JOIN coverage ON coverage.fragment = fragments.id
+                                    GROUP BY fragments.id ORDER BY n DESC, fragments.smiles""").fetchall()
+
+    def coverage(self, smiles):
+        """
+        Parents and bonds covered by a fragment
+
+        :param smiles: str. fragment SMILES
+        :return: list of (parent title, parent SMILES, bond index)
+        """
+        return self.conn.execute("""SELECT parents.title, parents.smiles, coverage.bond FROM coverage
+                                    JOIN fragments ON coverage.fragment = fragments.id
+                                    JOIN parents ON coverage.parent = parents.id
+                                    WHERE fragments.smiles=? ORDER BY parents.id, coverage.bond""",
+                                 (smiles,)).fetchall()
+
+    def errors(self):
+        """ list of (title, SMILES, error) of parents that could not be fragmented """
+        return self.conn.execute("SELECT title, smiles, error FROM parents WHERE error IS NOT NULL").fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def read_molecules(filename):
+    """
+    Stream molecules from a file OpenEye can read (SD, SMILES, mol2, ...)
+
+    :param filename: str
+    :return: generator of (title, canonical isomeric SMILES)
+    """
+    ifs = oechem.oemolistream(filename)
+    for mol in ifs.GetOEGraphMols():
+        yield mol.GetTitle(), oechem.OECreateIsoSmiString(mol)
+    ifs.close()
+
+
+def fragment_parent(title, smiles, cache=None):
+    """
+    Fragment one parent molecule. Runs in worker processes.
+
+    :param title: str
+    :param smiles: str
+    :param cache: str. path to sqlite file of charges.ChargeCache. Default None
+    :return: (title, smiles, dict mapping fragment SMILES to list of bond indices, error message or None)
+    """
+    try:
+        mol = openeye.smiles_to_oemol(smiles)
+        charged, frags = fragment.generate_fragments(mol, cache=cache)
+        bonds = {id(frag): bond for bond, frag in frags.items()}
+        fragments = {}
+        for frag_smiles, frag_list in fragment.frag_to_smiles(list(frags.values()), charged).items():
+            fragments[frag_smiles] = sorted(bonds[id(frag)] for frag in frag_list)
+        return title, smiles, fragments, None
+    except Exception as e:
+        return title, smiles, {}, '{}: {}'.format(type(e).__name__, e)
+
+
+def fragment_library(infile, outfile, processes=None, cache=None, max_pending=None):
+    """
+    Fragment every molecule in infile and store the unique fragments in outfile
+
+    :param infile: str. SD or SMILES file of parent molecules
+    :param outfile: str. path to sqlite file of library
+    :param processes: int. Default None uses all cores
+    :param cache: str. path to sqlite file of charges.ChargeCache shared by the workers. Default None
+    :param max_pending: int. molecules submitted to the pool at a time. Default None uses 4 * processes
+    :return: FragmentLibrary
+    """
+    library = FragmentLibrary(outfile)
+    start = time.time()
+    n_parents = 0
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 4 * processes
+    submitted = set()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = set()
+        for title, smiles in read_molecules(infile):
+            if smiles in submitted or smiles in library:
+                continue
+            submitted.add(smiles)
+            pending.add(executor.submit(fragment_parent, title, smiles, cache))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    library.add(*future.result())
+                    n_parents += 1
+        for future in pending:
+            library.add(*future.result())
+            n_parents += 1
+    logger().info('fragmented {} molecules into {} unique fragments in {:.1f} s'.format(n_parents, len(library),
+                                                                                   time.time() - start))
+    return library
@@ -0,0 +1,116 @@
+"""
+Incremental ingestion of psi4 torsion scan results
+
+Output files are parsed as soon as psi4 finishes them and appended to a persistent QMStore. The ingester can poll a
+scan tree or be registered as a callback of torsionfit.qmscan.scheduler.Scheduler.
+
+Example:
+    store = QMStore('butane_qm.sqlite')
+    ingester = Ingester(store, 'torsion_scan')
+    scheduler = Scheduler(ledger, cores=16, callbacks=[ingester])
+    ...
+    qmdb = store.to_qmdatabase('butane.psf')
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import time
+import warnings
+from fnmatch import fnmatch
+from torsionfit.qmscan.scheduler import is_complete, PSI4_SUCCESS
+from torsionfit.utils import logger
+
+
+class Ingester(object):
+    """
+    Parses finished psi4 output files in a scan tree into a QMStore.
+
+    Attributes
+    ----------
+    store: QMStore
+    directory: str. root of torsion scan
+    pattern: str. pattern of psi4 output files
+    """
+
+    def __init__(self, store, directory=None, pattern='*.out', success=PSI4_SUCCESS):
+        """
+
+        Parameters
+        ----------
+        store : QMStore or str
+            store or path to sqlite file of store
+        directory : str
+            root of torsion scan to poll. Not needed when only used as a scheduler callback
+        pattern : str
+            Default '*.out'
+        success : str
+            string psi4 writes at the end of a finished output file
+        """
+        from torsionfit.database.qmstore import QMStore
+        if not isinstance(store, QMStore):
+            store = QMStore(store)
+        self.store = store
+        self.directory = directory
+        self.pattern = pattern
+        self.success = success
+
+    def ingest(self, out_file):
+        """
+        Parse out_file into the store if it is finished and new or changed since it was stored.
+
+        :param out_file: str. path to psi4 output file
+        :return: bool. True if the file was added
+        """
+        if not is_complete(out_file, self.success):
+            return False
+        stored = self.store.mtime(out_file)
+        if stored is not None and stored >= os.path.getmtime(out_file):
+            return False
+        try:
+            self.store.add(out_file)
+        except Exception as e:
+            warnings.warn("Could not parse {}: {}".format(out_file, e))
+            return False
+        logger().debug('ingested {}'.format(out_file))
+        return True
+
+    def poll(self):
+        """
+        Ingest all new finished output files in directory
+
+        :return: list of files that were added
+        """
+        added = []
+        for path, subdir, files in os.walk(self.directory):
+            for name in sorted(files):
+                if fnmatch(name, self.pattern) and not name.startswith('timer'):
+                    out_file = os.path.join(path, name)
+                    if self.ingest(out_file):
+                        added.append(out_file)
+        return added
+
+    def watch(self, interval=30.0, timeout=None, stop=None):
+        """
+        Poll directory until timeout or stop() returns True
+
+        :param interval: float. seconds between polls. Default 30
+        :param timeout: float. seconds to watch. Default None watches until stop
+        :param stop: callable. Default None
+        :return: int. number of files added
+        """
+        start = time.time()
+        n_added = 0
+        while True:
+            n_added += len(self.poll())
+            if stop is not None and stop():
+                break
+            if timeout is not None and time.time() - start >= timeout:
+                break
+            time.sleep(interval)
+        return n_added
+
+    def __call__(self, job):
+        """ Scheduler callback. Ingests the output of a finished job """
+        self.ingest(job['output'])
@@ -0,0 +1,255 @@
+"""
+Core and memory aware packing of psi4 jobs on a node
+
+Estimates the cost of every psi4 input from its number of atoms, basis set and method and chooses the number of threads
+per job and the number of jobs running at the same time that minimize the makespan of a scan directory on a node with
+a given number of cores and memory. Jobs are run with torsionfit.qmscan.scheduler, longest job first.
+
+Scheduling decisions are logged and the measured runtimes are stored in the job ledger so the cost model can be refit
+with `CostModel.fit(runtime_records(ledger))`.
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import re
+import json
+import time
+import numpy as np
+from torsionfit.utils import logger
+from torsionfit.qmscan.scheduler import JobLedger, Scheduler, DONE, PENDING
+
+# Approximate number of basis functions for hydrogen and heavy (second row) atoms
+BASIS_FUNCTIONS = {'sto-3g': (1, 5),
+                   '3-21g': (2, 9),
+                   '6-31g': (2, 9),
+                   '6-31g*': (2, 15),
+                   '6-31+g*': (2, 19),
+                   '6-31g**': (5, 15),
+                   '6-311g**': (6, 18),
+                   'cc-pvdz': (5, 14),
+                   'jun-cc-pvdz': (5, 18),
+                   'aug-cc-pvdz': (9, 23),
+                   'cc-pvtz': (14, 30),
+                   'jun-cc-pvtz': (14, 39),
+                   'aug-cc-pvtz': (23, 46),
+                   'cc-pvqz': (30, 55),
+                   'def2-svp': (5, 14),
+                   'def2-tzvp': (6, 31)}
+
+# Formal scaling with number of basis functions
+METHOD_SCALING = {'scf': 3, 'hf': 3, 'b3lyp': 3, 'b3lyp-d3': 3, 'wb97x-d': 3, 'pbe': 3, 'pbe0': 3,
+                  'mp2': 4, 'ri-mp2': 4, 'scs-mp2': 4, 'df-mp2': 4,
+                  'ccsd': 6, 'ccsd(t)': 7}
+
+MEMORY_UNITS = {'b': 1e-6, 'kb': 1e-3, 'kib': 1.024e-3, 'mb': 1, 'mib': 1.048576, 'gb': 1e3, 'gib': 1073.741824}
+
+
+def parse_input(input_file):
+    """
+    Read the features of a psi4 input file that the cost model uses.
+
+    :param input_file: str. path to psi4 input
+    :return: dict with n_atoms, n_hydrogens, method, basis and memory (MB, None if not set)
+    """
+    n_atoms = n_hydrogens = 0
+    method = basis = memory = None
+    in_molecule = False
+    with open(input_file) as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if line.startswith('molecule'):
+                in_molecule = True
+            elif in_molecule and fields[0] == '}':
+                in_molecule = False
+            elif in_molecule and len(fields) == 4 and fields[0].isalpha():
+                n_atoms += 1
+                if fields[0].upper() == 'H':
+                    n_hydrogens += 1
+            elif fields[0] == 'memory':
+                match = re.match(r'memory\s+([\d.]+)\s*(\w+)', line.strip())
+                if match:
+                    memory = float(match.group(1)) * MEMORY_UNITS.get(match.group(2).lower(), 1)
+            else:
+                match = re.search(r"(?:optimize|opt|energy|gradient)\(['\"]([^'\"]+)['\"]", line)
+                if match and '/' in match.group(1):
+                    method, basis = match.group(1).lower().split('/', 1)
+    return {'n_atoms': n_atoms, 'n_hydrogens': n_hydrogens, 'method': method, 'basis': basis, 'memory': memory}
+
+
+class CostModel(object):
+    """
+    Runtime model of a psi4 job
+
+    runtime(threads) = prefactor[method] * n_basis ** scaling[method] * (serial + (1 - serial) / threads)
+
+    Attributes
+    ----------
+    prefactors: dict mapping method to prefactor (seconds). Methods not in the dict use default_prefactor
+    serial: float. fraction of the runtime that does not parallelize (Amdahl's law)
+    """
+
+    def __init__(self, prefactors=None, default_prefactor=1e-9, serial=0.1):
+        """
+
+        Parameters
+        ----------
+        prefactors : dict
+            maps method to prefactor. Default None
+        default_prefactor : float
+            Default 1e-9
+        serial : float
+            serial fraction of a job. Default 0.1
+        """
+        self.prefactors = dict(prefactors or {})
+        self.default_prefactor = default_prefactor
+        self.serial = serial
+
+    @staticmethod
+    def n_basis(features):
+        """ Approximate number of basis functions """
+        hydrogen, heavy = BASIS_FUNCTIONS.get(features['basis'], (5, 14))
+        return features['n_hydrogens'] * hydrogen + (features['n_atoms'] - features['n_hydrogens']) * heavy
+
+    def work(self, features):
+        """ Serial runtime estimate of a job """
+        prefactor = self.prefactors.get(features['method'], self.default_prefactor)
+        return prefactor * self.n_basis(features) ** METHOD_SCALING.get(features['method'], 4)
+
+    def runtime(self, features, threads):
+        """ Runtime estimate of a job on threads """
+        return self.work(features) * (self.serial + (1.0 - self.serial) / threads)
+
+    def fit(self, records):
+        """
+        Refit prefactors and serial fraction to measured runtimes.
+
+        :param records: list of dicts with the features of parse_input, threads and runtime (see runtime_records)
+        :return: self
+        """
+        records = [r for r in records if r['method'] is not None and r['runtime'] > 0]
+        if not records:
+            return self
+        # log(runtime) - log(n_basis ** scaling) = log(prefactor) + log(serial + (1 - serial) / threads)
+        best = None
+        for serial in np.linspace(0, 1, 101):
+            residuals = {}
+            for r in records:
+                scaled = self.n_basis(r) ** METHOD_SCALING.get(r['method'], 4)
+                amdahl = serial + (1.0 - serial) / r['threads']
+                residuals.setdefault(r['method'], []).append(np.log(r['runtime'] / (scaled * amdahl)))
+            log_prefactors = {method: np.mean(res) for method, res in residuals.items()}
+            error = sum(((np.array(res) - log_prefactors[method])**2).sum() for method, res in residuals.items())
+            if best is None or error < best[0]:
+                best = (error, serial, log_prefactors)
+        self.serial = best[1]
+        self.prefactors.update({method: float(np.exp(p)) for method, p in best[2].items()})
+        return self
+
+    def to_json(self):
+        return json.dumps({'prefactors': self.prefactors, 'default_prefactor': self.default_prefactor,
+                           'serial': self.serial})
+
+    @classmethod
+    def from_json(cls, string):
+        return cls(**json.loads(string))
+
+
+def lpt_makespan(work, slots):
+    """
+    Longest processing time first assignment of jobs to identical slots.
+
+    :param work: list of job runtimes
+    :param slots: int. number of jobs that run at the same time
+    :return: makespan
+    """
+    loads = np.zeros(max(slots, 1))
+    for w in sorted(work, reverse=True):
+        loads[np.argmin(loads)] += w
+    return loads.max()
+
+
+def plan(jobs, cores, memory=None, cost_model=None, default_memory=500):
+    """
+    Choose the number of threads per job and number of concurrent jobs that minimize the makespan.
+
+    :param jobs: dict mapping input file to features (parse_input)
+    :param cores: int. cores on the node
+    :param memory: float. memory on the node (MB). Default None does not limit concurrency by memory
+    :param cost_model: CostModel. Default None uses CostModel()
+    :param default_memory: float. memory of a job (MB) if its input does not set it. Default 500 (psi4 default)
+    :return: dict with threads, slots, makespan and estimated runtime of every job
+    """
+    if cost_model is None:
+        cost_model = CostModel()
+    job_memory = max([f['memory'] or default_memory for f in jobs.values()] or [default_memory])
+    best = None
+    for threads in range(1, cores + 1):
+        slots = cores // threads
+        if memory is not None:
+            slots = min(slots, max(int(memory // job_memory), 1))
+        runtimes = {job: cost_model.runtime(features, threads) for job, features in jobs.items()}
+        makespan = lpt_makespan(list(runtimes.values()), slots)
+        # prefer fewer threads when makespans are the same
+        if best is None or makespan < best['makespan'] * (1 - 1e-9):
+            best = {'threads': threads, 'slots': slots, 'makespan': makespan, 'runtimes': runtimes}
+    return best
+
+
+def runtime_records(ledger):
+    """
+    Measured runtimes of finished jobs in the ledger with the features of their input files.
+
+    :param ledger: JobLedger
+    :return: list of dicts
+    """
+    records = []
+    for job in ledger.jobs(DONE):
+        if job['start'] is None or job['end'] is None:
+            continue
+        record = parse_input(job['input'])
+        record.update({'input': job['input'], 'threads': job['threads'], 'runtime': job['end'] - job['start']})
+        records.append(record)
+    return records
+
+
+def run_packed(directory, cores, memory=None, ledger='jobs.sqlite', cost_model=None, log=None, **kwargs):
+    """
+    Run all psi4 inputs in a scan directory packed on the node. Can be called again to continue an interrupted scan.
+
+    :param directory: str. root directory of torsion scan
+    :param cores: int. cores on the node
+    :param memory: float. memory on the node (MB). Default None
+    :param ledger: str. path to ledger sqlite file. Default jobs.sqlite
+    :param cost_model: CostModel. Default None uses CostModel()
+    :param log: str. JSON lines file to append the scheduling decision and measured runtimes to. Default None
+    :param kwargs: keyword arguments for Scheduler
+    :return: dict mapping status to number of jobs
+    """
+    job_ledger = JobLedger(ledger)
+    scheduler = Scheduler(job_ledger, **kwargs)
+    scheduler.submit(directory)
+
+    jobs = {job['input']: parse_input(job['input']) for job in job_ledger.jobs(PENDING)}
+    decision = plan(jobs, cores, memory=memory, cost_model=cost_model)
+    logger().info('packing {} jobs on {} cores: {} threads per job, {} jobs at a time, estimated makespan {:.1f} s'
+                  .format(len(jobs), cores, decision['threads'], decision['slots'], decision['makespan']))
+    for job, runtime in decision['runtimes'].items():
+        # longest job first
+        job_ledger.update(job, threads=decision['threads'], priority=runtime)
+    scheduler.cores = decision['threads'] * decision['slots']
+
+    start = time.time()
+    counts = scheduler.run()
+    records = runtime_records(job_ledger)
+    logger().info('finished in {:.1f} s'.format(time.time() - start))
+    if log is not None:
+        with open(log, 'a') as f:
+            f.write(json.dumps({'time': start, 'cores': cores, 'memory': memory, 'n_jobs': len(jobs),
+                                'threads': decision['threads'], 'slots': decision['slots'],
+                                'estimated_makespan': decision['makespan'], 'makespan': time.time() - start,
+                                'runtimes': [r for r in records if r['input'] in jobs]}) + '\n')
+    job_ledger.close()
+    return counts
@@ -1,23 +1,50 @@
 __author__ = 'Chaya D. Stern'
 
-from celery import Celery
-import yaml
 import os
-from shutilwhich import which
+import sys
+import types
 from fnmatch import fnmatch
-from celery import group
 
-config_file = open(os.environ['CELERY_CONFIG'], 'r')
-config = yaml.load(config_file)
-config_file.close()
+_app = None
 
-app = Celery('psi4_jobs',
-             broker=config['broker'],
-             include=['torsionfit.qmscan.qmtasks'])
+
+def get_app():
+    """
+    Celery app with the broker in the YAML file CELERY_CONFIG. The config is read and celery imported on first use so
+    importing this module is cheap.
+
+    :return: celery.Celery
+    """
+    global _app
+    if _app is None:
+        from celery import Celery
+        import yaml
+
+        with open(os.environ['CELERY_CONFIG'], 'r') as config_file:
+            config = yaml.safe_load(config_file)
+
+        _app = Celery('psi4_jobs',
+                      broker=config['broker'],
+                      include=['torsionfit.qmscan.qmtasks'])
+        _app.task(name='torsionfit.qmscan.qmtasks.start_psi4_calculation')(start_psi4_calculation)
+    return _app
+
+
+class _TasksModule(types.ModuleType):
+    """ Creates app on first access. Module level __getattr__ needs Python 3.7 """
+
+    def __getattr__(self, name):
+        # celery -A torsionfit.qmscan.qmtasks worker looks up app
+        if name == 'app':
+            return get_app()
+        raise AttributeError("module {!r} has no attribute {!r}".format(self.__name__, name))
+
+
+sys.modules[__name__].__class__ = _TasksModule
 
 
-@app.task
 def start_psi4_calculation(path, input_file):
+    from shutilwhich import which
     print(input_file)
     output_file = input_file.replace('dat', 'out')
     input_file = os.path.join(path, input_file)
@@ -35,5 +62,6 @@ def run_psi4_distributed(directory):
             if fnmatch(name, pattern):
                 path = os.path.join(os.getcwd(), path)
                 to_submit.append((path, name))
-    [start_psi4_calculation.apply_async(args=[path, input_file]) for path, input_file
-          in to_submit]
\ No newline at end of file
+    task = get_app().tasks['torsionfit.qmscan.qmtasks.start_psi4_calculation']
+    [task.apply_async(args=[path, input_file]) for path, input_file
+          in to_submit]
@@ -0,0 +1,309 @@
+"""
+Local resumable scheduler for psi4 torsion scan jobs
+
+Every input file is recorded in a sqlite job ledger with its status (pending, running, done or failed). Outputs that
+already finished are skipped so rerunning a half finished scan only runs the missing points. Failed jobs are retried
+with exponential backoff and jobs that ran out of retries are tried again when the scan is rerun. The number of jobs
+running at the same time is capped by the total number of cores using the threads of every job.
+
+Example:
+    ledger = JobLedger('scan.sqlite')
+    scheduler = Scheduler(ledger, cores=16)
+    scheduler.submit('torsion_scan', threads=4)
+    scheduler.run()
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import time
+import shutil
+import sqlite3
+import subprocess
+from fnmatch import fnmatch
+from torsionfit.utils import logger
+
+# psi4 writes this at the end of the output file when the calculation finished
+PSI4_SUCCESS = 'Psi4 exiting successfully'
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def output_filename(input_file):
+    """ Output file of a psi4 input file (.dat -> .out) """
+    return os.path.splitext(input_file)[0] + '.out'
+
+
+def is_complete(output_file, success=PSI4_SUCCESS):
+    """
+    Check if psi4 finished writing output_file.
+
+    :param output_file: str. path to psi4 output
+    :param success: str. string psi4 writes at the end of a successful calculation
+    :return: bool
+    """
+    if not os.path.isfile(output_file):
+        return False
+    with open(output_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 4096, 0))
+        return success.encode() in f.read()
+
+
+def find_inputs(directory, pattern='*.dat'):
+    """
+    Find all psi4 input files in directory
+
+    :param directory: str. root directory of torsion scan
+    :param pattern: str. Default '*.dat'
+    :return: sorted list of absolute paths
+    """
+    inputs = []
+    for path, subdir, files in os.walk(directory):
+        for name in files:
+            if fnmatch(name, pattern):
+                inputs.append(os.path.abspath(os.path.join(path, name)))
+    return sorted(inputs)
+
+
+class JobLedger(object):
+    """
+    sqlite ledger of psi4 jobs. Each row is an input file with its output, threads, status and number of attempts.
+    """
+
+    def __init__(self, filename):
+        """
+
+        Parameters
+        ----------
+        filename : str
+            path to sqlite file. Will be created if it does not exist.
+        """
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs
+                             (input TEXT PRIMARY KEY, output TEXT, threads INT, status TEXT, attempts INT DEFAULT 0,
+                              returncode INT, next_try REAL DEFAULT 0, start REAL, end REAL, message TEXT,
+                              priority REAL DEFAULT 0)""")
+        columns = [row['name'] for row in self.conn.execute("PRAGMA table_info(jobs)")]
+        if 'priority' not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN priority REAL DEFAULT 0")
+        self.conn.commit()
+
+    def add(self, input_file, output_file, threads):
+        """ Add job if it is not in the ledger. Returns True if the job was added. """
+        cur = self.conn.execute("INSERT OR IGNORE INTO jobs (input, output, threads, status) VALUES (?, ?, ?, ?)",
+                                (input_file, output_file, threads, PENDING))
+        self.conn.commit()
+        return cur.rowcount == 1
+
+    def update(self, input_file, **fields):
+        """ Update columns of a job """
+        columns = ', '.join('%s=?' % key for key in fields)
+        self.conn.execute("UPDATE jobs SET %s WHERE input=?" % columns, list(fields.values()) + [input_file])
+        self.conn.commit()
+
+    def reset(self, status=FAILED):
+        """ Put jobs with status back to pending with no attempts. Returns the number of jobs that were reset """
+        cur = self.conn.execute("UPDATE jobs SET status=?, attempts=0, next_try=0 WHERE status=?", (PENDING, status))
+        self.conn.commit()
+        return cur.rowcount
+
+    def jobs(self, status=None):
+        """ Jobs (sqlite3.Row) with status ordered by priority, highest first. Default None returns all jobs """
+        if status is None:
+            return self.conn.execute("SELECT * FROM jobs ORDER BY priority DESC, input").fetchall()
+        return self.conn.execute("SELECT * FROM jobs WHERE status=? ORDER BY priority DESC, input",
+                                 (status,)).fetchall()
+
+    def counts(self):
+        """ dict mapping status to number of jobs """
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+class Scheduler(object):
+    """
+    Runs psi4 jobs in the ledger as local subprocesses.
+
+    Attributes
+    ----------
+    ledger: JobLedger
+    cores: int. total number of cores to use
+    threads: int. default number of threads for every job (psi4 -n)
+    max_retries: int. number of times a failed job is retried
+    backoff: float. seconds to wait before the first retry. Doubles with every retry
+    retry_failed: bool. if True, jobs that failed in an earlier run are retried when run is called
+    """
+
+    def __init__(self, ledger, cores=None, threads=1, max_retries=2, backoff=30.0, psi4=None, poll_interval=1.0,
+                 success=PSI4_SUCCESS, callbacks=None, retry_failed=True):
+        """
+
+        Parameters
+        ----------
+        ledger : JobLedger
+        cores : int
+            total number of cores. Default None uses os.cpu_count()
+        threads : int
+            default threads per job. Default 1
+        max_retries : int
+            Default 2
+        backoff : float
+            seconds before first retry. Default 30
+        psi4 : str
+            path to psi4 executable. Default None looks for psi4 in PATH
+        poll_interval : float
+            seconds between checking running jobs. Default 1
+        success : str
+            string psi4 writes at the end of a finished output file
+        callbacks : list of callables
+            called with the job (sqlite3.Row) every time a job finishes successfully. Default None
+        retry_failed : bool
+            If True, jobs that used up their retries in an earlier run are retried with max_retries again when run is
+            called. Default True
+        """
+        self.ledger = ledger
+        self.cores = cores or os.cpu_count() or 1
+        self.threads = threads
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.success = success
+        if psi4 is None:
+            psi4 = shutil.which('psi4', mode=os.X_OK)
+        elif os.sep in psi4:
+            # jobs run in the directory of their input
+            psi4 = os.path.abspath(psi4)
+        self.psi4 = psi4
+        self.callbacks = list(callbacks or [])
+        self.retry_failed = retry_failed
+        self._running = {}
+
+    def submit(self, directory, threads=None, pattern='*.dat'):
+        """
+        Add all input files in directory to the ledger. Jobs whose output is already complete are marked done.
+
+        :param directory: str. root directory of torsion scan
+        :param threads: int. threads for these jobs. Default None uses self.threads
+        :param pattern: str. Default '*.dat'
+        :return: int. number of new jobs
+        """
+        if threads is None:
+            threads = self.threads
+        added = 0
+        for input_file in find_inputs(directory, pattern):
+            output_file = output_filename(input_file)
+            if self.ledger.add(input_file, output_file, threads):
+                added += 1
+                if is_complete(output_file, self.success):
+                    self.ledger.update(input_file, status=DONE)
+        return added
+
+    def _recover(self):
+        """ Jobs left running by an interrupted scheduler are checked and rescheduled """
+        for job in self.ledger.jobs(RUNNING):
+            if job['input'] in self._running:
+                continue
+            if is_complete(job['output'], self.success):
+                self.ledger.update(job['input'], status=DONE)
+            else:
+                self.ledger.update(job['input'], status=PENDING, next_try=0)
+
+    def _start(self, job, threads):
+        if self.psi4 is None:
+            raise RuntimeError("psi4 executable not found")
+        cmd = [self.psi4, job['input'], '-o', job['output'], '-n', str(threads)]
+        logger().info('starting {}'.format(' '.join(cmd)))
+        err_file = os.path.splitext(job['input'])[0] + '.err'
+        with open(err_file, 'w') as err:
+            process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=err,
+                                       cwd=os.path.dirname(job['input']))
+        self._running[job['input']] = (process, threads, err_file)
+        self.ledger.update(job['input'], status=RUNNING, start=time.time(), attempts=job['attempts'] + 1)
+
+    def _finish(self, input_file, returncode):
+        process, threads, err_file = self._running.pop(input_file)
+        job = self.ledger.conn.execute("SELECT * FROM jobs WHERE input=?", (input_file,)).fetchone()
+        if returncode == 0 and is_complete(job['output'], self.success):
+            self.ledger.update(input_file, status=DONE, returncode=returncode, end=time.time(), message=None)
+            logger().info('finished {}'.format(input_file))
+            job = self.ledger.conn.execute("SELECT * FROM jobs WHERE input=?", (input_file,)).fetchone()
+            for callback in self.callbacks:
+                callback(job)
+            return
+        with open(err_file) as err:
+            message = err.read()[-1000:]
+        if job['attempts'] <= self.max_retries:
+            delay = self.backoff * 2 ** (job['attempts'] - 1)
+            self.ledger.update(input_file, status=PENDING, returncode=returncode, end=time.time(), message=message,
+                               next_try=time.time() + delay)
+            logger().warning('{} failed with return code {}. Retrying in {} s'.format(input_file, returncode, delay))
+        else:
+            self.ledger.update(input_file, status=FAILED, returncode=returncode, end=time.time(), message=message)
+            logger().error('{} failed with return code {}'.format(input_file, returncode))
+
+    def run(self, retry_failed=None):
+        """
+        Run all pending jobs until every job is done or failed.
+
+        :param retry_failed: bool. Retry jobs that failed in an earlier run. Default None uses self.retry_failed
+        :return: dict mapping status to number of jobs
+        """
+        self._recover()
+        if retry_failed is None:
+            retry_failed = self.retry_failed
+        if retry_failed:
+            reset = self.ledger.reset(FAILED)
+            if reset:
+                logger().info('retrying {} failed jobs'.format(reset))
+        while True:
+            for input_file in list(self._running):
+                returncode = self._running[input_file][0].poll()
+                if returncode is not None:
+                    self._finish(input_file, returncode)
+
+            now = time.time()
+            free = self.cores - sum(threads for process, threads, err in self._running.values())
+            pending = self.ledger.jobs(PENDING)
+            for job in pending:
+                # jobs that need more than all cores run alone on all cores
+                threads = min(job['threads'], self.cores)
+                if job['next_try'] > now or threads > free:
+                    continue
+                if is_complete(job['output'], self.success):
+                    self.ledger.update(job['input'], status=DONE)
+                    continue
+                self._start(job, threads)
+                free -= threads
+
+            if not self._running and not pending:
+                break
+            time.sleep(self.poll_interval)
+        return self.ledger.counts()
+
+
+def run_psi4_local(directory, threads, cores=None, ledger='jobs.sqlite', **kwargs):
+    """
+    Run all psi4 input files in directory on the local machine. Can be called again to continue an interrupted scan.
+
+    :param directory: str. root directory of torsion scan
+    :param threads: int. threads for every psi4 job
+    :param cores: int. total number of cores. Default None uses all cores
+    :param ledger: str. path to ledger sqlite file. Default jobs.sqlite
+    :param kwargs: keyword arguments for Scheduler
+    :return: dict mapping status to number of jobs
+    """
+    job_ledger = JobLedger(ledger)
+    scheduler = Scheduler(job_ledger, cores=cores, threads=threads, **kwargs)
+    scheduler.submit(directory)
+    counts = scheduler.run()
+    job_ledger.close()
+    return counts
@@ -0,0 +1,188 @@
+"""
+Torsion drive geometries with numpy
+
+Generates the starting geometries of a torsion scan without OpenEye or PyMOL. The atoms on one side of the central bond
+are rotated to all scan angles at once and the psi4 inputs (and optionally pdb files) are written in the same tree as
+generate_torsions (path/a_b_c_d/angle/mol_a_b_c_d_angle.pdb).
+
+Example:
+    write_torsion_drive('butane.pdb', 'torsion_scan', 'butane', ['MP2'], ['aug-cc-pvtz'], interval=30)
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from torsionfit.qmscan.dedup import guess_bonds
+from torsionfit.qmscan.torsion_scan import _input_template, _write, fixed_dihedral_string
+from torsionfit.utils import logger
+
+
+def _neighbors(n_atoms, bonds):
+    neighbors = [[] for _ in range(n_atoms)]
+    for i, j in bonds:
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+    return neighbors
+
+
+def moving_atoms(neighbors, torsion):
+    """
+    Atoms on the side of the third atom of a torsion (atoms that move when the torsion is driven)
+
+    :param neighbors: list of list of bonded atoms of every atom
+    :param torsion: sequence of 4 atom indices (0 based)
+    :return: np.array of atom indices. None if the central bond is in a ring
+    """
+    b, c = torsion[1], torsion[2]
+    seen = {c}
+    stack = [c]
+    while stack:
+        atom = stack.pop()
+        for neighbor in neighbors[atom]:
+            if atom == c and neighbor == b:
+                continue
+            if neighbor == b:
+                return None
+            if neighbor not in seen:
+                seen.add(neighbor)
+                stack.append(neighbor)
+    return np.array(sorted(seen))
+
+
+def rotatable_torsions(elements, bonds):
+    """
+    One torsion per rotatable bond. Bonds between two non terminal atoms that are not in a ring are rotatable. The
+    torsion with the heaviest end atoms is used, like generate_torsions.
+
+    :param elements: list of element symbols
+    :param bonds: list of (i, j) tuples
+    :return: list of (a, b, c, d) tuples (0 based)
+    """
+    import mdtraj as md
+    neighbors = _neighbors(len(elements), bonds)
+    weight = [md.element.get_by_symbol(e).atomic_number for e in elements]
+    torsions = []
+    for b, c in sorted(tuple(sorted(bond)) for bond in bonds):
+        if len(neighbors[b]) < 2 or len(neighbors[c]) < 2:
+            continue
+        a = max((i for i in neighbors[b] if i != c), key=lambda i: (weight[i], -i))
+        d = max((i for i in neighbors[c] if i != b), key=lambda i: (weight[i], -i))
+        if moving_atoms(neighbors, (a, b, c, d)) is not None:
+            torsions.append((a, b, c, d))
+    return torsions
+
+
+def dihedral(xyz, torsion):
+    """ Dihedral angle (radians) of a torsion with the same sign convention as mdtraj.compute_dihedrals """
+    b1, b2, b3 = np.diff(xyz[list(torsion)], axis=0)
+    c1 = np.cross(b2, b3)
+    c2 = np.cross(b1, b2)
+    return np.arctan2(np.linalg.norm(b2) * b1.dot(c1), c2.dot(c1))
+
+
+def drive_torsion(xyz, torsion, moving, angles):
+    """
+    Set a torsion to every angle by rotating the moving atoms around the central bond
+
+    :param xyz: np.array (n_atoms, 3)
+    :param torsion: sequence of 4 atom indices (0 based)
+    :param moving: np.array of indices of atoms that move (moving_atoms)
+    :param angles: sequence of angles in degrees
+    :return: np.array (n_angles, n_atoms, 3)
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    current = dihedral(xyz, torsion)
+    theta = np.radians(np.asarray(angles, dtype=np.float64)) - current
+    axis = xyz[torsion[2]] - xyz[torsion[1]]
+    axis /= np.linalg.norm(axis)
+
+    # Rodrigues rotation matrices for all angles
+    k = np.array([[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]])
+    sin = np.sin(theta)[:, np.newaxis, np.newaxis]
+    cos = np.cos(theta)[:, np.newaxis, np.newaxis]
+    rotations = np.eye(3) + sin * k + (1 - cos) * k.dot(k)
+
+    driven = np.repeat(xyz[np.newaxis], len(theta), axis=0)
+    origin = xyz[torsion[2]]
+    driven[:, moving] = np.einsum('aij,mj->ami', rotations, xyz[moving] - origin) + origin
+    return driven
+
+
+def write_torsion_drive(traj, path, mol_name, method, basis_set, torsions=None, interval=30, angles=None, frame=0,
+                        pdb=True, threads=None, **kwargs):
+    """
+    Write psi4 inputs for a torsion drive of every torsion
+
+    Parameters
+    ----------
+    traj : str or mdtraj.Trajectory (or QMDataBase)
+        starting conformer
+    path : str
+        root of scan tree
+    mol_name : str
+    method : list of str
+    basis_set : list of str
+    torsions : list of sequences of 4 atom indices (0 based)
+        Default None drives one torsion per rotatable bond
+    interval : int
+        angle (in degrees) of interval for torsion drive. Default 30
+    angles : list of int
+        angles to drive to. Default None uses range(0, 360, interval)
+    frame : int
+        frame of traj. Default 0
+    pdb : bool
+        also write pdb file of every starting geometry. Default True
+    threads : int
+        number of threads writing files. Default None
+    kwargs : keyword arguments for pdb_to_psi4 (charge, multiplicity, symmetry, mem, ...)
+
+    Returns
+    -------
+    list of input files
+    """
+    import mdtraj as md
+    if isinstance(traj, str):
+        traj = md.load(traj)
+    topology = traj.topology
+    xyz = traj.xyz[frame]
+    elements = [atom.element.symbol for atom in topology.atoms]
+    bonds = [(bond[0].index, bond[1].index) for bond in topology.bonds]
+    if not bonds:
+        bonds = guess_bonds(xyz, elements)
+    neighbors = _neighbors(len(elements), bonds)
+    if torsions is None:
+        torsions = rotatable_torsions(elements, bonds)
+    if angles is None:
+        angles = list(range(0, 360, interval))
+
+    geometry = ''.join("  {}      {{:05.3f}}   {{:05.3f}}   {{:05.3f}}\n".format(element) for element in elements)
+    head, middle, tail = _input_template(mol_name=mol_name, method=method, basis_set=basis_set, **kwargs)
+
+    files = []
+    trajectories = []
+    for torsion in torsions:
+        moving = moving_atoms(neighbors, torsion)
+        if moving is None:
+            raise Exception("Central bond of torsion {} is in a ring".format(torsion))
+        tor_name = '_'.join(str(i + 1) for i in torsion)
+        logger().info('driving torsion {}'.format(tor_name))
+        driven = drive_torsion(xyz, torsion, moving, angles)
+        fixed = ' '.join(tor_name.split('_'))
+        for angle, positions in zip(angles, driven):
+            folder = os.path.join(path, tor_name, str(angle))
+            os.makedirs(folder, exist_ok=True)
+            filename = os.path.join(folder, '{}_{}_{}'.format(mol_name, tor_name, angle))
+            # Convert to Angstroms
+            contents = head + geometry.format(*(positions*10).ravel().tolist()) + middle + \
+                fixed_dihedral_string(fixed, angle) + tail
+            files.append((filename + '.dat', contents))
+            if pdb:
+                trajectories.append((filename + '.pdb', positions))
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(_write, files))
+        list(executor.map(lambda f: md.Trajectory(f[1], topology).save_pdb(f[0]), trajectories))
+    return [filename for filename, contents in files]
@@ -1,19 +1,18 @@
 __author__ = 'Chaya D. Stern'
 
-import mdtraj as md
 import os
 from fnmatch import fnmatch
 import sys
 from math import radians
+from concurrent.futures import ThreadPoolExecutor
 try:
     import openeye.oechem as oechem
 except ImportError:
     pass
 from torsionfit.utils import logger
+from torsionfit.qmscan.dedup import load_mapping
 import warnings
 import numpy as np
-from cclib.parser import Gaussian, Psi
-from cclib.parser.utils import convertor
 import re
 
 
@@ -201,8 +200,200 @@ def pdb_to_psi4(starting_geom, mol_name, method, basis_set, charge=0, multiplici
     return input_string
 
 
+def fixed_dihedral_string(dihedral, angle):
+    """
+    psi4 fixed dihedral string
+
+    :param dihedral: str
+        index of atoms that should remain fixed. format '1  2  3  4'
+    :param angle: str or int
+        angle of fixed dihedral
+    :return: str
+        Because of a bug in psi4, dihedral angle can't be exactly 0 (same would apply for 180) so 0.001 is added
+    """
+    fixed_dih_angle = str(angle)
+    if fixed_dih_angle == '0':
+        fixed_dih_angle = '0.001'
+    if fixed_dih_angle == '180':
+        fixed_dih_angle = '180.001'
+    if fixed_dih_angle == '360':
+        fixed_dih_angle = '360.001'
+    return dihedral + ' ' + fixed_dih_angle
+
+
+def psi4_geometry(elements, xyz):
+    """
+    Geometry lines of psi4 molecule block
+
+    :param elements: list of element symbols
+    :param xyz: np.array (n_atoms, 3) in Angstroms
+    :return: str
+    """
+    starting_geom = ""
+    for i, element in enumerate(elements):
+        starting_geom += "  {}      {:05.3f}   {:05.3f}   {:05.3f}\n".format(element, xyz[i][0], xyz[i][1], xyz[i][2])
+    return starting_geom
+
+
+def optimized_geometry(filename):
+    """
+    Final optimized geometry in psi4 output file
+
+    :param filename: str
+        path to psi4 output file
+    :return: (list of element symbols, np.array (n_atoms, 3) in Angstroms). None if the optimization did not finish
+    """
+    with open(filename) as f:
+        lines = f.readlines()
+    start = None
+    for i, line in enumerate(lines):
+        if line.strip().startswith('Final optimized geometry'):
+            start = i
+    if start is None:
+        return None
+    elements = []
+    xyz = []
+    reading = False
+    for line in lines[start:]:
+        fields = line.split()
+        if len(fields) == 4 and fields[0].isalpha():
+            try:
+                xyz.append([float(x) for x in fields[1:]])
+            except ValueError:
+                continue
+            elements.append(fields[0])
+            reading = True
+        elif reading:
+            break
+    return elements, np.array(xyz)
+
+
+def read_pdb_coordinates(filename):
+    """
+    Read coordinates of the first model of a pdb file without building a topology
+
+    :param filename: str
+        path to pdb file
+    :return: np.array (n_atoms, 3) in Angstroms. Same values as md.load(filename).xyz[0]*10
+    """
+    xyz = []
+    with open(filename) as f:
+        for line in f:
+            if line.startswith('ATOM') or line.startswith('HETATM'):
+                xyz.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+            elif line.startswith('ENDMDL'):
+                break
+    # Round trip through nm in single precision like mdtraj
+    xyz = (np.array(xyz) / 10).astype(np.float32)
+    return xyz*10
+
+
+def _input_template(mol_name, method, basis_set, **kwargs):
+    """ psi4 input split around the geometry and the fixed dihedral """
+    geometry = '@@geometry@@'
+    fixed_dih = '@@fixed_dih@@'
+    template = pdb_to_psi4(starting_geom=geometry, mol_name=mol_name, method=method, basis_set=basis_set,
+                           fixed_dih=fixed_dih, **kwargs)
+    head, tail = template.split(geometry)
+    middle, tail = tail.split(fixed_dih)
+    return head, middle, tail
+
+
+def generate_scan_inputs(root, mol_name, method, basis_set, filetype='pdb', dihedral=None, structure=None, charge=0,
+                         multiplicity=1, symmetry=None, geom_opt=True, sp_energy=False, mem=None, mapping=None,
+                         threads=None):
+    """
+    Write psi4 input files for every starting geometry of a scan tree
+
+    The topology is loaded once, coordinates of all starting geometries are read into one array and inputs are
+    rendered from a template and written in parallel.
+
+    :param root: str
+        root of scan tree (root/a_b_c_d/angle/file) or of one torsion (root/angle/file)
+    :param mol_name: str
+        molecule name
+    :param method: list of str
+        QM method (see psi4 website for options)
+    :param basis_set: list of str
+        see psi4 website for options
+    :param filetype: str
+        filetype of starting geometries. Default pdb. Other filetypes are loaded with mdtraj
+    :param dihedral: str
+        index of atoms that should remain fixed. format '1  2  3  4'. Default None uses the name of the torsion
+        directory of every file
+    :param structure: str
+        path to file with the topology of all starting geometries. Default None uses the first starting geometry
+    :param charge: int
+        default 0
+    :param multiplicity: int
+        default 1
+    :param symmetry: str
+        symmetry of molecule. default None
+    :param geom_opt: bool
+        if True, run geometry optimization
+    :param sp_energy: bool
+        if True, run a single point energy calculation after geomoetry optimization
+    :param mem: str
+        memory allocation
+    :param mapping: str or dict
+        scan point mapping from dedup.dedup_scan. Input files are not written for duplicate scan points. Default None
+    :param threads: int
+        number of threads reading and writing files. Default None uses ThreadPoolExecutor default
+    :return: list of input files
+    """
+    if mapping is not None:
+        mapping = load_mapping(mapping)
+    else:
+        mapping = {}
+    input_files = []
+    pattern = "*.{}".format(filetype)
+    for path, subdir, files in os.walk(root):
+        for name in files:
+            if fnmatch(name, pattern):
+                f = os.path.join(path, name)
+                if '/'.join(f.split(os.sep)[-3:-1]) not in mapping:
+                    input_files.append(f)
+    if not input_files:
+        return []
+
+    import mdtraj as md
+    topology = md.load(structure or input_files[0]).topology
+    elements = [atom.element.symbol for atom in topology.atoms]
+    # One format string for all geometries
+    geometry = ''.join("  {}      {{:05.3f}}   {{:05.3f}}   {{:05.3f}}\n".format(element) for element in elements)
+    head, middle, tail = _input_template(mol_name=mol_name, method=method, basis_set=basis_set, charge=charge,
+                                         multiplicity=multiplicity, symmetry=symmetry, geom_opt=geom_opt,
+                                         sp_energy=sp_energy, mem=mem)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        if filetype == 'pdb':
+            coordinates = list(executor.map(read_pdb_coordinates, input_files))
+        else:
+            # Convert to Angstroms
+            coordinates = [md.load(f, top=topology).xyz[0]*10 for f in input_files]
+        coordinates = np.array(coordinates)
+        if coordinates.ndim != 3 or coordinates.shape[1] != len(elements):
+            raise Exception("Starting geometries in {} do not all have the {} atoms of the topology".format(
+                root, len(elements)))
+
+        outputs = []
+        for f, xyz in zip(input_files, coordinates):
+            tor_name, angle = f.split(os.sep)[-3:-1]
+            tor = dihedral or ' '.join(tor_name.split('_'))
+            output = head + geometry.format(*xyz.ravel().tolist()) + middle + fixed_dihedral_string(tor, angle) + tail
+            outputs.append((os.path.splitext(f)[0] + '.dat', output))
+        list(executor.map(_write, outputs))
+    return [filename for filename, output in outputs]
+
+
+def _write(file_contents):
+    filename, contents = file_contents
+    with open(filename, 'w') as f:
+        f.write(contents)
+
+
 def generate_scan_input(root, filetype, mol_name, method, basis_set, dihedral=None, charge=0, multiplicity=1, symmetry=None,
-                        geom_opt=True, sp_energy=False, mem=None):
+                        geom_opt=True, sp_energy=False, mem=None, mapping=None):
     """
     This function takes a directory and writes out psi4 input files for all files that match the filetype specified
 
@@ -230,43 +421,16 @@ def generate_scan_input(root, filetype, mol_name, method, basis_set, dihedral=No
         if True, run a single point energy calculation after geomoetry optimization
     :param mem: str
         memory allocation
+    :param mapping: str or dict
+        scan point mapping from dedup.dedup_scan. Input files are not written for duplicate scan points. Default None
 
     """
     if not dihedral:
         dihedral = list(filter(None, root.split('/')))[-1].split('_')
         dihedral = dihedral[0] + ' ' + dihedral[1] + ' ' + dihedral[2] + ' ' + dihedral[3]
-    input_files = []
-    pattern = "*.{}".format(filetype)
-    for path, subdir, files in os.walk(root):
-        for name in files:
-            if fnmatch(name, pattern):
-                input_files.append(os.path.join(path, name))
-
-    for f in input_files:
-        fixed_dih_angle = f.split('/')[-2]
-        if fixed_dih_angle == '0':
-            fixed_dih_angle = '0.001'
-        if fixed_dih_angle == '180':
-            fixed_dih_angle = '180.001'
-        if fixed_dih_angle == '360':
-            fixed_dih_angle = '360.001'
-        dihedral_string = dihedral + ' ' + fixed_dih_angle
-        mol = md.load(f)
-        starting_geom = ""
-        for i, atom in enumerate(mol.topology.atoms):
-            element = atom.element.symbol
-            # Convert to Angstroms
-            xyz = mol.xyz[0]*10
-            starting_geom += "  {}      {:05.3f}   {:05.3f}   {:05.3f}\n".format(element, xyz[i][0], xyz[i][1], xyz[i][2])
-
-        output = pdb_to_psi4(starting_geom=starting_geom, mol_name=mol_name, method=method, basis_set=basis_set, charge=charge,
-                             multiplicity=multiplicity, symmetry=symmetry, geom_opt=geom_opt, sp_energy=sp_energy,
-                             fixed_dih=dihedral_string, mem=mem)
-
-        filename = f.replace(filetype, 'dat')
-        psi4_input = open(filename, 'w')
-        psi4_input.write(output)
-        psi4_input.close()
+    generate_scan_inputs(root, mol_name, method, basis_set, filetype=filetype, dihedral=dihedral, charge=charge,
+                         multiplicity=multiplicity, symmetry=symmetry, geom_opt=geom_opt, sp_energy=sp_energy,
+                         mem=mem, mapping=mapping)
 
 
 def from_psi4(filename, method=None, basis_set=None, dihedral=None, charge=None, multiplicity=None, symmetry=None,
@@ -294,6 +458,7 @@ def from_psi4(filename, method=None, basis_set=None, dihedral=None, charge=None,
     """
 
     # Load psi4 output file
+    from cclib.parser import Psi
     log = Psi(filename)
     data = log.parse()
 
@@ -0,0 +1,187 @@
+"""
+Wavefront torsion drive
+
+Instead of optimizing every angle of a torsion scan from the same rigidly rotated geometry, the scan starts at one
+angle per torsion and moves outward in both directions. Every new point is seeded with the optimized geometry of the
+neighboring point that just finished. Jobs run through torsionfit.qmscan.scheduler so both directions of every torsion
+run in parallel. Points whose neighbors failed are started from the rigidly rotated geometry.
+
+Example:
+    generate_torsions('butane.pdb', 'torsion_scan', 30)
+    scheduler = Scheduler(JobLedger('jobs.sqlite'), cores=16, threads=4)
+    WavefrontScan('torsion_scan', 'butane', ['MP2'], ['aug-cc-pvtz'], scheduler, mol='butane.pdb').run()
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import os
+import numpy as np
+from torsionfit.qmscan.torsion_scan import pdb_to_psi4, psi4_geometry, fixed_dihedral_string, optimized_geometry
+from torsionfit.qmscan.dedup import find_scan_points, load_mapping
+from torsionfit.qmscan.scheduler import output_filename, DONE
+from torsionfit.utils import logger
+
+
+class WavefrontScan(object):
+    """
+    Torsion drive that seeds every angle from the optimized geometry of its neighbor.
+
+    Attributes
+    ----------
+    scans: dict mapping torsion name (a_b_c_d) to dict mapping angle to starting geometry file
+    dispatched: set of (torsion name, angle) whose input file is in the scheduler ledger
+    """
+
+    def __init__(self, root, mol_name, method, basis_set, scheduler, pattern='*.pdb', start=None, mol=None,
+                 mapping=None, threads=None, **kwargs):
+        """
+
+        Parameters
+        ----------
+        root : str
+            root of scan tree written by generate_torsions (root/a_b_c_d/angle/file)
+        mol_name : str
+        method : list of str
+        basis_set : list of str
+        scheduler : torsionfit.qmscan.scheduler.Scheduler
+        pattern : str
+            pattern of starting geometries. Default '*.pdb'
+        start : int or dict
+            angle (or dict mapping torsion name to angle) to start from. Default None uses the angle closest to the
+            dihedral in mol, or the first angle if mol is None
+        mol : str
+            path to the starting conformer. Default None
+        mapping : str or dict
+            scan point mapping from dedup.dedup_scan. Duplicate scan points are not computed. Default None
+        threads : int
+            threads per job. Default None uses scheduler.threads
+        kwargs : keyword arguments for pdb_to_psi4 (charge, multiplicity, symmetry, mem, ...)
+        """
+        self.mol_name = mol_name
+        self.method = method
+        self.basis_set = basis_set
+        self.scheduler = scheduler
+        self.threads = threads or scheduler.threads
+        self.kwargs = kwargs
+        mapping = load_mapping(mapping) if mapping is not None else {}
+
+        self.scans = {}
+        for key, filename in find_scan_points(root, pattern).items():
+            if key in mapping:
+                continue
+            tor_name, angle = key.split('/')
+            self.scans.setdefault(tor_name, {})[int(angle)] = filename
+
+        if start is None and mol is not None:
+            import mdtraj as md
+            conformer = md.load(mol)
+            start = {}
+            for tor_name, angles in self.scans.items():
+                torsion = np.array([[int(i) - 1 for i in tor_name.split('_')]])
+                dihedral = np.degrees(md.compute_dihedrals(conformer, torsion)[0][0]) % 360
+                start[tor_name] = min(angles, key=lambda a: min(abs(a - dihedral), 360 - abs(a - dihedral)))
+        self.start = start
+
+        # Points are only dispatched once they are in the ledger. Input files written by generate_scan_input or left
+        # by an interrupted dispatch are overwritten with a seeded geometry.
+        self.dispatched = set()
+        for job in scheduler.ledger.jobs():
+            point = self._scan_point(job['input'])
+            if point is not None:
+                self.dispatched.add(point)
+        scheduler.callbacks.append(self)
+
+    def _input_file(self, tor_name, angle):
+        return os.path.splitext(self.scans[tor_name][angle])[0] + '.dat'
+
+    def neighbors(self, tor_name, angle):
+        """ Adjacent angles of a scan point. The scan wraps around if the angles cover the whole circle """
+        angles = sorted(self.scans[tor_name])
+        i = angles.index(angle)
+        neighbors = angles[max(i - 1, 0):i] + angles[i + 1:i + 2]
+        if len(angles) > 2:
+            step = angles[1] - angles[0]
+            if angles[0] + 360 - angles[-1] == step:
+                if i == 0:
+                    neighbors.append(angles[-1])
+                if i == len(angles) - 1:
+                    neighbors.append(angles[0])
+        return neighbors
+
+    def dispatch(self, tor_name, angle, seed=None):
+        """
+        Write the input file of a scan point and add it to the scheduler
+
+        :param tor_name: str. a_b_c_d
+        :param angle: int
+        :param seed: (elements, np.array (n_atoms, 3) in Angstroms). Default None uses the rigidly rotated geometry
+        """
+        if (tor_name, angle) in self.dispatched:
+            return
+        if seed is None:
+            import mdtraj as md
+            mol = md.load(self.scans[tor_name][angle])
+            seed = ([atom.element.symbol for atom in mol.topology.atoms], mol.xyz[0]*10)
+        elements, xyz = seed
+        dihedral = ' '.join(tor_name.split('_'))
+        output = pdb_to_psi4(starting_geom=psi4_geometry(elements, xyz), mol_name=self.mol_name, method=self.method,
+                             basis_set=self.basis_set, fixed_dih=fixed_dihedral_string(dihedral, angle), **self.kwargs)
+        input_file = os.path.abspath(self._input_file(tor_name, angle))
+        with open(input_file, 'w') as f:
+            f.write(output)
+        self.scheduler.ledger.add(input_file, output_filename(input_file), self.threads)
+        self.dispatched.add((tor_name, angle))
+        logger().debug('dispatched {} {}'.format(tor_name, angle))
+
+    def _scan_point(self, input_file):
+        """ torsion name and angle of an input file. None if it is not part of this scan """
+        tor_name, angle = input_file.split(os.sep)[-3:-1]
+        try:
+            angle = int(angle)
+        except ValueError:
+            return None
+        if tor_name in self.scans and angle in self.scans[tor_name]:
+            return tor_name, angle
+        return None
+
+    def __call__(self, job):
+        """ Scheduler callback. Seed the neighbors of a finished scan point with its optimized geometry """
+        point = self._scan_point(job['input'])
+        if point is None:
+            return
+        seed = optimized_geometry(job['output'])
+        for angle in self.neighbors(*point):
+            self.dispatch(point[0], angle, seed=seed)
+
+    def run(self):
+        """
+        Run the torsion drive. Can be called again to continue an interrupted scan.
+
+        :return: dict mapping status to number of jobs
+        """
+        # Continue from points that already finished
+        for job in self.scheduler.ledger.jobs(DONE):
+            self(job)
+        for tor_name, angles in self.scans.items():
+            if isinstance(self.start, dict):
+                start = self.start.get(tor_name, min(angles))
+            elif self.start is not None:
+                start = self.start
+            else:
+                start = min(angles)
+            self.dispatch(tor_name, start)
+
+        retry_failed = None
+        while True:
+            counts = self.scheduler.run(retry_failed=retry_failed)
+            # points that failed in this run are not retried for every batch of unseeded points
+            retry_failed = False
+            missing = [(tor_name, angle) for tor_name, angles in self.scans.items() for angle in angles
+                       if (tor_name, angle) not in self.dispatched]
+            if not missing:
+                return counts
+            logger().warning('{} scan points could not be seeded from a neighbor. Starting them from the rigidly '
+                             'rotated geometry'.format(len(missing)))
+            for tor_name, angle in missing:
+                self.dispatch(tor_name, angle)
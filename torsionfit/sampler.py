@@ -0,0 +1,193 @@
+"""
+pymc sampler for TorsionFitModel with restartable checkpoints.
+
+The state of the sampler, step methods and numpy random number generator is saved in the database backend every
+`save_interval` iterations. A preempted run can be continued from the last checkpoint with `resume`. Streaming
+posterior summaries of the stochastics can be turned on with `summaries` and are saved with the checkpoints.
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import pymc
+import numpy as np
+import warnings
+from torsionfit.backends import sqlite_plus
+from torsionfit.summaries import StreamingSummaries
+from torsionfit import profiling
+from torsionfit.utils import RunLog
+
+
+class TorsionFitMCMC(pymc.MCMC):
+    """pymc.MCMC sampler that can continue a chain from a checkpoint stored in the database backend.
+
+    Checkpoints are written by the backend's savestate every `save_interval` iterations (see pymc.MCMC.sample). The
+    sqlite_plus and netcdf4 backends commit the samples and the state together so the checkpoint on disk always matches
+    the stored traces.
+
+    Attributes
+    ----------
+    trace_offset: int
+        number of samples in the chain before the current call to sample. 0 unless the chain was resumed.
+    summaries: torsionfit.summaries.StreamingSummaries or None
+        running mean, variance and quantiles of the stochastics and inclusion counts of multiplicity bitstrings for
+        the samples tallied in the current chain. Pass summaries=True to update them at every tally or an int N to
+        update them every N tallies. Default None (off). Use summaries.summary() during a run or
+        torsionfit.summaries.get_summaries(db) to read the summaries saved with the last checkpoint. The state is saved
+        at every checkpoint and at the end of sample.
+    run_log: torsionfit.utils.RunLog
+        aggregated progress records (mean log probability and steps per second) every run_log.interval iterations.
+        Pass run_log as an int (interval), str (JSON lines file with records every 100 iterations) or RunLog. Default
+        None does not log progress.
+    """
+
+    def __init__(self, input=None, db='ram', name='MCMC', calc_deviance=True, quantiles=(0.025, 0.5, 0.975),
+                 run_log=None, summaries=None, **kwds):
+        if isinstance(run_log, int):
+            run_log = RunLog(interval=run_log)
+        elif isinstance(run_log, str):
+            run_log = RunLog(filename=run_log)
+        self.run_log = run_log
+        self.trace_offset = 0
+        self._resuming = False
+        super(TorsionFitMCMC, self).__init__(input=input, db=db, name=name, calc_deviance=calc_deviance, **kwds)
+        self._state.append('_save_interval')
+        self.quantiles = quantiles
+        self.summaries = None
+        if summaries:
+            self.enable_summaries(1 if summaries is True else summaries)
+
+    def enable_summaries(self, interval=1):
+        """ Turn on streaming summaries updated every interval tallies """
+        self.summaries = StreamingSummaries(sorted(self.stochastics, key=lambda s: s.__name__),
+                                            quantiles=self.quantiles, interval=interval)
+
+    def sample(self, *args, **kwargs):
+        """ pymc.MCMC.sample. A new chain starts new summaries. """
+        if not self._resuming and self.summaries is not None:
+            self.summaries.reset()
+        self._resuming = False
+        super(TorsionFitMCMC, self).sample(*args, **kwargs)
+        if self.summaries is not None:
+            # store the summaries of the complete chain with the final state
+            self.save_state()
+        if self.run_log is not None:
+            self.run_log.emit()
+
+    def tally(self):
+        """ Record the value of all tracing variables and update the streaming summaries """
+        if self.summaries is not None and self._cur_trace_index < self.max_trace_length:
+            with profiling.phase('sampler.summaries'):
+                self.summaries.update()
+        with profiling.phase('backend.tally'):
+            super(TorsionFitMCMC, self).tally()
+        profiling.count('sampler.iterations')
+        if self.run_log is not None:
+            self.run_log.step(logp=self.logp)
+
+    def get_state(self):
+        """
+        Return the sampler, step methods and numpy random state. The length of the chain on disk is saved so samples
+        tallied after the checkpoint can be discarded when resuming.
+        """
+        state = super(TorsionFitMCMC, self).get_state()
+        trace_length = min(self._cur_trace_index, self.max_trace_length)
+        state['checkpoint'] = {'trace_length': self.trace_offset + trace_length,
+                               'random_state': np.random.get_state()}
+        if self.summaries is not None:
+            state['summaries'] = self.summaries.get_state()
+        return state
+
+    def resume(self, save_interval=None, tune_interval=None, verbose=0, progress_bar=False):
+        """
+        Continue the last chain in the database from its checkpoint. Stochastics and step methods were restored when
+        the sampler was created with the loaded database. The remaining iterations are sampled into the same chain.
+
+        Parameters
+        ----------
+        save_interval : int
+            checkpoint interval for the continued run. Default None uses the interval of the original run.
+        tune_interval : int
+            Default None uses the interval of the original run.
+        verbose : int
+        progress_bar : bool
+            Default False
+
+        Returns
+        -------
+        remaining : int
+            number of iterations that were sampled
+        """
+        state = self.db.getstate() or {}
+        sampler_state = state.get('sampler', {})
+        checkpoint = state.get('checkpoint', {})
+        if not sampler_state:
+            raise ValueError("There is no checkpoint in the database to resume from")
+
+        current_iter = sampler_state['_current_iter']
+        if current_iter >= sampler_state['_iter']:
+            warnings.warn("Chain already finished. Nothing to resume")
+            return 0
+        # The state is saved after iteration _current_iter was tallied
+        done = current_iter + 1
+        remaining = sampler_state['_iter'] - done
+        burn = max(sampler_state['_burn'] - done, 0)
+        if save_interval is None:
+            save_interval = sampler_state.get('_save_interval')
+        if tune_interval is None:
+            tune_interval = sampler_state.get('_tune_interval', 1000)
+
+        trace_length = checkpoint.get('trace_length')
+        self.db.resume_chain(length=trace_length)
+        self.trace_offset = trace_length or 0
+
+        # Don't let Sampler.seed redraw the restored values
+        for s in self.stochastics:
+            s.rseed = None
+        if 'random_state' in checkpoint:
+            np.random.set_state(checkpoint['random_state'])
+        if 'summaries' in state:
+            if self.summaries is None:
+                self.enable_summaries(state['summaries']['interval'])
+            self.summaries.reset()
+            self.summaries.set_state(state['summaries'])
+        elif self.summaries is not None:
+            self.summaries.reset()
+
+        if remaining > 0:
+            self._resuming = True
+            self.sample(iter=remaining, burn=burn, thin=sampler_state.get('_thin', 1), tune_interval=tune_interval,
+                        tune_throughout=sampler_state.get('_tune_throughout', True), save_interval=save_interval,
+                        verbose=verbose, progress_bar=progress_bar)
+        return remaining
+
+
+def resume(model, dbname, db=sqlite_plus, step_methods=None, sampler_kwargs=None, **kwargs):
+    """
+    Continue a TorsionFitModel chain that was sampled with TorsionFitMCMC from its last checkpoint.
+
+    Parameters
+    ----------
+    model : torsionfit.model.TorsionFitModel or torsionfit.model_omm.TorsionFitModel
+        The model needs to be built with the same options as the original run.
+    dbname : str
+        path to database of the original run
+    db : module
+        database backend. Default sqlite_plus
+    step_methods : list of tuples of (step method class, stochastic name)
+        non default step methods used in the original run. Default None
+    sampler_kwargs : dict
+        keyword arguments for TorsionFitMCMC (run_log, summaries, ...). Default None
+    kwargs : keyword arguments for TorsionFitMCMC.resume
+
+    Returns
+    -------
+    sampler : TorsionFitMCMC
+    """
+    database = db.load(dbname)
+    sampler = TorsionFitMCMC(model.pymc_parameters, db=database, **(sampler_kwargs or {}))
+    if step_methods is not None:
+        for step_method, name in step_methods:
+            sampler.use_step_method(step_method, model.pymc_parameters[name])
+    sampler.resume(**kwargs)
+    return sampler
@@ -0,0 +1,320 @@
+"""
+Streaming posterior summaries
+
+Accumulators that are updated when the sampler tallies (opt in with TorsionFitMCMC(summaries=True) or every N tallies
+with summaries=N) so posterior means, variances, quantiles and multiplicity inclusion frequencies are available while a
+run is going without reading the traces. The state of the accumulators is written with the sampler state. The
+sqlite_plus and netcdf4 backends write and commit the state together with the samples at every checkpoint
+(save_interval) and at the end of sampling, so the summaries on disk always describe the committed traces. They can be
+read at any time with `get_summaries`. The ram backend does not persist them.
+
+"""
+
+__author__ = 'Chaya D. Stern'
+
+import numpy as np
+from collections import OrderedDict
+from torsionfit.utils import decode_multiplicity_bitstring
+
+
+class RunningMoments(object):
+    """
+    Welford's online algorithm for the mean and variance. Values can be scalars or arrays of fixed shape.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, value):
+        value = np.asarray(value, dtype=float)
+        self.n += 1
+        if self.mean is None:
+            self.mean = value.copy()
+            self.m2 = np.zeros_like(value)
+            return
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.n
+        self.m2 = self.m2 + delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        """ Sample variance. nan for less than 2 samples """
+        if self.n < 2:
+            return np.nan if self.mean is None else np.full_like(self.mean, np.nan)
+        return self.m2 / (self.n - 1)
+
+    def get_state(self):
+        return {'n': self.n, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_state(cls, state):
+        moments = cls()
+        moments.n, moments.mean, moments.m2 = state['n'], state['mean'], state['m2']
+        return moments
+
+
+class P2Quantile(object):
+    """
+    P-square algorithm for estimating a quantile without storing samples (Jain and Chlamtac, Comm. ACM 28, 1985).
+    Five markers are kept per element so values can be scalars or arrays of fixed shape. When p is a sequence, all
+    quantiles are estimated at once and the estimates have a leading quantile axis.
+    """
+
+    def __init__(self, p):
+        """
+
+        Parameters
+        ----------
+        p : float or sequence of floats
+            quantile(s) to estimate (0 < p < 1)
+        """
+        self.p = p
+        self._p = np.asarray(p, dtype=float)
+        self.n = 0
+        self._initial = []
+        self.heights = None
+        self.positions = None
+        zero = np.zeros_like(self._p)
+        self.desired = np.array([zero, 2 * self._p, 4 * self._p, 2 + 2 * self._p, zero + 4])
+        self.increments = np.array([zero, self._p / 2, self._p, (1 + self._p) / 2, zero + 1])
+
+    def update(self, value):
+        value = np.asarray(value, dtype=float)
+        self.n += 1
+        if self.heights is None:
+            self._initial.append(value)
+            if len(self._initial) == 5:
+                heights = np.sort(np.array(self._initial), axis=0)
+                shape = (5,) + self._p.shape + value.shape
+                self.heights = np.broadcast_to(heights.reshape((5,) + (1,) * self._p.ndim + value.shape),
+                                               shape).copy()
+                self.positions = np.broadcast_to(np.arange(5.0).reshape((5,) + (1,) * (len(shape) - 1)),
+                                                 shape).copy()
+                self._initial = []
+            return
+
+        q, n = self.heights, self.positions
+        # quantile axis first, then the shape of the values
+        value = np.broadcast_to(value, q.shape[1:])
+        extra = (1,) * (value.ndim - self._p.ndim)
+        q[0] = np.minimum(q[0], value)
+        q[4] = np.maximum(q[4], value)
+        # cell of the new observation
+        k = (q[1:4] <= value).sum(axis=0)
+        n[1:] += np.arange(1, 5).reshape((4,) + (1,) * value.ndim) > k
+        self.desired = self.desired + self.increments
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(1, 4):
+                d = self.desired[i].reshape(self._p.shape + extra) - n[i]
+                move = ((d >= 1) & (n[i + 1] - n[i] > 1)) | ((d <= -1) & (n[i - 1] - n[i] < -1))
+                if not np.any(move):
+                    continue
+                s = np.where(d >= 0, 1.0, -1.0)
+                parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                q_neighbor = np.where(s > 0, q[i + 1], q[i - 1])
+                n_neighbor = np.where(s > 0, n[i + 1], n[i - 1])
+                linear = q[i] + s * (q_neighbor - q[i]) / (n_neighbor - n[i])
+                new = np.where((q[i - 1] < parabolic) & (parabolic < q[i + 1]), parabolic, linear)
+                q[i] = np.where(move, new, q[i])
+                n[i] = np.where(move, n[i] + s, n[i])
+
+    @property
+    def value(self):
+        """ Current estimate of the quantile. Exact for less than 5 samples """
+        if self.heights is None:
+            if not self._initial:
+                return np.nan
+            return np.percentile(np.array(self._initial), 100 * self._p, axis=0)
+        return self.heights[2].copy()
+
+    def get_state(self):
+        return {'p': self.p, 'n': self.n, 'initial': list(self._initial), 'heights': self.heights,
+                'positions': self.positions, 'desired': self.desired}
+
+    @classmethod
+    def from_state(cls, state):
+        quantile = cls(state['p'])
+        quantile.n = state['n']
+        quantile._initial = list(state['initial'])
+        quantile.heights = state['heights']
+        quantile.positions = state['positions']
+        quantile.desired = state['desired']
+        return quantile
+
+
+class InclusionCounts(object):
+    """
+    Counts how often each multiplicity is on in a multiplicity bitstring trace. With size, counts a vector of size
+    bitstrings at once.
+    """
+
+    multiplicities = (1, 2, 3, 4, 5, 6)
+
+    def __init__(self, size=None):
+        self.size = size
+        self.n = 0
+        shape = (len(self.multiplicities),) if size is None else (size, len(self.multiplicities))
+        self.counts = np.zeros(shape, dtype=np.int64)
+
+    def update(self, value):
+        self.n += 1
+        decoded = decode_multiplicity_bitstring(value, self.multiplicities)
+        self.counts += decoded[0] if self.size is None else decoded
+
+    @property
+    def frequencies(self):
+        """ dict mapping multiplicity to fraction of samples it was included in """
+        return _frequencies(self.n, self.counts)
+
+    def get_state(self):
+        return {'n': self.n, 'size': self.size, 'counts': self.counts}
+
+    @classmethod
+    def from_state(cls, state):
+        inclusion = cls(state.get('size'))
+        inclusion.n, inclusion.counts = state['n'], np.array(state['counts'])
+        return inclusion
+
+
+def _frequencies(n, counts):
+    if n == 0:
+        return {str(m): np.nan for m in InclusionCounts.multiplicities}
+    return {str(m): counts[i] / float(n) for i, m in enumerate(InclusionCounts.multiplicities)}
+
+
+class StreamingSummaries(object):
+    """
+    Streaming summaries for a set of pymc variables. Multiplicity bitstrings get inclusion counts, all other variables
+    get running moments and P-square quantiles.
+
+    The values of all variables are packed into one vector so every update is a handful of numpy operations instead of
+    one accumulator object per variable and quantile.
+
+    Attributes
+    ----------
+    variables: list of pymc variables
+    quantiles: tuple of floats
+    interval: int. summaries are updated every interval calls to update
+    layout: OrderedDict mapping variable name to (start, stop, shape) in the packed vector
+    """
+
+    def __init__(self, variables, quantiles=(0.025, 0.5, 0.975), interval=1):
+        """
+
+        Parameters
+        ----------
+        variables : list of pymc variables
+        quantiles : tuple of floats
+            quantiles to estimate. Default (0.025, 0.5, 0.975)
+        interval : int
+            only add every interval-th sample. Default 1
+        """
+        self.variables = list(variables)
+        self.quantiles = tuple(quantiles)
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        """ Start new accumulators (new chain) """
+        self.bitstrings = [v for v in self.variables if v.__name__.endswith('multiplicity_bitstring')]
+        self.continuous = [v for v in self.variables if not v.__name__.endswith('multiplicity_bitstring')]
+        self.layout = OrderedDict()
+        start = 0
+        for variable in self.continuous:
+            shape = np.shape(variable.value)
+            size = int(np.prod(shape))
+            self.layout[variable.__name__] = (start, start + size, shape)
+            start += size
+        self._values = np.zeros(start)
+        self._calls = 0
+        self.moments = RunningMoments()
+        self.quantile = P2Quantile(self.quantiles)
+        self.inclusion = InclusionCounts(len(self.bitstrings))
+
+    def update(self):
+        """ Add current values of the variables (every interval calls) """
+        self._calls += 1
+        if (self._calls - 1) % self.interval:
+            return
+        for variable, (start, stop, shape) in zip(self.continuous, self.layout.values()):
+            self._values[start:stop] = np.ravel(variable.value)
+        if len(self._values):
+            self.moments.update(self._values)
+            self.quantile.update(self._values)
+        if self.bitstrings:
+            self.inclusion.update([variable.value for variable in self.bitstrings])
+
+    def summary(self):
+        """
+        Returns
+        -------
+        summary : dict mapping variable name to dict of summaries. Keys are 'n', 'mean', 'variance' and 'quantiles'
+            (dict mapping quantile to estimate) or 'n' and 'inclusion' for multiplicity bitstrings.
+        """
+        return _summarize(self.get_state())
+
+    def get_state(self):
+        return {'layout': [(name,) + tuple(entry) for name, entry in self.layout.items()],
+                'bitstrings': [variable.__name__ for variable in self.bitstrings],
+                'quantiles': self.quantiles, 'interval': self.interval, 'calls': self._calls,
+                'moments': self.moments.get_state(), 'quantile': self.quantile.get_state(),
+                'inclusion': self.inclusion.get_state()}
+
+    def set_state(self, state):
+        """ Continue from a saved state of the same variables """
+        if [tuple(entry) for entry in state['layout']] != [(name,) + tuple(entry) for name, entry in
+                                                            self.layout.items()]:
+            raise ValueError("Saved summaries are for different variables")
+        self._calls = state['calls']
+        self.moments = RunningMoments.from_state(state['moments'])
+        self.quantile = P2Quantile.from_state(state['quantile'])
+        self.inclusion = InclusionCounts.from_state(state['inclusion'])
+
+
+def _unpack(values, start, stop, shape):
+    """ Values of one variable from the packed vector """
+    if values is None or np.ndim(values) == 0:
+        return values
+    return np.asarray(values)[start:stop].reshape(shape)
+
+
+def _summarize(state):
+    moments = RunningMoments.from_state(state['moments'])
+    quantile = P2Quantile.from_state(state['quantile'])
+    mean, variance, quantiles = moments.mean, moments.variance, quantile.value
+    summary = {}
+    for name, start, stop, shape in state['layout']:
+        summary[name] = {'n': moments.n, 'mean': _unpack(mean, start, stop, shape),
+                         'variance': _unpack(variance, start, stop, shape),
+                         'quantiles': {p: _unpack(quantiles[i] if np.ndim(quantiles) else quantiles, start, stop, shape)
+                                       for i, p in enumerate(state['quantiles'])}}
+    inclusion = state['inclusion']
+    for i, name in enumerate(state['bitstrings']):
+        summary[name] = {'n': inclusion['n'], 'inclusion': _frequencies(inclusion['n'], inclusion['counts'][i])}
+    return summary
+
+
+def get_summaries(db, chain=-1):
+    """
+    Read the streaming summaries stored at the last checkpoint of a chain. Does not read the traces.
+
+    Parameters
+    ----------
+    db : pymc.database (sqlite_plus or netcdf4)
+    chain : int
+        Default -1 (last chain)
+
+    Returns
+    -------
+    summary : dict. See StreamingSummaries.summary
+    """
+    state = db.getstate(chain) or {}
+    if not state.get('summaries'):
+        raise KeyError("No streaming summaries in the database. The run needs to be sampled with "
+                       "TorsionFitMCMC(summaries=True)")
+    return _summarize(state['summaries'])
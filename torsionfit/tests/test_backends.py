@@ -11,6 +11,7 @@ import pymc
 import pymc.database
 from torsionfit.backends import netcdf4, sqlite_plus
 from torsionfit.tests.utils import get_fun
+from torsionfit.utils import MultiplicityTable
 
 from pymc.tests.test_database import TestPickle, TestSqlite
 import numpy as np
@@ -105,3 +106,14 @@ class TestSqlitPlusDB(unittest.TestCase):
         keys = ['1', '2', '3', '4', '5', '6']
         self.assertEqual(set(mult.keys()), set(keys))
 
+    def test_multiplicity_table(self):
+        """Tests marginal inclusion probabilities and model frequencies"""
+        db = sqlite_plus.load(get_fun('butane.db'))
+        table = MultiplicityTable(db, n5=True)
+        self.assertEqual(len(table.torsions), 5)
+        inclusion, frequencies = table.tables()
+        self.assertEqual(inclusion.shape, (5, 6))
+        np.testing.assert_almost_equal(frequencies.sum(1), np.ones(5))
+        mult = db.get_multiplicity_trace(table.torsions[0].split('_'), n5=True)
+        self.assertAlmostEqual(inclusion[0][0], np.mean(mult['1']))
+
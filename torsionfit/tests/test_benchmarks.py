@@ -0,0 +1,37 @@
+""" Tests synthetic benchmark workloads """
+
+import unittest
+import numpy as np
+from torsionfit import benchmarks
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_synthetic_database(self):
+        """ Test synthetic chain has the right frames, bond lengths and torsion types """
+        db, param = benchmarks.synthetic_database(n_atoms=8, n_frames=5, n_types=2)
+        self.assertEqual(db.n_frames, 5)
+        self.assertEqual(db.positions.shape, (5, 8, 3))
+        bonds = np.linalg.norm(np.diff(db.xyz, axis=1), axis=2)
+        np.testing.assert_allclose(bonds, 0.153, rtol=1e-5)
+        to_optimize = benchmarks.to_optimize(db.structure)
+        # CG331-CG321-CX1-CG321, CG321-CX1-CG321-CX1 and CX1-CG321-CX1-CG331
+        self.assertEqual(len(to_optimize), 3)
+        db.build_phis(to_optimize=to_optimize)
+        self.assertEqual(sorted(db.phis), sorted(to_optimize))
+        self.assertEqual(sum(phis.shape[1] for phis in db.phis.values()), 5)
+        for phis in db.phis.values():
+            self.assertEqual(phis.shape[0], 5)
+
+    def test_compare(self):
+        """ Test regressions are flagged """
+        workload = {'n_atoms': 4}
+        old = {'results': [{'benchmark': 'a', 'workload': workload, 'min': 1.0},
+                           {'benchmark': 'b', 'workload': workload, 'min': 1.0},
+                           {'benchmark': 'c', 'workload': workload, 'error': 'No module named pymc'}]}
+        new = {'results': [{'benchmark': 'a', 'workload': workload, 'min': 1.1},
+                           {'benchmark': 'b', 'workload': workload, 'min': 2.0}]}
+        regressions, comparison = benchmarks.compare(old, new, tolerance=1.2)
+        self.assertEqual(len(comparison), 2)
+        self.assertEqual([r[0] for r in regressions], ['b'])
+        self.assertAlmostEqual(regressions[0][-1], 2.0)
@@ -0,0 +1,54 @@
+""" Tests command line runner """
+
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+from torsionfit.tests.utils import get_fun
+from torsionfit import cli
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_load_config(self):
+        """ Test defaults and paths relative to config """
+        filename = os.path.join(self.tmp, 'fit.yaml')
+        with open(filename, 'w') as f:
+            f.write("param: par.prm\n"
+                    "param_to_opt: [[CG331, CG321, CG321, CG331]]\n"
+                    "scans:\n"
+                    "  - directory: scan\n"
+                    "    structure: /data/butane.psf\n"
+                    "model:\n"
+                    "  rj: false\n"
+                    "chains: 2\n")
+        config = cli.load_config(filename)
+        self.assertEqual(config['param'], [os.path.join(self.tmp, 'par.prm')])
+        self.assertEqual(config['param_to_opt'], [('CG331', 'CG321', 'CG321', 'CG331')])
+        self.assertEqual(config['scans'][0]['directory'], os.path.join(self.tmp, 'scan'))
+        self.assertEqual(config['scans'][0]['structure'], '/data/butane.psf')
+        self.assertFalse(config['model']['rj'])
+        self.assertEqual(config['model']['tau'], 'mult')
+        self.assertEqual(cli.dbname(config, 1), os.path.join(self.tmp, 'torsionfit_1.sqlite'))
+        with self.assertRaises(ValueError):
+            cli.load_config({'scans': [{'directory': 'scan'}], 'param_to_opt': [], 'chain': 2})
+
+    def test_load_scan(self):
+        """ Test parallel parsing into a store gives the same database as parse_psi4_out """
+        from torsionfit.database.qmdatabase import parse_psi4_out
+        scan = {'directory': get_fun('MP2_torsion_scan/'), 'pattern': '*.out2',
+                'store': os.path.join(self.tmp, 'qm.sqlite')}
+        frag = cli.load_scan(scan, structure=get_fun('butane.psf'), processes=2, optimized_only=False)
+        reference = parse_psi4_out(get_fun('MP2_torsion_scan/'), get_fun('butane.psf'), pattern='*.out2')
+        self.assertEqual(frag.n_frames, reference.n_frames)
+        np.testing.assert_allclose(np.sort(frag.qm_energy._value), np.sort(reference.qm_energy._value), atol=1e-6)
+        # cached
+        frag = cli.load_scan(scan, structure=get_fun('butane.psf'), processes=2, optimized_only=False)
+        self.assertEqual(frag.n_frames, reference.n_frames)
@@ -0,0 +1,78 @@
+""" Tests deduplication of torsion scan points """
+
+import unittest
+import tempfile
+import shutil
+import os
+import json
+import numpy as np
+import mdtraj as md
+from torsionfit.tests.utils import get_fun
+from torsionfit.qmscan.dedup import atom_classes, canonical_torsion, guess_bonds, dedup_scan, proper_permutation
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        traj = md.load(get_fun('butane.pdb'))
+        self.traj = traj
+        self.elements = [atom.element.symbol for atom in traj.topology.atoms]
+        self.bonds = guess_bonds(traj.xyz[0], self.elements)
+        self.tmp = tempfile.mkdtemp()
+        for tor_name in ('4_7_10_14', '1_4_7_10', '11_14_10_7', '5_7_10_14', '6_7_10_14'):
+            for angle in (0, 120, 240, 360):
+                folder = os.path.join(self.tmp, tor_name, str(angle))
+                os.makedirs(folder)
+                shutil.copy(get_fun('butane.pdb'), os.path.join(folder, 'butane_{}_{}.pdb'.format(tor_name, angle)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_guess_bonds(self):
+        """ Tests guessing bonds of butane """
+        self.assertEqual(len(self.bonds), 13)
+
+    def test_canonical_torsion(self):
+        """ Tests symmetry equivalent torsions have the same key """
+        classes = atom_classes(self.elements, self.bonds)
+        self.assertEqual(len(set(classes)), 4)
+        self.assertEqual(canonical_torsion((0, 3, 6, 9), classes), canonical_torsion((10, 13, 9, 6), classes))
+        self.assertEqual(canonical_torsion((3, 6, 9, 13), classes), canonical_torsion((13, 9, 6, 3), classes))
+        self.assertNotEqual(canonical_torsion((0, 3, 6, 9), classes), canonical_torsion((3, 6, 9, 13), classes))
+
+    def test_dedup_scan(self):
+        """ Tests duplicate scan points map to the computed point """
+        mapping = dedup_scan(self.tmp)
+        self.assertEqual(len(mapping), 8)
+        self.assertEqual(mapping['4_7_10_14/360']['source'], '4_7_10_14/0')
+        self.assertEqual(mapping['4_7_10_14/360']['permutation'], list(range(14)))
+        duplicate = mapping['11_14_10_7/120']
+        self.assertEqual(duplicate['source'], '1_4_7_10/120')
+        self.assertEqual(duplicate['torsion'], [11, 14, 10, 7])
+        self.assertEqual(duplicate['angle'], 120)
+        self.assertEqual(mapping['11_14_10_7/360']['source'], '1_4_7_10/0')
+        # the hydrogens of a CH2 are mirror images. H21 at 60 and H22 at 60 are different scan points
+        self.assertEqual(mapping['5_7_10_14/360']['source'], '5_7_10_14/0')
+        self.assertEqual(mapping['6_7_10_14/360']['source'], '6_7_10_14/0')
+        for angle in (0, 120, 240):
+            self.assertNotIn('6_7_10_14/{}'.format(angle), mapping)
+        with open(os.path.join(self.tmp, 'scan_mapping.json')) as f:
+            self.assertEqual(json.load(f), mapping)
+
+    def test_proper_permutation(self):
+        """ Tests permuted geometry has the dihedral of the source at the duplicate torsion and mirrors are rejected """
+        xyz = self.traj.xyz[0]
+        permutation = proper_permutation((0, 3, 6, 9), (10, 13, 9, 6), self.elements, self.bonds, xyz)
+        self.assertIsNotNone(permutation)
+        permuted = self.traj.slice(0)
+        permuted.xyz[0][permutation] = xyz
+        np.testing.assert_allclose(md.compute_dihedrals(permuted, [[10, 13, 9, 6]]),
+                                   md.compute_dihedrals(self.traj, [[0, 3, 6, 9]]), atol=1e-4)
+        # H4-C6-C9-C13 and H5-C6-C9-C13 (0 based) are mirror images
+        self.assertEqual(canonical_torsion((4, 6, 9, 13), atom_classes(self.elements, self.bonds)),
+                         canonical_torsion((5, 6, 9, 13), atom_classes(self.elements, self.bonds)))
+        self.assertIsNone(proper_permutation((4, 6, 9, 13), (5, 6, 9, 13), self.elements, self.bonds, xyz))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+""" Test convergence diagnostics """
+
+import unittest
+import numpy as np
+from torsionfit.diagnostics import ConvergenceDiagnostics, split_rhat, trace_statistics
+
+
+class Trace(object):
+    def __init__(self, values, db=None):
+        self.values = values
+        self.db = db
+
+    def __getitem__(self, item):
+        if self.db is not None:
+            self.db.reads += 1
+        return self.values[item]
+
+    def length(self, chain=-1):
+        return len(self.values)
+
+
+class RamDB(object):
+    """ Minimal in memory database with the pymc trace interface. Counts how often samples are read """
+    def __init__(self, traces):
+        self.traces = traces
+        self.reads = 0
+
+    def trace(self, name):
+        return Trace(self.traces[name], self)
+
+
+class TestDiagnostics(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.stationary = np.random.normal(size=2000)
+        self.drift = np.concatenate((np.linspace(10, 0, 500), np.random.normal(size=1500)))
+
+    def test_split_rhat(self):
+        """ Tests split R-hat of stationary and non stationary traces """
+        self.assertAlmostEqual(split_rhat(self.stationary), 1.0, places=2)
+        self.assertGreater(split_rhat(np.linspace(0, 10, 1000)), 1.5)
+        self.assertTrue(np.isnan(split_rhat(np.ones(100))))
+
+    def test_trace_statistics(self):
+        """ Tests equilibration time is detected """
+        stats = trace_statistics(self.drift)
+        self.assertGreater(stats.t0, 100)
+        self.assertLess(stats.t0, 700)
+        self.assertLessEqual(stats.ess, len(self.drift) - stats.t0)
+        self.assertEqual(stats[0], stats.t0)
+
+    def test_multidimensional(self):
+        """ Tests statistics of vector traces are computed per column """
+        stats = trace_statistics(np.vstack((self.stationary, self.drift)).T)
+        self.assertEqual(stats.t0.shape, (2,))
+        self.assertEqual(stats.t0[1], trace_statistics(self.drift).t0)
+
+    def test_cached_update(self):
+        """ Tests only traces that grew are read and recomputed and the cache is keyed by burn """
+        db = RamDB({'a': self.stationary[:1000], 'b': self.drift})
+        with ConvergenceDiagnostics(db, processes=2) as diagnostics:
+            first = diagnostics.update(['a', 'b'])
+            executor = diagnostics._executor
+            self.assertEqual(db.reads, 2)
+            db.traces['a'] = self.stationary[:1500]
+            second = diagnostics.update(['a', 'b'])
+            self.assertEqual(db.reads, 3)
+            self.assertIs(first['b'], second['b'])
+            self.assertIsNot(first['a'], second['a'])
+            self.assertIn(('a', 0, 1500), diagnostics.statistics)
+            self.assertNotIn(('a', 0, 1000), diagnostics.statistics)
+
+            # a different burn is not served from the burn 0 statistics
+            db.traces['a'] = self.stationary[:1600]
+            burned = diagnostics.update(['a', 'b'], burn=100)
+            self.assertIn(('a', 100, 1500), diagnostics.statistics)
+            self.assertEqual(burned['a'], trace_statistics(self.stationary[100:1600]))
+            self.assertIs(diagnostics['a'], burned['a'])
+            self.assertIs(diagnostics._executor, executor)
+        self.assertIsNone(diagnostics._executor)
+
+if __name__ == '__main__':
+    unittest.main()
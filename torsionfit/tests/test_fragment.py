@@ -4,10 +4,14 @@ __author__ = 'Chaya D. Stern'
 
 from torsionfit.tests.utils import get_fun, has_openeye
 import unittest
+import tempfile
+import shutil
+import os
 if has_openeye:
     from openmoltools.openeye import get_charges, smiles_to_oemol
     import openeye.oechem as oechem
     from torsionfit.qmscan import fragment
+    from torsionfit.qmscan.charges import ChargeCache
     mol = smiles_to_oemol('CN(C)C/C=C/C(=O)NC1=C(C=C2C(=C1)C(=NC=N2)NC3=CC(=C(C=C3)F)Cl)O[C@H]4CCOC4')
     charged = get_charges(mol, keep_confs=1)
 
@@ -128,3 +132,24 @@ class TestFragments(unittest.TestCase):
 
 
 
+
+    @unittest.skipUnless(has_openeye, "Cannot test without OpenEye")
+    def test_charge_cache(self):
+        """Test charges and Wiberg bond orders are reused from cache"""
+        path = tempfile.mkdtemp()
+        filename = os.path.join(path, 'charges.sqlite')
+        cache = ChargeCache(filename)
+        cache.add(ChargeCache.smiles(mol), charged)
+        cache.close()
+
+        cache = ChargeCache(filename)
+        cached, frags = fragment.generate_fragments(mol, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        for bond in charged.GetBonds():
+            cached_bond = cached.GetBond(oechem.OEHasBondIdx(bond.GetIdx()))
+            self.assertEqual(bond.GetData('WibergBondOrder'), cached_bond.GetData('WibergBondOrder'))
+        for atom in charged.GetAtoms():
+            cached_atom = cached.GetAtom(oechem.OEHasAtomIdx(atom.GetIdx()))
+            self.assertAlmostEqual(atom.GetPartialCharge(), cached_atom.GetPartialCharge())
+        cache.close()
+        shutil.rmtree(path)
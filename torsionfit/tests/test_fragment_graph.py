@@ -0,0 +1,67 @@
+""" Test fragmentation graph algorithms """
+
+__author__ = 'Chaya D. Stern'
+
+import unittest
+import itertools
+import numpy as np
+from torsionfit.qmscan.fragment_graph import connected_subgraphs, BondTable, union_find, fragment_bonds
+
+
+def is_connected(nodes, edges):
+    nodes = set(nodes)
+    component = {min(nodes)}
+    grown = True
+    while grown:
+        grown = False
+        for i, j in edges:
+            if i in nodes and j in nodes and (i in component) != (j in component):
+                component |= {i, j}
+                grown = True
+    return component == nodes
+
+
+class TestFragmentGraph(unittest.TestCase):
+
+    def test_connected_subgraphs(self):
+        """ Test every connected subgraph is enumerated once """
+        edges = [(0, 1), (1, 2), (2, 3), (3, 0), (2, 4), (5, 6)]
+        subgraphs = [nodes for nodes, items in connected_subgraphs(7, edges)]
+        self.assertEqual(len(subgraphs), len(set(subgraphs)))
+        expected = [c for n in range(1, 8) for c in itertools.combinations(range(7), n) if is_connected(c, edges)]
+        self.assertEqual(sorted(subgraphs), sorted(expected))
+
+    def test_max_items(self):
+        """ Test pruning by number of rotors """
+        edges = [(i, i + 1) for i in range(5)]
+        node_items = [{i} for i in range(6)]
+        edge_items = {(i, i + 1): {10 + i} for i in range(5)}
+        subgraphs = dict(connected_subgraphs(6, edges, node_items, edge_items, max_items=3))
+        # single fragments have 1 rotor and pairs 3
+        self.assertEqual(len(subgraphs), 11)
+        self.assertEqual(subgraphs[(2, 3)], {2, 3, 12})
+
+    def test_max_size(self):
+        """ Test limit on number of fragments """
+        edges = [(0, 1), (1, 2)]
+        subgraphs = [nodes for nodes, items in connected_subgraphs(3, edges, max_size=2)]
+        self.assertNotIn((0, 1, 2), subgraphs)
+        self.assertEqual(list(connected_subgraphs(1, [], max_size=0)), [])
+
+    def test_union_find(self):
+        """ Test connected components """
+        labels = union_find(6, [(4, 5), (0, 2), (2, 3)])
+        np.testing.assert_array_equal(labels, [0, 1, 0, 0, 2, 2])
+
+    def test_fragment_bonds(self):
+        """ Test fragmenting at bonds with low Wiberg bond order """
+        # H0-C1-C2(=O3)-N4-C5, C5-H6. C2-N4 is in a functional group and C1-C2 has a low bond order
+        table = BondTable(7, [(0, 1), (1, 2), (2, 3), (2, 4), (4, 5), (5, 6)], [0.9, 1.0, 1.8, 1.1, 1.0, 0.9],
+                          index=[10, 11, 12, 13, 14, 15], fgroup=[False, False, True, True, False, False])
+        np.testing.assert_array_equal(table.cut_mask(), [False, True, False, False, True, False])
+        fragments = fragment_bonds(table)
+        self.assertEqual(len(fragments), 3)
+        atoms, bonds = fragments[1]
+        np.testing.assert_array_equal(atoms, [2, 3, 4])
+        np.testing.assert_array_equal(bonds, [12, 13])
+        np.testing.assert_array_equal(fragments[2][0], [5, 6])
@@ -0,0 +1,46 @@
+""" Test fragment library """
+
+__author__ = 'Chaya D. Stern'
+
+import unittest
+import tempfile
+import shutil
+import os
+from torsionfit.tests.utils import has_openeye
+from torsionfit.qmscan.fragment_library import FragmentLibrary, fragment_library
+
+
+class TestFragmentLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_library(self):
+        """ Test fragments are deduplicated across parents """
+        library = FragmentLibrary(os.path.join(self.tmp, 'fragments.sqlite'))
+        library.add('butane', 'CCCC', {'CCCC': [3]})
+        library.add('pentane', 'CCCCC', {'CCCC': [3, 6]})
+        library.add('pentane', 'CCCCC', {'CCCC': [3, 6]})
+        library.add('broken', 'C1C', {}, error='ValueError')
+        self.assertEqual(len(library), 1)
+        self.assertTrue('CCCCC' in library)
+        self.assertEqual(library.fragments(), [('CCCC', 2)])
+        self.assertEqual(library.coverage('CCCC'), [('butane', 'CCCC', 3), ('pentane', 'CCCCC', 3),
+                                                    ('pentane', 'CCCCC', 6)])
+        self.assertEqual(library.errors(), [('broken', 'C1C', 'ValueError')])
+        library.close()
+
+    @unittest.skipUnless(has_openeye, "Cannot test without OpenEye")
+    def test_fragment_library(self):
+        """ Test fragmenting a SMILES file """
+        infile = os.path.join(self.tmp, 'parents.smi')
+        with open(infile, 'w') as f:
+            f.write('CCCCCC hexane\nCCCCCC hexane2\nCCCCCCC heptane\n')
+        library = fragment_library(infile, os.path.join(self.tmp, 'fragments.sqlite'), processes=2)
+        self.assertEqual(library.conn.execute("SELECT COUNT(*) FROM parents").fetchone()[0], 2)
+        self.assertTrue(len(library) > 0)
+        self.assertEqual(library.errors(), [])
+        library.close()
@@ -1,7 +1,42 @@
 #!/usr/bin/python
 
+import sys
+import json
+import subprocess
+
+# Modules that are imported on first use
+HEAVY = ['pymc', 'simtk', 'openmm', 'mdtraj', 'parmed', 'cclib', 'pandas', 'matplotlib', 'pymbar', 'openeye',
+         'networkx', 'celery', 'yaml', 'pkg_resources']
+LIGHT = ['torsionfit', 'torsionfit.database', 'torsionfit.utils', 'torsionfit.profiling', 'torsionfit.summaries',
+         'torsionfit.diagnostics', 'torsionfit.qmscan.dedup', 'torsionfit.qmscan.scheduler',
+         'torsionfit.qmscan.packing', 'torsionfit.qmscan.ingest', 'torsionfit.qmscan.fragment_graph',
+         'torsionfit.qmscan.qmtasks', 'torsionfit.qmscan.torsion_scan', 'torsionfit.qmscan.torsion_drive',
+         'torsionfit.qmscan.wavefront']
+# seconds
+BUDGET = 1.0
+
+
 def test_import():
     """
     Testing import of torsionfit.
     """
     import torsionfit
+
+
+def test_import_time():
+    """
+    Testing light modules import fast and do not import heavy dependencies
+    """
+    script = """
+import sys, time, json, importlib
+start = time.perf_counter()
+for module in {light}:
+    importlib.import_module(module)
+seconds = time.perf_counter() - start
+heavy = sorted(m for m in {heavy} if m in sys.modules)
+print(json.dumps([seconds, heavy]))
+""".format(light=LIGHT, heavy=HEAVY)
+    output = subprocess.check_output([sys.executable, '-c', script]).decode()
+    seconds, heavy = json.loads(output.strip().splitlines()[-1])
+    assert heavy == [], "importing {} imported {}".format(LIGHT, heavy)
+    assert seconds < BUDGET, "importing {} took {:.2f} s".format(LIGHT, seconds)
@@ -0,0 +1,61 @@
+""" Tests incremental ingestion of psi4 output into QMStore """
+
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+from torsionfit.tests.utils import get_fun
+import torsionfit.database.qmdatabase as qmdb
+from torsionfit.database.qmstore import QMStore
+from torsionfit.qmscan.ingest import Ingester
+
+
+class TestIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.scan = os.path.join(self.tmp, 'scan')
+        shutil.copytree(get_fun('MP2_torsion_scan'), self.scan)
+        self.store = QMStore(os.path.join(self.tmp, 'qm.sqlite'))
+        self.structure = get_fun('butane.psf')
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def test_poll(self):
+        """ Tests polling ingests every finished output once """
+        ingester = Ingester(self.store, self.scan, pattern='*.out2')
+        added = ingester.poll()
+        self.assertEqual(len(added), 14)
+        self.assertEqual(len(self.store), 14)
+        self.assertEqual(ingester.poll(), [])
+
+    def test_to_qmdatabase(self):
+        """ Tests the stored scan matches parsing the directory """
+        Ingester(self.store, self.scan, pattern='*.out2').poll()
+        stored = self.store.to_qmdatabase(self.structure)
+        parsed = qmdb.parse_psi4_out(self.scan, self.structure, pattern='*.out2')
+        np.testing.assert_equal(stored.angles, parsed.angles)
+        np.testing.assert_equal(stored.torsion_index, parsed.torsion_index)
+        np.testing.assert_equal(stored.optimized, parsed.optimized)
+        np.testing.assert_almost_equal(stored.xyz, parsed.xyz)
+        np.testing.assert_almost_equal(stored.qm_energy._value, parsed.qm_energy._value)
+
+    def test_growing_scan(self):
+        """ Tests unfinished outputs are ingested when they finish """
+        out_file = os.path.join(self.scan, '0', 'butane_0.out2')
+        contents = open(out_file).read()
+        with open(out_file, 'w') as f:
+            f.write(contents[:len(contents) // 2])
+        ingester = Ingester(self.store, self.scan, pattern='*.out2')
+        self.assertEqual(len(ingester.poll()), 13)
+        with open(out_file, 'w') as f:
+            f.write(contents)
+        self.assertEqual(ingester.poll(), [out_file])
+        self.assertEqual(self.store.to_qmdatabase(self.structure, optimized_only=True).n_frames, 13)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+""" Tests incremental likelihood of the residual energies """
+
+import unittest
+import numpy as np
+from torsionfit import benchmarks
+from torsionfit.database.shared import fourier_inner_sum
+from torsionfit.database.torsion_index import TorsionIndex
+from torsionfit.likelihood import IncrementalLikelihood
+try:
+    import pymc
+    from torsionfit.model import TorsionFitModel
+    has_pymc = True
+except ImportError:
+    has_pymc = False
+
+
+class TestLikelihood(unittest.TestCase):
+
+    def setUp(self):
+        frags = []
+        to_optimize = []
+        for i, n_atoms in enumerate([5, 6, 10]):
+            db, param = benchmarks.synthetic_database(n_atoms=n_atoms, n_frames=4 + i, n_types=2,
+                                                      resname='SY{}'.format(i), seed=i)
+            frags.append(db)
+            to_optimize.extend(t for t in benchmarks.to_optimize(db.structure) if t not in to_optimize)
+        for db in frags:
+            db.build_phis(to_optimize=to_optimize)
+        self.frags = frags
+        self.param = param
+        self.to_optimize = to_optimize
+        self.inner_sum = [fourier_inner_sum(db.phis) for db in frags]
+        self.index = TorsionIndex(frags, to_optimize, torsions=[list(s) for s in self.inner_sum])
+        self.observed = np.concatenate([db.delta_energy._value for db in frags])
+
+    def full(self, K, log_sigma):
+        mm = np.concatenate([sum((K[t]*s[t]).sum(1) for t in s) for s in self.inner_sum])
+        tau = np.exp(-2*log_sigma)
+        return np.sum(0.5*np.log(0.5*tau/np.pi) - 0.5*tau*(self.observed - mm)**2), mm
+
+    def test_logp(self):
+        """ Test single site updates, rejections and log_sigma give the full likelihood """
+        likelihood = IncrementalLikelihood(self.observed, self.inner_sum, self.index, refresh_interval=7)
+        random = np.random.RandomState(0)
+        K = {t: random.normal(0, 1, 6) for t in self.index.torsions}
+        log_sigma = np.log(0.5)
+        np.testing.assert_allclose(likelihood.logp(K, log_sigma), self.full(K, log_sigma)[0])
+        for step in range(50):
+            t = self.index.torsions[random.randint(len(self.index.torsions))]
+            proposed = dict(K)
+            proposed[t] = K[t].copy()
+            proposed[t][random.randint(6)] += random.normal()
+            np.testing.assert_allclose(likelihood.logp(proposed, log_sigma), self.full(proposed, log_sigma)[0])
+            if random.rand() < 0.5:
+                K = proposed
+            log_sigma += random.normal(0, 0.1)
+            np.testing.assert_allclose(likelihood.logp(K, log_sigma), self.full(K, log_sigma)[0])
+        np.testing.assert_allclose(likelihood.energy(), self.full(K, log_sigma)[1], atol=1e-10)
+        with self.assertRaises(ValueError):
+            IncrementalLikelihood(self.observed[:-1], self.inner_sum, self.index)
+
+    @unittest.skipUnless(has_pymc, "Cannot test without pymc")
+    def test_model(self):
+        """ Test the incremental model gives the same qm_fit logp and torsion energy as the full model """
+        np.random.seed(0)
+        full = TorsionFitModel(self.param, self.frags, param_to_opt=self.to_optimize, rj=True, init_random=False)
+        incremental = TorsionFitModel(self.param, self.frags, param_to_opt=self.to_optimize, rj=True,
+                                      init_random=False, incremental=True)
+        self.assertFalse(incremental.pymc_parameters['torsion_energy'].keep_trace)
+        sampler = pymc.MCMC(incremental.pymc_parameters)
+        for step in range(5):
+            sampler.sample(iter=2, progress_bar=False)
+            for name, node in incremental.pymc_parameters.items():
+                if isinstance(node, pymc.Stochastic) and not node.observed:
+                    full.pymc_parameters[name].value = node.value
+            np.testing.assert_allclose(incremental.pymc_parameters['qm_fit'].logp, full.pymc_parameters['qm_fit'].logp)
+            np.testing.assert_allclose(incremental.pymc_parameters['torsion_energy'].value,
+                                       full.pymc_parameters['torsion_energy'].value, atol=1e-10)
@@ -0,0 +1,66 @@
+""" Tests packing psi4 jobs on a node """
+
+import unittest
+import tempfile
+import shutil
+import os
+from torsionfit.tests.utils import get_fun
+from torsionfit.qmscan.packing import parse_input, CostModel, plan, lpt_makespan
+
+
+class TestPacking(unittest.TestCase):
+
+    def setUp(self):
+        self.features = parse_input(get_fun('butane_10_7_4_3_0.dat'))
+
+    def test_parse_input(self):
+        """ Tests reading atoms, method and basis from psi4 input """
+        self.assertEqual(self.features['n_atoms'], 14)
+        self.assertEqual(self.features['n_hydrogens'], 10)
+        self.assertEqual(self.features['method'], 'mp2')
+        self.assertEqual(self.features['basis'], 'aug-cc-pvtz')
+        self.assertIsNone(self.features['memory'])
+
+    def test_parse_memory(self):
+        """ Tests reading memory """
+        tmp = tempfile.mkdtemp()
+        input_file = os.path.join(tmp, 'mem.dat')
+        with open(input_file, 'w') as f:
+            f.write('\nmemory 2 GB\n' + open(get_fun('butane_10_7_4_3_0.dat')).read())
+        self.assertEqual(parse_input(input_file)['memory'], 2000)
+        shutil.rmtree(tmp)
+
+    def test_lpt(self):
+        """ Tests longest processing time first makespan """
+        self.assertEqual(lpt_makespan([4, 3, 3, 2], 2), 6)
+        self.assertEqual(lpt_makespan([5, 1, 1], 4), 5)
+
+    def test_plan(self):
+        """ Tests many jobs run single threaded and few jobs get more threads """
+        cost_model = CostModel(prefactors={'mp2': 1.0}, serial=0.1)
+        many = {str(i): self.features for i in range(64)}
+        decision = plan(many, cores=16, cost_model=cost_model)
+        self.assertEqual(decision['threads'], 1)
+        self.assertEqual(decision['slots'], 16)
+        few = {str(i): self.features for i in range(2)}
+        self.assertEqual(plan(few, cores=16, cost_model=cost_model)['threads'], 8)
+
+    def test_plan_memory(self):
+        """ Tests memory limits concurrency """
+        features = dict(self.features, memory=4000)
+        jobs = {str(i): features for i in range(64)}
+        decision = plan(jobs, cores=16, memory=16000, cost_model=CostModel())
+        self.assertEqual(decision['slots'], 4)
+        self.assertEqual(decision['threads'], 4)
+
+    def test_fit(self):
+        """ Tests refitting the cost model recovers prefactor and serial fraction """
+        true_model = CostModel(prefactors={'mp2': 2e-8}, serial=0.2)
+        records = [dict(self.features, threads=t, runtime=true_model.runtime(self.features, t)) for t in (1, 2, 4, 8)]
+        model = CostModel().fit(records)
+        self.assertAlmostEqual(model.serial, 0.2)
+        self.assertAlmostEqual(model.prefactors['mp2'] / 2e-8, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+""" Test plotting helpers """
+
+import unittest
+import numpy as np
+from numpy.testing import assert_array_equal
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from torsionfit.plots import envelope, _plot_trace, _envelope_cache
+from torsionfit.tests.test_diagnostics import RamDB
+
+
+class TestEnvelope(unittest.TestCase):
+
+    def test_envelope(self):
+        """ Tests min/max envelope keeps the extremes of every bin """
+        np.random.seed(0)
+        trace = np.random.normal(size=100000)
+        x, lower, upper = envelope(trace, 100)
+        self.assertEqual(len(x), 100)
+        assert_array_equal(lower, trace.reshape(100, -1).min(axis=1))
+        assert_array_equal(upper, trace.reshape(100, -1).max(axis=1))
+        self.assertEqual(lower.min(), trace.min())
+        self.assertTrue(np.all(np.diff(x) > 0))
+
+    def test_short_trace(self):
+        """ Tests short traces are not reduced """
+        trace = np.arange(10.0)
+        x, lower, upper = envelope(trace, 100)
+        assert_array_equal(x, np.arange(10))
+        assert_array_equal(lower, trace)
+
+    def test_cached_envelope(self):
+        """ Tests the samples are only read when the trace grew """
+        np.random.seed(0)
+        db = RamDB({'a': np.random.normal(size=10000)})
+        _plot_trace(db, 'a', 'k.', 1, 'a', downsample=100)
+        _plot_trace(db, 'a', 'k.', 1, 'a', downsample=100)
+        self.assertEqual(db.reads, 1)
+        db.traces['a'] = np.random.normal(size=20000)
+        _plot_trace(db, 'a', 'k.', 1, 'a', downsample=100)
+        self.assertEqual(db.reads, 2)
+        self.assertEqual(list(_envelope_cache[db]), [('a', 20000, 100)])
+        plt.close('all')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+""" Tests concurrent MM energies of fragments """
+
+import unittest
+import numpy as np
+from torsionfit import benchmarks
+from torsionfit.database import pool
+
+
+class TestPool(unittest.TestCase):
+
+    def setUp(self):
+        self.frags = []
+        self.to_optimize = []
+        for i, (n_atoms, n_frames) in enumerate([(5, 5), (6, 7), (10, 3)]):
+            db, param = benchmarks.synthetic_database(n_atoms=n_atoms, n_frames=n_frames, n_types=2,
+                                                      resname='SY{}'.format(i), seed=i)
+            self.frags.append(db)
+            self.to_optimize.extend(t for t in benchmarks.to_optimize(db.structure) if t not in self.to_optimize)
+        self.param = param
+
+    def sequential(self):
+        energies = []
+        for frag in self.frags:
+            frag.compute_energy(self.param)
+            energies.append(frag.mm_energy._value.copy())
+        return np.concatenate(energies)
+
+    def test_compute(self):
+        """ Test energies of the workers are the same as sequential energies after parameters change """
+        with pool.FragmentEnergyPool(self.frags, self.param, self.to_optimize) as workers:
+            self.assertEqual(len(workers), 3)
+            self.assertEqual(len(workers.energies), 15)
+            energies = workers.compute(self.param).copy()
+            np.testing.assert_allclose(energies, self.sequential(), atol=1e-4)
+            self.assertEqual(workers.n_computed, 3)
+
+            # torsion that is not in the first fragment
+            t = ('CG321', 'CX1', 'CG321', 'CX1')
+            self.assertEqual(workers.index.fragments[t], [1, 2])
+            self.param.dihedral_types[t][0].phi_k += 1.5
+            changed = workers.compute(self.param).copy()
+            self.assertEqual(workers.n_computed, 2)
+            np.testing.assert_array_equal(changed[workers.slices[0]], energies[workers.slices[0]])
+            self.assertFalse(np.allclose(changed, energies))
+            np.testing.assert_allclose(changed, self.sequential(), atol=1e-4)
+
+            # unchanged parameters are not sent again
+            self.assertIs(workers.compute(self.param), workers.energies)
+            self.assertEqual(workers.n_computed, 0)
+            np.testing.assert_array_equal(workers.energies, changed)
+        with self.assertRaises(RuntimeError):
+            workers.compute(self.param)
@@ -0,0 +1,59 @@
+""" Tests profiling timers and counters """
+
+import unittest
+import tempfile
+import shutil
+import json
+import os
+from torsionfit import profiling
+
+
+@profiling.timed('test.add')
+def add(a, b):
+    return a + b
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        profiling.disable()
+        profiling.profiler.reset()
+        shutil.rmtree(self.tmp)
+
+    def test_disabled(self):
+        """ Test nothing is recorded when profiling is off """
+        profiling.disable()
+        profiling.profiler.reset()
+        self.assertEqual(add(1, 2), 3)
+        with profiling.phase('test.block'):
+            pass
+        profiling.count('test.counter')
+        self.assertEqual(profiling.profiler.phases, {})
+        self.assertEqual(profiling.profiler.counters, {})
+
+    def test_enabled(self):
+        """ Test phases, counters and JSON dump """
+        filename = os.path.join(self.tmp, 'profile.json')
+        profiling.enable(filename=filename, interval=0)
+        for i in range(5):
+            self.assertEqual(add(i, 1), i + 1)
+        with profiling.phase('test.block'):
+            pass
+        profiling.count('test.counter', 3)
+        phases = profiling.profiler.phases
+        self.assertEqual(phases['test.add'].count, 5)
+        self.assertEqual(sum(phases['test.add'].histogram), 5)
+        self.assertEqual(phases['test.block'].count, 1)
+        self.assertLessEqual(phases['test.add'].min, phases['test.add'].max)
+        # dumped every record with interval 0
+        with open(filename) as f:
+            profile = json.load(f)
+        self.assertEqual(profile['phases']['test.add']['count'], 5)
+        profiling.dump(filename)
+        with open(filename) as f:
+            profile = json.load(f)
+        self.assertEqual(profile['counters'], {'test.counter': 3})
+        self.assertIn('test.add', profiling.summary())
@@ -9,6 +9,9 @@ from parmed.charmm import CharmmParameterSet
 import unittest
 import numpy as np
 import warnings
+import tempfile
+import shutil
+import os
 
 try:
     from simtk.openmm import app
@@ -83,6 +86,21 @@ class TestScanSet(unittest.TestCase):
         torsion = np.array([3, 6, 9, 13])
         np.testing.assert_equal(butane_scan.torsion_index[0], torsion)
 
+    def test_parse_psi4_out_mapping(self):
+        """ Tests duplicate scan points are expanded from the mapping """
+        structure = get_fun('butane.psf')
+        scan = tempfile.mkdtemp()
+        shutil.copytree(get_fun('MP2_torsion_scan/'), os.path.join(scan, 'MP2_torsion_scan'))
+        shutil.rmtree(os.path.join(scan, 'MP2_torsion_scan', '360'))
+        mapping = {'only_one_scan/360': {'source': 'only_one_scan/0', 'torsion': [4, 7, 10, 14], 'angle': 360}}
+        butane_scan = qmdb.parse_psi4_out(scan, structure, pattern="*.out2", mapping=mapping)
+        full_scan = qmdb.parse_psi4_out(get_fun('MP2_torsion_scan/'), structure, pattern="*.out2")
+        self.assertEqual(butane_scan.n_frames, 14)
+        np.testing.assert_equal(butane_scan.angles, full_scan.angles)
+        np.testing.assert_equal(butane_scan.xyz[-1], butane_scan.xyz[0])
+        self.assertEqual(butane_scan.qm_energy[-1], butane_scan.qm_energy[0])
+        shutil.rmtree(scan)
+
     def test_remove_nonoptimized(self):
         """ Test remove non_optimized structures """
         structure = get_fun('butane.psf')
@@ -40,5 +40,20 @@ class TestQmscan(unittest.TestCase):
         compare_content = open(get_fun('butane_10_7_4_3_0.dat')).read()
         self.assertEqual(contents, compare_content)
 
+    def test_generate_inputs(self):
+        """ Tests batched input generation for a scan tree """
+        root = tempfile.mkdtemp()
+        shutil.copytree(get_fun('torsion_scan'), os.path.join(root, 'torsion_scan'),
+                        ignore=shutil.ignore_patterns('*.dat'))
+        input_files = qmscan.generate_scan_inputs(os.path.join(root, 'torsion_scan'), 'butane', ['MP2'],
+                                                  ['aug-cc-pvtz'], symmetry='C1', threads=2)
+        self.assertEqual(len(input_files), 4)
+
+        contents = open(os.path.join(root, 'torsion_scan/10_7_4_3/0/butane_10_7_4_3_0.dat')).read()
+        compare_content = open(get_fun('butane_10_7_4_3_0.dat')).read()
+        self.assertEqual(contents, compare_content)
+
+        shutil.rmtree(root)
+
 
 #
@@ -0,0 +1,117 @@
+""" Test checkpointing and resuming of TorsionFitMCMC """
+
+import os
+import types
+import unittest
+import sqlite3
+import pymc
+from pymc.examples import disaster_model
+from torsionfit.backends import sqlite_plus, netcdf4
+from torsionfit.sampler import TorsionFitMCMC, resume
+from torsionfit.utils import RunLog
+from torsionfit.summaries import get_summaries
+from numpy.testing import assert_almost_equal
+
+testdir = 'testresults'
+try:
+    os.mkdir(testdir)
+except:
+    pass
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dbname = os.path.join(testdir, 'Disaster_checkpoint.sqlite')
+        sampler = TorsionFitMCMC(disaster_model, db=sqlite_plus, dbname=self.dbname, dbmode='w', summaries=True)
+        sampler.sample(100, save_interval=10, progress_bar=False)
+        sampler.db.close()
+
+    def test_one_state_per_chain(self):
+        """ Tests that checkpoints replace the state of the chain """
+        cur = sqlite3.connect(self.dbname).cursor()
+        cur.execute('SELECT chain FROM state')
+        self.assertEqual(cur.fetchall(), [(0,)])
+
+    def test_checkpoint_trace_length(self):
+        """ Tests that the checkpoint records the length of the chain """
+        db = sqlite_plus.load(self.dbname)
+        self.assertEqual(db.getstate()['checkpoint']['trace_length'], 100)
+        db.close()
+
+    def test_summaries(self):
+        """ Tests streaming summaries saved with the checkpoint match the trace """
+        db = sqlite_plus.load(self.dbname)
+        summaries = get_summaries(db)
+        trace = db.trace('early_mean')[:]
+        self.assertEqual(summaries['early_mean']['n'], len(trace))
+        assert_almost_equal(summaries['early_mean']['mean'], trace.mean())
+        assert_almost_equal(summaries['early_mean']['variance'], trace.var(ddof=1))
+        db.close()
+
+    def test_resume(self):
+        """ Tests that a chain is continued from an intermediate checkpoint """
+        db = sqlite_plus.load(self.dbname)
+        state = db.getstate()
+        state['sampler']['_current_iter'] = 49
+        state['checkpoint']['trace_length'] = 50
+        db.savestate(state)
+
+        sampler = TorsionFitMCMC(disaster_model, db=db)
+        remaining = sampler.resume()
+        self.assertEqual(remaining, 50)
+        self.assertEqual(sampler.db.chains, 1)
+        self.assertEqual(len(sampler.trace('early_mean')[:]), 100)
+        sampler.db.close()
+
+    def test_resume_run_log(self):
+        """ Tests a resumed chain keeps writing the run log """
+        db = sqlite_plus.load(self.dbname)
+        state = db.getstate()
+        state['sampler']['_current_iter'] = 49
+        state['checkpoint']['trace_length'] = 50
+        db.savestate(state)
+        db.close()
+
+        filename = os.path.join(testdir, 'Disaster_checkpoint.log.jsonl')
+        if os.path.exists(filename):
+            os.remove(filename)
+        run_log = RunLog(interval=10, filename=filename)
+        model = types.SimpleNamespace(pymc_parameters=disaster_model)
+        sampler = resume(model, self.dbname, sampler_kwargs={'run_log': run_log})
+        self.assertIs(sampler.run_log, run_log)
+        self.assertEqual(len(open(filename).readlines()), 5)
+        sampler.db.close()
+
+
+class TestNetcdf4Checkpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dbname = os.path.join(testdir, 'Disaster_checkpoint.nc')
+        sampler = TorsionFitMCMC(disaster_model, db=netcdf4, dbname=self.dbname, dbmode='w')
+        sampler.sample(100, save_interval=10, progress_bar=False)
+        sampler.db.close()
+
+    def test_resume(self):
+        """ Tests samples after the checkpoint are dropped when the resumed run stops before overwriting them """
+        db = netcdf4.load(self.dbname)
+        state = db.getstate()
+        state['sampler']['_current_iter'] = 49
+        state['sampler']['_iter'] = 80
+        state['checkpoint']['trace_length'] = 50
+        db.savestate(state)
+
+        sampler = TorsionFitMCMC(disaster_model, db=db)
+        self.assertEqual(sampler.resume(), 30)
+        self.assertEqual(sampler.db.chains, 1)
+        self.assertEqual(sampler.db.trace('early_mean').length(), 80)
+        self.assertEqual(len(sampler.trace('early_mean')[:]), 80)
+        sampler.db.close()
+
+        db = netcdf4.load(self.dbname)
+        self.assertEqual(len(db.trace('early_mean')[:]), 80)
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
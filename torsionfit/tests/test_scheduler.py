@@ -0,0 +1,101 @@
+""" Tests local psi4 job scheduler """
+
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+import stat
+from torsionfit.qmscan.scheduler import JobLedger, Scheduler, DONE, FAILED
+
+# Fake psi4: writes a finished output. Inputs containing 'fail' fail on every attempt and inputs containing 'flaky'
+# fail on the first attempt.
+FAKE_PSI4 = """#!{python}
+import sys, os
+input_file, output_file, threads = sys.argv[1], sys.argv[3], sys.argv[5]
+with open(input_file + '.calls', 'a') as f:
+    f.write(threads + '\\n')
+calls = len(open(input_file + '.calls').readlines())
+if 'fail' in input_file or ('flaky' in input_file and calls == 1):
+    sys.stderr.write('error')
+    sys.exit(1)
+with open(output_file, 'w') as f:
+    f.write('*** Psi4 exiting successfully. Buy a developer a beer!')
+"""
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.psi4 = os.path.join(self.tmp, 'psi4')
+        with open(self.psi4, 'w') as f:
+            f.write(FAKE_PSI4.format(python=sys.executable))
+        os.chmod(self.psi4, os.stat(self.psi4).st_mode | stat.S_IEXEC)
+        self.scan = os.path.join(self.tmp, 'scan')
+        for i in range(4):
+            os.makedirs(os.path.join(self.scan, str(i * 30)))
+            open(os.path.join(self.scan, str(i * 30), 'butane_{}.dat'.format(i * 30)), 'w').close()
+        self.ledger = JobLedger(os.path.join(self.tmp, 'jobs.sqlite'))
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.tmp)
+
+    def scheduler(self, **kwargs):
+        return Scheduler(self.ledger, cores=4, threads=2, psi4=self.psi4, poll_interval=0.01, backoff=0, **kwargs)
+
+    def test_run(self):
+        """ Tests all jobs run once with the requested threads """
+        scheduler = self.scheduler()
+        self.assertEqual(scheduler.submit(self.scan), 4)
+        self.assertEqual(scheduler.run(), {DONE: 4})
+        calls = open(os.path.join(self.scan, '0', 'butane_0.dat.calls')).read()
+        self.assertEqual(calls, '2\n')
+
+    def test_skip_completed(self):
+        """ Tests rerunning a scan only runs missing points """
+        with open(os.path.join(self.scan, '0', 'butane_0.out'), 'w') as f:
+            f.write('*** Psi4 exiting successfully. Buy a developer a beer!')
+        scheduler = self.scheduler()
+        scheduler.submit(self.scan)
+        scheduler.run()
+        self.assertFalse(os.path.exists(os.path.join(self.scan, '0', 'butane_0.dat.calls')))
+
+        # Resubmitting does not add or rerun jobs
+        self.assertEqual(scheduler.submit(self.scan), 0)
+        scheduler.run()
+        calls = open(os.path.join(self.scan, '30', 'butane_30.dat.calls')).readlines()
+        self.assertEqual(len(calls), 1)
+
+    def test_retry(self):
+        """ Tests failed jobs are retried and then marked failed """
+        open(os.path.join(self.scan, '0', 'flaky.dat'), 'w').close()
+        open(os.path.join(self.scan, '0', 'fail.dat'), 'w').close()
+        scheduler = self.scheduler(max_retries=2)
+        scheduler.submit(self.scan)
+        self.assertEqual(scheduler.run(), {DONE: 5, FAILED: 1})
+        failed = self.ledger.jobs(FAILED)[0]
+        self.assertEqual(failed['attempts'], 3)
+        self.assertEqual(failed['message'], 'error')
+        self.assertEqual(len(open(os.path.join(self.scan, '0', 'flaky.dat.calls')).readlines()), 2)
+
+        # Rerunning retries the failed job unless retry_failed is False
+        self.assertEqual(self.scheduler(max_retries=2, retry_failed=False).run(), {DONE: 5, FAILED: 1})
+        self.assertEqual(len(open(os.path.join(self.scan, '0', 'fail.dat.calls')).readlines()), 3)
+        self.assertEqual(self.scheduler(max_retries=2).run(), {DONE: 5, FAILED: 1})
+        self.assertEqual(len(open(os.path.join(self.scan, '0', 'fail.dat.calls')).readlines()), 6)
+        self.assertEqual(self.ledger.jobs(FAILED)[0]['attempts'], 3)
+
+    def test_callbacks(self):
+        """ Tests callbacks are called with every finished job """
+        finished = []
+        scheduler = self.scheduler(callbacks=[lambda job: finished.append(job['output'])])
+        scheduler.submit(self.scan)
+        scheduler.run()
+        self.assertEqual(len(finished), 4)
+        self.assertTrue(all(os.path.exists(output) for output in finished))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+""" Tests sharing QMDataBase arrays in memory mapped files """
+
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+from torsionfit import benchmarks
+from torsionfit.database import shared
+
+
+class TestShared(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db, self.param = benchmarks.synthetic_database(n_atoms=8, n_frames=6, n_types=2)
+        self.to_optimize = benchmarks.to_optimize(self.db.structure)
+        self.db.build_phis(to_optimize=self.to_optimize)
+        self.db.compute_energy(self.param)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_share(self):
+        """ Test arrays are replaced by read-only memory maps with the same values """
+        xyz = self.db.xyz.copy()
+        phis = {t: p.copy() for t, p in self.db.phis.items()}
+        qm_energy = self.db.qm_energy._value.copy()
+        mm_energy = self.db.mm_energy._value.copy()
+        directory = os.path.join(self.tmp, 'shared')
+        frags = shared.share(self.db, directory)
+
+        db = frags[0]
+        self.assertIsInstance(db.xyz, np.memmap)
+        self.assertFalse(db.xyz.flags.writeable)
+        np.testing.assert_array_equal(db.xyz, xyz)
+        np.testing.assert_array_equal(db.qm_energy._value, qm_energy)
+        for t in phis:
+            self.assertIsInstance(db.phis[t], np.memmap)
+            np.testing.assert_array_equal(db.phis[t], phis[t])
+            np.testing.assert_allclose(db.inner_sum[t], shared.fourier_inner_sum(phis)[t])
+        self.assertIsNone(db.context)
+
+        # energies are the same with a new context
+        db.compute_energy(self.param)
+        np.testing.assert_allclose(db.mm_energy._value, mm_energy, atol=1e-4)
+
+        loaded = shared.load(directory)
+        np.testing.assert_array_equal(loaded[0]['xyz'], xyz)
+        self.assertEqual(list(loaded[0]['inner_sum']), list(db.inner_sum))
+        shared.release(directory)
+        self.assertFalse(os.path.exists(directory))
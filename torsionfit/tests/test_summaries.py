@@ -0,0 +1,125 @@
+""" Test streaming posterior summaries """
+
+import unittest
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_array_almost_equal
+from torsionfit.summaries import RunningMoments, P2Quantile, InclusionCounts, StreamingSummaries
+
+
+class Variable(object):
+    """ Stand-in for a pymc variable """
+
+    def __init__(self, name, value):
+        self.__name__ = name
+        self.value = value
+
+
+class TestAccumulators(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.samples = np.random.normal(loc=2.0, scale=3.0, size=(5000, 6))
+
+    def test_running_moments(self):
+        """ Tests Welford mean and variance match numpy """
+        moments = RunningMoments()
+        for sample in self.samples:
+            moments.update(sample)
+        assert_array_almost_equal(moments.mean, self.samples.mean(axis=0))
+        assert_array_almost_equal(moments.variance, self.samples.var(axis=0, ddof=1))
+
+    def test_running_moments_state(self):
+        """ Tests accumulators continue from saved state """
+        moments = RunningMoments()
+        for sample in self.samples[:100]:
+            moments.update(sample)
+        moments = RunningMoments.from_state(moments.get_state())
+        for sample in self.samples[100:]:
+            moments.update(sample)
+        assert_array_almost_equal(moments.mean, self.samples.mean(axis=0))
+
+    def test_p2_quantile(self):
+        """ Tests P-square estimates are close to the exact quantiles """
+        for p in (0.025, 0.5, 0.975):
+            quantile = P2Quantile(p)
+            for sample in self.samples:
+                quantile.update(sample)
+            exact = np.percentile(self.samples, 100 * p, axis=0)
+            self.assertLess(np.abs(quantile.value - exact).max(), 0.2)
+
+    def test_p2_quantiles(self):
+        """ Tests several quantiles estimated at once match single quantile estimates """
+        quantiles = P2Quantile((0.025, 0.5, 0.975))
+        single = [P2Quantile(p) for p in (0.025, 0.5, 0.975)]
+        for sample in self.samples:
+            quantiles.update(sample)
+            for quantile in single:
+                quantile.update(sample)
+        self.assertEqual(quantiles.value.shape, (3, 6))
+        for i, quantile in enumerate(single):
+            assert_array_almost_equal(quantiles.value[i], quantile.value)
+
+    def test_p2_quantile_few_samples(self):
+        """ Tests quantiles with less than 5 samples are exact """
+        quantile = P2Quantile(0.5)
+        for sample in (1.0, 3.0, 2.0):
+            quantile.update(sample)
+        assert_almost_equal(quantile.value, 2.0)
+
+    def test_inclusion_counts(self):
+        """ Tests multiplicity inclusion frequencies """
+        inclusion = InclusionCounts()
+        for bitstring in (1, 3, 12, 63):
+            inclusion.update(bitstring)
+        frequencies = inclusion.frequencies
+        self.assertEqual(frequencies['1'], 0.75)
+        self.assertEqual(frequencies['3'], 0.5)
+        self.assertEqual(frequencies['6'], 0.25)
+
+
+
+class TestStreamingSummaries(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.samples = np.random.normal(size=(2000, 7))
+        self.bitstrings = np.random.randint(0, 64, size=(2000, 2))
+        self.variables = [Variable('a_K', np.zeros(6)), Variable('log_sigma', 0.0),
+                          Variable('a_multiplicity_bitstring', 0), Variable('b_multiplicity_bitstring', 0)]
+
+    def sample(self, summaries, samples, bitstrings):
+        for sample, bitstring in zip(samples, bitstrings):
+            self.variables[0].value = sample[:6]
+            self.variables[1].value = sample[6]
+            self.variables[2].value, self.variables[3].value = bitstring
+            summaries.update()
+
+    def test_summary(self):
+        """ Tests packed summaries of every variable match the samples and continue from saved state """
+        summaries = StreamingSummaries(self.variables)
+        self.sample(summaries, self.samples[:500], self.bitstrings[:500])
+        state = summaries.get_state()
+        summaries = StreamingSummaries(self.variables)
+        summaries.set_state(state)
+        self.sample(summaries, self.samples[500:], self.bitstrings[500:])
+        summary = summaries.summary()
+        self.assertEqual(summary['a_K']['n'], 2000)
+        self.assertEqual(summary['a_K']['mean'].shape, (6,))
+        assert_array_almost_equal(summary['a_K']['mean'], self.samples[:, :6].mean(axis=0))
+        assert_almost_equal(summary['log_sigma']['variance'], self.samples[:, 6].var(ddof=1))
+        self.assertLess(abs(summary['log_sigma']['quantiles'][0.5] - np.median(self.samples[:, 6])), 0.1)
+        self.assertEqual(summary['b_multiplicity_bitstring']['inclusion']['1'],
+                         (self.bitstrings[:, 1] & 1).mean())
+
+    def test_interval(self):
+        """ Tests summaries are only updated every interval calls """
+        summaries = StreamingSummaries(self.variables, interval=10)
+        self.sample(summaries, self.samples, self.bitstrings)
+        summary = summaries.summary()
+        self.assertEqual(summary['log_sigma']['n'], 200)
+        assert_almost_equal(summary['log_sigma']['mean'], self.samples[::10, 6].mean())
+        self.assertEqual(summary['a_multiplicity_bitstring']['n'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+""" Tests numpy torsion drive """
+
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+import mdtraj as md
+from torsionfit.tests.utils import get_fun
+import torsionfit.qmscan.torsion_drive as torsion_drive
+
+
+class TestTorsionDrive(unittest.TestCase):
+
+    def setUp(self):
+        self.traj = md.load(get_fun('butane.pdb'))
+        self.elements = [atom.element.symbol for atom in self.traj.topology.atoms]
+        self.bonds = torsion_drive.guess_bonds(self.traj.xyz[0], self.elements)
+        self.neighbors = torsion_drive._neighbors(self.traj.n_atoms, self.bonds)
+
+    def test_rotatable_torsions(self):
+        """ Tests finding one torsion per rotatable bond """
+        torsions = torsion_drive.rotatable_torsions(self.elements, self.bonds)
+        self.assertEqual(len(torsions), 3)
+        self.assertIn((3, 6, 9, 13), torsions)
+
+    def test_ring(self):
+        """ Tests bonds in rings can't be driven """
+        neighbors = torsion_drive._neighbors(4, [(0, 1), (1, 2), (2, 3), (3, 0)])
+        self.assertIsNone(torsion_drive.moving_atoms(neighbors, (0, 1, 2, 3)))
+
+    def test_drive_torsion(self):
+        """ Tests driven geometries have the right dihedral and unchanged bonds """
+        torsion = (9, 6, 3, 2)
+        moving = torsion_drive.moving_atoms(self.neighbors, torsion)
+        np.testing.assert_array_equal(moving, [0, 1, 2, 3])
+        angles = [0, 30, 90, 180, 270]
+        driven = torsion_drive.drive_torsion(self.traj.xyz[0], torsion, moving, angles)
+        self.assertEqual(driven.shape, (5, 14, 3))
+
+        dihedrals = np.degrees(md.compute_dihedrals(md.Trajectory(driven, self.traj.topology), [torsion]))
+        np.testing.assert_almost_equal((dihedrals.ravel() - angles + 180) % 360 - 180, 0, decimal=3)
+        i, j = np.array(self.bonds).T
+        lengths = np.linalg.norm(driven[:, i] - driven[:, j], axis=-1)
+        np.testing.assert_almost_equal(lengths - lengths[0], 0, decimal=6)
+
+    def test_write_torsion_drive(self):
+        """ Tests writing scan tree """
+        path = tempfile.mkdtemp()
+        files = torsion_drive.write_torsion_drive(get_fun('butane.pdb'), path, 'butane', ['MP2'], ['aug-cc-pvtz'],
+                                                  torsions=[(9, 6, 3, 2)], interval=90, symmetry='C1')
+        self.assertEqual(len(files), 4)
+        pdb = os.path.join(path, '10_7_4_3', '90', 'butane_10_7_4_3_90.pdb')
+        self.assertAlmostEqual(np.degrees(md.compute_dihedrals(md.load(pdb), [[9, 6, 3, 2]]))[0, 0], 90, places=1)
+        contents = open(os.path.join(path, '10_7_4_3', '0', 'butane_10_7_4_3_0.dat')).read()
+        self.assertIn('10 7 4 3 0.001', contents)
+        shutil.rmtree(path)
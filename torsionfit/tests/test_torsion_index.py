@@ -0,0 +1,33 @@
+""" Tests index from torsion types to fragments """
+
+import unittest
+from torsionfit import benchmarks
+from torsionfit.database.torsion_index import TorsionIndex, canonical
+
+
+class TestTorsionIndex(unittest.TestCase):
+
+    def test_index(self):
+        """ Test fragments, frames and orientation of torsions """
+        frags = []
+        to_optimize = []
+        for i, n_atoms in enumerate([5, 6]):
+            db, param = benchmarks.synthetic_database(n_atoms=n_atoms, n_frames=3 + i, n_types=2,
+                                                      resname='SY{}'.format(i))
+            frags.append(db)
+            to_optimize.extend(t for t in benchmarks.to_optimize(db.structure) if t not in to_optimize)
+        index = TorsionIndex(frags, to_optimize)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.n_frames, 7)
+        self.assertEqual(index.frames(1), slice(3, 7))
+        t = ('CG321', 'CX1', 'CG321', 'CG331')
+        self.assertEqual(index.fragments[t], [0, 1])
+        self.assertEqual(index.torsions_of[0], [t])
+        self.assertEqual(index.affected([('CX1', 'CG321', 'CX1', 'CG321')]), [1])
+        self.assertEqual(index.affected([('CG331', 'CG321', 'CX1', 'CG321')]), [0, 1])
+        self.assertEqual(index.affected([('CG331', 'CG321', 'CG321', 'CG331')]), [])
+        self.assertEqual(canonical(tuple(reversed(t))), canonical(t))
+
+        # torsions from phis
+        index = TorsionIndex(frags, [t], torsions=[[], [t]])
+        self.assertEqual(index.fragments[t], [1])
@@ -0,0 +1,78 @@
+""" Test utility functions """
+
+import unittest
+import tempfile
+import logging
+import shutil
+import json
+import os
+import numpy as np
+from numpy.testing import assert_array_equal
+from torsionfit import utils
+from torsionfit.utils import decode_multiplicity_bitstring, logger, RunLog
+
+
+class TestMultiplicityBitstring(unittest.TestCase):
+
+    def test_decode(self):
+        """ Tests decoding multiplicity bitstrings into on/off traces """
+        decoded = decode_multiplicity_bitstring(np.array([0., 1., 12., 63.]))
+        assert_array_equal(decoded, [[0, 0, 0, 0, 0],
+                                     [1, 0, 0, 0, 0],
+                                     [0, 0, 1, 1, 0],
+                                     [1, 1, 1, 1, 1]])
+        self.assertEqual(decoded.dtype, np.uint8)
+
+    def test_decode_n5(self):
+        """ Tests decoding multiplicity 5 """
+        decoded = decode_multiplicity_bitstring([16, 32], multiplicities=(1, 2, 3, 4, 5, 6))
+        assert_array_equal(decoded, [[0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 1]])
+
+    def test_table_cache(self):
+        """ Tests multiplicity tables only read samples added since the last call """
+        from torsionfit.tests.test_diagnostics import RamDB
+        bitstrings = np.random.RandomState(0).randint(0, 64, size=50).astype(float)
+        db = RamDB({'A_B_C_D_multiplicity_bitstring': bitstrings[:30]})
+        table = utils.MultiplicityTable(db, torsions=['A_B_C_D'])
+        assert_array_equal(table.decode('A_B_C_D', burn=5), decode_multiplicity_bitstring(bitstrings[5:30]))
+        self.assertEqual(db.reads, 1)
+        table.decode('A_B_C_D', burn=5)
+        self.assertEqual(db.reads, 1)
+
+        db.traces['A_B_C_D_multiplicity_bitstring'] = bitstrings
+        grown = table.decode('A_B_C_D', burn=5)
+        self.assertEqual(db.reads, 2)
+        assert_array_equal(grown, decode_multiplicity_bitstring(bitstrings[5:]))
+        assert_array_equal(table._cache[('A_B_C_D', 5)][1],
+                           np.bincount(bitstrings[5:].astype(int), minlength=64))
+
+
+class TestLogging(unittest.TestCase):
+
+    def tearDown(self):
+        utils.verbose = False
+
+    def test_logger_cache(self):
+        """ Tests logger is cached and follows verbose """
+        self.assertIs(logger(), logger())
+        self.assertFalse(logger().isEnabledFor(logging.DEBUG))
+        utils.verbose = True
+        self.assertTrue(logger().isEnabledFor(logging.DEBUG))
+        self.assertEqual(logger().handlers[0].level, logging.DEBUG)
+
+    def test_run_log(self):
+        """ Tests run log aggregates every interval steps """
+        tmp = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp, 'run.jsonl')
+            run_log = RunLog(interval=4, filename=filename)
+            for i in range(10):
+                run_log.step(logp=float(i))
+            run_log.emit()
+            self.assertEqual([r['step'] for r in run_log.records], [4, 8, 10])
+            self.assertEqual([r['logp'] for r in run_log.records], [1.5, 5.5, 8.5])
+            with open(filename) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(records, run_log.records)
+        finally:
+            shutil.rmtree(tmp)
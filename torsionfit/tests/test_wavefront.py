@@ -0,0 +1,89 @@
+""" Tests wavefront torsion drive """
+
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+import stat
+from torsionfit.tests.utils import get_fun
+from torsionfit.qmscan.wavefront import WavefrontScan
+from torsionfit.qmscan.scheduler import JobLedger, Scheduler, DONE
+from torsionfit.qmscan.torsion_scan import optimized_geometry
+
+# Fake psi4: writes the geometry of the input shifted by 1 Angstrom along x as the final optimized geometry.
+FAKE_PSI4 = """#!{python}
+import sys
+input_file, output_file = sys.argv[1], sys.argv[3]
+geometry = []
+for line in open(input_file):
+    fields = line.split()
+    if len(fields) == 4 and fields[0].isalpha():
+        geometry.append('{{}} {{:.6f}} {{}} {{}}'.format(fields[0], float(fields[1]) + 1, fields[2], fields[3]))
+with open(output_file, 'w') as f:
+    f.write('Final optimized geometry and variables:\\n\\n')
+    f.write('    Molecular point group: c1\\n\\n')
+    f.write('\\n'.join(geometry) + '\\n\\n')
+    f.write('*** Psi4 exiting successfully. Buy a developer a beer!')
+"""
+
+
+class TestWavefront(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.psi4 = os.path.join(self.tmp, 'psi4')
+        with open(self.psi4, 'w') as f:
+            f.write(FAKE_PSI4.format(python=sys.executable))
+        os.chmod(self.psi4, os.stat(self.psi4).st_mode | stat.S_IEXEC)
+        self.scan = os.path.join(self.tmp, 'torsion_scan')
+        shutil.copytree(get_fun('torsion_scan'), self.scan, ignore=shutil.ignore_patterns('*.dat'))
+        self.ledger = JobLedger(os.path.join(self.tmp, 'jobs.sqlite'))
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.tmp)
+
+    def test_wavefront(self):
+        """ Tests every point is seeded from the optimized geometry of its neighbor """
+        scheduler = Scheduler(self.ledger, cores=2, threads=1, psi4=self.psi4, poll_interval=0.01)
+        wavefront = WavefrontScan(self.scan, 'butane', ['MP2'], ['aug-cc-pvtz'], scheduler, start=0, symmetry='C1')
+        self.assertEqual(wavefront.neighbors('10_7_4_3', 0), [30])
+        self.assertEqual(wavefront.neighbors('10_7_4_3', 30), [0, 60])
+        self.assertEqual(wavefront.run(), {DONE: 4})
+
+        # Every step away from the start adds 1 Angstrom along x
+        start = optimized_geometry(os.path.join(self.scan, '10_7_4_3', '0', 'butane_10_7_4_3_0.out'))[1]
+        for i, angle in enumerate((30, 60, 90)):
+            out_file = os.path.join(self.scan, '10_7_4_3', str(angle), 'butane_10_7_4_3_{}.out'.format(angle))
+            elements, xyz = optimized_geometry(out_file)
+            self.assertEqual(len(elements), 14)
+            self.assertAlmostEqual((xyz - start)[:, 0].max(), i + 1, places=2)
+
+        contents = open(os.path.join(self.scan, '10_7_4_3', '30', 'butane_10_7_4_3_30.dat')).read()
+        self.assertIn('10 7 4 3 30', contents)
+
+    def test_resume(self):
+        """ Tests a restarted scan only runs missing points """
+        scheduler = Scheduler(self.ledger, cores=2, threads=1, psi4=self.psi4, poll_interval=0.01)
+        WavefrontScan(self.scan, 'butane', ['MP2'], ['aug-cc-pvtz'], scheduler, start=0).run()
+        out_file = os.path.join(self.scan, '10_7_4_3', '90', 'butane_10_7_4_3_90.out')
+        mtime = os.path.getmtime(out_file)
+
+        scheduler = Scheduler(self.ledger, cores=2, threads=1, psi4=self.psi4, poll_interval=0.01)
+        self.assertEqual(WavefrontScan(self.scan, 'butane', ['MP2'], ['aug-cc-pvtz'], scheduler, start=0).run(),
+                         {DONE: 4})
+        self.assertEqual(os.path.getmtime(out_file), mtime)
+
+    def test_existing_inputs(self):
+        """ Tests input files that are not in the ledger are seeded and run """
+        shutil.rmtree(self.scan)
+        shutil.copytree(get_fun('torsion_scan'), self.scan)
+        scheduler = Scheduler(self.ledger, cores=2, threads=1, psi4=self.psi4, poll_interval=0.01)
+        wavefront = WavefrontScan(self.scan, 'butane', ['MP2'], ['aug-cc-pvtz'], scheduler, start=0, symmetry='C1')
+        self.assertEqual(wavefront.dispatched, set())
+        self.assertEqual(wavefront.run(), {DONE: 4})
+
+        start = optimized_geometry(os.path.join(self.scan, '10_7_4_3', '0', 'butane_10_7_4_3_0.out'))[1]
+        xyz = optimized_geometry(os.path.join(self.scan, '10_7_4_3', '90', 'butane_10_7_4_3_90.out'))[1]
+        self.assertAlmostEqual((xyz - start)[:, 0].max(), 3, places=2)
@@ -2,9 +2,12 @@ __author__ = 'Chaya D. Stern'
 
 import numpy as np
 import logging
+import json
+import time
 import sys
 
 verbose = False
+_loggers = {}
 
 def RMSE(scanSet, db):
     '''
@@ -22,25 +25,140 @@ def RMSE(scanSet, db):
     return errors
 
 
+def decode_multiplicity_bitstring(bitstrings, multiplicities=(1, 2, 3, 4, 6)):
+    """
+    Decode a multiplicity bitstring trace into on/off traces for every multiplicity term.
+
+    :param bitstrings: array of multiplicity bitstrings (n_samples)
+    :param multiplicities: tuple of multiplicity terms to decode. Default (1, 2, 3, 4, 6)
+    :return: np.array (n_samples, n_multiplicities) of uint8. 1 when the multiplicity term is on and 0 when it's off
+    """
+    bitstrings = np.asarray(bitstrings).astype(np.int64).reshape(-1)
+    bitmasks = np.left_shift(1, np.asarray(multiplicities, dtype=np.int64) - 1)
+    return ((bitstrings[:, np.newaxis] & bitmasks) != 0).astype(np.uint8)
+
+
+def trace_length(trace):
+    """
+    Number of samples in a trace without reading the samples when the backend can count them (Trace.length of the
+    sqlite_plus and netcdf4 backends)
+
+    :param trace: pymc trace (db.trace(name)) or array
+    :return: int
+    """
+    if hasattr(trace, 'length'):
+        return trace.length(getattr(trace, '_chain', -1))
+    return len(trace)
+
+
+class MultiplicityTable(object):
+    """
+    Marginal inclusion probabilities and model frequencies of multiplicity terms for all sampled torsions.
+
+    Decoded traces are cached for every torsion. The length of the trace is checked without reading it and only the
+    samples added since the last call are read and decoded.
+
+    Attributes
+    ----------
+    db: pymc.database or pymc.sampler
+    multiplicities: tuple of multiplicity terms
+    torsions: list of torsion names (A_B_C_D)
+    """
+
+    def __init__(self, db, torsions=None, n5=False):
+        """
+
+        Parameters
+        ----------
+        db : pymc.database (can also be pymc.sampler)
+        torsions : list of str
+            names of torsions (A_B_C_D). Default None will use all multiplicity bitstrings in database
+        n5 : bool
+            Flag if multiplicity of 5 was sampled. Default False
+        """
+        self.db = db
+        self.multiplicities = (1, 2, 3, 4, 5, 6) if n5 else (1, 2, 3, 4, 6)
+        if torsions is None:
+            torsions = set()
+            for names in getattr(db, 'db', db).trace_names:
+                for name in names:
+                    if name.endswith('_multiplicity_bitstring'):
+                        torsions.add(name[:-len('_multiplicity_bitstring')])
+            torsions = sorted(torsions)
+        self.torsions = list(torsions)
+        self._cache = {}
+
+    def decode(self, torsion, burn=0):
+        """
+        Returns decoded multiplicity traces (n_samples, n_multiplicities) for torsion A_B_C_D
+        """
+        trace = self.db.trace(torsion + '_multiplicity_bitstring')
+        n_samples = max(trace_length(trace) - burn, 0)
+        key = (torsion, burn)
+        cached = self._cache.get(key)
+        if cached is None or len(cached[0]) > n_samples:
+            bitstrings = np.asarray(trace[burn:]).astype(np.int64).reshape(-1)
+            self._cache[key] = (decode_multiplicity_bitstring(bitstrings, self.multiplicities),
+                                np.bincount(bitstrings, minlength=64))
+        elif len(cached[0]) < n_samples:
+            # only read and decode the samples added since the last call
+            bitstrings = np.asarray(trace[burn + len(cached[0]):]).astype(np.int64).reshape(-1)
+            self._cache[key] = (np.concatenate((cached[0], decode_multiplicity_bitstring(bitstrings,
+                                                                                         self.multiplicities))),
+                                cached[1] + np.bincount(bitstrings, minlength=64))
+        return self._cache[key][0]
+
+    def tables(self, burn=0):
+        """
+        Returns marginal inclusion probabilities and model frequencies for all torsions
+
+        :param burn: int. number of samples to skip
+        :return: inclusion: np.array (n_torsions, n_multiplicities) of marginal probability that a term is on
+                 frequencies: np.array (n_torsions, 64) frequency of every multiplicity bitstring (model)
+        """
+        inclusion = np.zeros((len(self.torsions), len(self.multiplicities)))
+        frequencies = np.zeros((len(self.torsions), 64))
+        for i, torsion in enumerate(self.torsions):
+            decoded = self.decode(torsion, burn)
+            if len(decoded) == 0:
+                continue
+            inclusion[i] = decoded.mean(0)
+            frequencies[i] = self._cache[(torsion, burn)][1] / float(len(decoded))
+        return inclusion, frequencies
+
+
 def logger(name='torsionFit', pattern='%(asctime)s %(levelname)s %(name)s: %(message)s',
            date_format='%H:%M:%S', handler=logging.StreamHandler(sys.stdout)):
     """
-    Retrieves the logger instance associated to the given name
+    Retrieves the logger instance associated to the given name. The logger is cached and only reconfigured when
+    verbose changed, so it is cheap to call in loops. Check logger().isEnabledFor(logging.DEBUG) before building debug
+    messages in hot loops or pass arguments to be formatted lazily (logger().debug('sample %s', value)).
     :param name: The name of the logger instance
     :param pattern: The associated pattern
     :param date_format: The date format to be used in the pattern
     :param handler: The logging handler
     :return: The logger
     """
+    level = log_level(verbose)
+    try:
+        _logger, _level = _loggers[name]
+        if _level == level:
+            return _logger
+    except KeyError:
+        pass
     _logger = logging.getLogger(name)
-    _logger.setLevel(log_level(verbose))
+    _logger.setLevel(level)
 
     if not _logger.handlers:
         formatter = logging.Formatter(pattern, date_format)
         handler.setFormatter(formatter)
-        handler.setLevel(log_level(verbose))
+        handler.setLevel(level)
         _logger.addHandler(handler)
         _logger.propagate = False
+    else:
+        for _handler in _logger.handlers:
+            _handler.setLevel(level)
+    _loggers[name] = (_logger, level)
     return _logger
 
 
@@ -49,3 +167,70 @@ def log_level(verbose=verbose):
         return logging.DEBUG
     else:
         return logging.INFO
+
+
+class RunLog(object):
+    """
+    Aggregated progress records of a run
+
+    Values passed to step are averaged over every `interval` steps and logged as one JSON record with the step, the
+    elapsed time and the steps per second of the interval. Records are also appended to filename (one JSON record per
+    line) if it is given.
+
+    Attributes
+    ----------
+    interval: int
+    filename: str
+    records: list of dict. all emitted records
+    """
+
+    def __init__(self, interval=100, filename=None, name='torsionFit.run'):
+        """
+
+        Parameters
+        ----------
+        interval : int
+            number of steps that are aggregated into one record. Default 100
+        filename : str
+            JSON lines file to append records to. Default None only logs
+        name : str
+            name of logger. Default 'torsionFit.run'
+        """
+        self.interval = interval
+        self.filename = filename
+        self.name = name
+        self.records = []
+        self.n_steps = 0
+        self._start = self._last = time.time()
+        self._sums = {}
+        self._n = 0
+
+    def step(self, **values):
+        """
+        Add a step. Values are numbers that are averaged over the interval
+        """
+        self.n_steps += 1
+        self._n += 1
+        for key, value in values.items():
+            self._sums[key] = self._sums.get(key, 0.0) + value
+        if self._n >= self.interval:
+            self.emit()
+
+    def emit(self):
+        """ Log a record of the steps since the last record """
+        if not self._n:
+            return
+        now = time.time()
+        record = {'step': self.n_steps, 'elapsed': now - self._start,
+                  'steps_per_second': self._n / (now - self._last) if now > self._last else None}
+        for key, value in self._sums.items():
+            record[key] = value / self._n
+        self.records.append(record)
+        line = json.dumps(record, sort_keys=True)
+        logger(self.name).info(line)
+        if self.filename is not None:
+            with open(self.filename, 'a') as f:
+                f.write(line + '\n')
+        self._sums = {}
+        self._n = 0
+        self._last = now